@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from pathlib import Path
+from time import perf_counter
+from functools import partial
+import click
+from geosys.standin import StandInServer, STANDIN_ROOT
+
+# end to end panos/s of scripts/download_map_pano.py against a local
+# geosys.standin server, so the numbers do not depend on the real servers
+SCRIPTS = Path(__file__).parents[1] / 'scripts'
+
+def download_panos(srv, pids, map_type, zoom, opts=()):
+    """
+    run download_map_pano.py in a new process, returns the seconds taken
+    and its metrics snapshot
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        src = tmp / 'panos.yaml'
+        src.write_text(''.join(f'{i}: 0\n' for i in pids))
+        env = dict(os.environ, **srv.env())
+        t = perf_counter()
+        subprocess.run(
+            [sys.executable, str(SCRIPTS / 'download_map_pano.py'), str(src),
+             '-t', map_type, '-z', str(zoom), '-q', '--http_cache', '',
+             '--metrics', str(tmp / 'metrics.json'), *opts],
+            env=env, check=True)
+        t = perf_counter() - t
+        return t, json.load(open(tmp / 'metrics.json'))
+
+def count(snapshot, name, **labels):
+    return sum(i['value'] for i in snapshot['counters'] if i['name'] == name
+               and labels.items() <= i['labels'].items())
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.option('-r', '--root', default=str(STANDIN_ROOT), help='fixture dir')
+@click.option('-t', '--map_type', type=click.Choice(['qmap', 'bmap']),
+              default='qmap')
+@click.option('-z', '--zoom', default=3)
+@click.option('-f', '--fmt', type=click.Choice(['jpg', 'tiles']), default='jpg')
+@click.option('-n', '--nr', default=32, help='panos per run')
+@click.option('--latency', default=0.05, help='seconds per response')
+@click.option('--jitter', default=0.02)
+@click.option('--error_rate', default=0.)
+@click.option('--bandwidth', default=0, help='bytes/s per response')
+@click.option('-c', '--concurrency', default='8,32', help='tile requests in flight')
+@click.option('-w', '--workers', default=-1,
+              help='stitch and encode processes, -1 for the script default')
+@click.option('-o', '--out', default='', help='json file of the results')
+def main(root, map_type, zoom, fmt, nr, latency, jitter, error_rate, bandwidth,
+         concurrency, workers, out):
+    results = {}
+    opts = ['-f', fmt, '--host_rate', '1000']
+    if workers >= 0:
+        opts += ['--stitch_workers', str(workers),
+                 '--encode_workers', str(workers)]
+    with StandInServer(root, latency=latency, jitter=jitter,
+                       error_rate=error_rate, bandwidth=bandwidth,
+                       any_id=True) as srv:
+        # unknown ids are served from the fixtures, so any nr works
+        pids = [f'{map_type}{i:06d}' for i in range(nr)]
+        # renders and caches the tiles once, off the clock
+        download_panos(srv, pids, map_type, zoom, opts)
+        for c in concurrency.split(','):
+            t, snap = download_panos(
+                srv, pids, map_type, zoom,
+                opts + ['-c', c, '--host_concurrency', c])
+            res = results[c] = {
+                'seconds': t, 'panos_per_s': nr / t,
+                'panos': count(snap, 'panos_total', result='done'),
+                'requests': count(snap, 'http_requests_total'),
+                'retries': count(snap, 'http_retries_total'),
+                'bytes': count(snap, 'http_response_bytes_total'),
+            }
+            print(f"concurrency {c}: {res['panos_per_s']:.3g} panos/s, "
+                  f"{res['panos']}/{nr} done, {res['requests']} requests, "
+                  f"{res['retries']} retries, {res['bytes'] / t / 1e6:.3g} MB/s")
+
+    if out:
+        json.dump({'map_type': map_type, 'zoom': zoom, 'fmt': fmt,
+                   'workers': workers, 'nr': nr,
+                   'latency': latency, 'error_rate': error_rate,
+                   'bandwidth': bandwidth, 'results': results},
+                  open(out, 'w'), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import sys
+import json
+import time
+import platform
+import subprocess
+from pathlib import Path
+from time import perf_counter
+from functools import partial
+import numpy as np
+import click
+from geosys import __version__
+from geosys.cvt_geosys import (
+    wgs84_to_gcj02, gcj02_to_wgs84, wgs84_to_gcj02_batch, gcj02_to_wgs84_batch,
+    in_china, in_china_batch, geo_dist, geo_dist_batch,
+    ll2merc, merc2ll, ll2merc_batch, merc2ll_batch,
+    ll2merc_epsg3857, merc2ll_epsg3857,
+    ll2merc_epsg3857_batch, merc2ll_epsg3857_batch,
+    bd09mc_to_bd09, bd09_to_bd09mc, gcj02_to_bd09, bd09_to_gcj02,
+    wgs84_to_bd09mc_batch, bd09mc_to_wgs84_batch)
+from geosys.maps import qmap_ll2yx, qmap_yx2ll, qmap_ll2yx_batch, qmap_yx2ll_batch
+
+# points are drawn in this wgs84 box around china, so the gcj02 paths see
+# both sides of the border
+BOUNDS = (18, 73, 54, 135)
+ANCHOR = (39.9, 116.3)
+
+def first(fn):
+    return lambda *a: fn(*a)[0]
+
+def wgs84_to_bd09mc(y, x):
+    return bd09_to_bd09mc(*gcj02_to_bd09(*wgs84_to_gcj02(y, x)))
+
+def bd09mc_to_wgs84(y, x):
+    return gcj02_to_wgs84(*bd09_to_gcj02(*bd09mc_to_bd09(y, x)))
+
+
+# name: (scalar, batch, scalar inverse, batch inverse), a batch fn returns
+# an array of shape (2, n) or (n,), inverses map the output back to wgs84
+CASES = {
+    'wgs84_to_gcj02': (wgs84_to_gcj02, first(wgs84_to_gcj02_batch),
+                       gcj02_to_wgs84, first(gcj02_to_wgs84_batch)),
+    'gcj02_to_wgs84': (gcj02_to_wgs84, first(gcj02_to_wgs84_batch),
+                       wgs84_to_gcj02, first(wgs84_to_gcj02_batch)),
+    'wgs84_to_bd09mc': (wgs84_to_bd09mc, first(wgs84_to_bd09mc_batch),
+                        bd09mc_to_wgs84, first(bd09mc_to_wgs84_batch)),
+    'in_china': (in_china, in_china_batch, None, None),
+    'geo_dist': (partial(geo_dist, *ANCHOR), partial(geo_dist_batch, *ANCHOR),
+                 None, None),
+    'll2merc': (ll2merc, first(ll2merc_batch), merc2ll, first(merc2ll_batch)),
+    'll2merc_epsg3857': (ll2merc_epsg3857, first(ll2merc_epsg3857_batch),
+                         merc2ll_epsg3857, first(merc2ll_epsg3857_batch)),
+    'qmap_ll2yx': (qmap_ll2yx, first(qmap_ll2yx_batch),
+                   qmap_yx2ll, first(qmap_yx2ll_batch)),
+}
+
+def random_points(n, seed=0):
+    lat0, lng0, lat1, lng1 = BOUNDS
+    rng = np.random.default_rng(seed)
+    return rng.uniform(lat0, lat1, n), rng.uniform(lng0, lng1, n)
+
+def best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t = perf_counter()
+        out = fn()
+        best = min(best, perf_counter() - t)
+    return best, out
+
+def error_stats(lat, lng, out):
+    err = geo_dist_batch(lat, lng, *out)
+    return {'max_m': float(err.max()), 'p99_m': float(np.percentile(err, 99))}
+
+def run_case(name, sizes, scalar_nr, accuracy_nr, repeat, min_time=0.05):
+    fn, fn_batch, inv, inv_batch = CASES[name]
+    res = {'batch': {}}
+
+    lat, lng = random_points(scalar_nr)
+    t, out = best_time(lambda: [fn(*i) for i in zip(lat, lng)], repeat)
+    res['scalar'] = {'n': scalar_nr, 'pts_per_s': scalar_nr / t}
+    batch_out = fn_batch(lat, lng)
+    # scalar and batch paths should agree, in the units of the output
+    res['scalar_batch_max_diff'] = float(np.abs(
+        np.array(out, dtype=float).T - np.asarray(batch_out, dtype=float)).max())
+
+    for n in sizes:
+        lat, lng = random_points(n)
+        # small batches are looped for ~min_time so they are not timer noise
+        t, _ = best_time(lambda: fn_batch(lat, lng), 1)
+        loops = max(1, int(min_time / t))
+        t, _ = best_time(lambda: [fn_batch(lat, lng) for _ in range(loops)],
+                         repeat)
+        res['batch'][str(n)] = n * loops / t
+
+    if inv:
+        lat, lng = random_points(accuracy_nr)
+        res['roundtrip_batch'] = error_stats(
+            lat, lng, inv_batch(*fn_batch(lat, lng)))
+        lat, lng = lat[:scalar_nr], lng[:scalar_nr]
+        res['roundtrip_scalar'] = error_stats(
+            lat, lng, np.array([inv(*fn(*i)) for i in zip(lat, lng)]).T)
+    return res
+
+def git_rev():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(results, baseline, max_slowdown, max_err):
+    """
+    list of regressions of results against a baseline json from this script
+    """
+    bad = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        pairs = [('scalar', res['scalar']['pts_per_s'],
+                  base['scalar']['pts_per_s'])]
+        pairs += [('batch ' + n, v, base['batch'][n])
+                  for n, v in res['batch'].items() if n in base['batch']]
+        for what, v, v0 in pairs:
+            if v * max_slowdown < v0:
+                bad.append(f'{name} {what}: {v:.3g} pts/s, was {v0:.3g}')
+        for k in 'roundtrip_batch', 'roundtrip_scalar':
+            if k in res and k in base and \
+                    res[k]['max_m'] > base[k]['max_m'] + max_err:
+                bad.append('{} {}: {:.3g} m, was {:.3g}'.format(
+                    name, k, res[k]['max_m'], base[k]['max_m']))
+    return bad
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.argument('cases', nargs=-1)
+@click.option('-o', '--out', default='', help='json file of the results')
+@click.option('--max_exp', default=6, help='batch sizes are 10**0 .. 10**max_exp')
+@click.option('--scalar_nr', default=10000, help='points for scalar calls')
+@click.option('--accuracy_nr', default=100000, help='points for batch round trips')
+@click.option('-r', '--repeat', default=3)
+@click.option('-b', '--baseline', default='', help='json of an earlier run')
+@click.option('--max_slowdown', default=1.5, help='tolerated throughput ratio')
+@click.option('--max_err', default=1e-3, help='tolerated round trip error growth, m')
+def main(cases, out, max_exp, scalar_nr, accuracy_nr, repeat, baseline,
+         max_slowdown, max_err):
+    sizes = [10 ** i for i in range(max_exp + 1)]
+    results = {}
+    for name in cases or CASES:
+        res = results[name] = run_case(
+            name, sizes, scalar_nr, accuracy_nr, repeat)
+        batch = ' '.join(f'{n}:{v:.3g}' for n, v in res['batch'].items())
+        print(f"{name} scalar {res['scalar']['pts_per_s']:.3g} pts/s, "
+              f"batch pts/s {batch}")
+        for k in 'roundtrip_scalar', 'roundtrip_batch':
+            if k in res:
+                # the max is set by points whose conversion crosses the
+                # china border, so only one direction applies the offset
+                print(f"  {k} max {res[k]['max_m']:.3e} m, "
+                      f"p99 {res[k]['p99_m']:.3e} m")
+
+    if out:
+        meta = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': __version__,
+            'git': git_rev(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'sizes': sizes,
+            'bounds': BOUNDS,
+        }
+        json.dump({'meta': meta, 'results': results}, open(out, 'w'), indent=2)
+
+    if baseline:
+        bad = compare(results, json.load(open(baseline))['results'],
+                      max_slowdown, max_err)
+        if bad:
+            sys.exit('regressions against {}:\n{}'.format(baseline, '\n'.join(bad)))
+
+
+if __name__ == "__main__":
+    main()
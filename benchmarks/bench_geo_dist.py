@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+from time import perf_counter
+from functools import partial
+import numpy as np
+from geopy.distance import geodesic
+import click
+from geosys.cvt_geosys import geo_dist_batch
+
+def random_pairs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(-89, 89, (2, n))
+    lng = rng.uniform(-180, 180, (2, n))
+    return lat[0], lng[0], lat[1], lng[1]
+
+def timeit(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t = perf_counter()
+        out = fn()
+        best = min(best, perf_counter() - t)
+    return best, out
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.option('-n', '--nr', default=10000, help='number of point pairs')
+@click.option('--geopy_nr', default=2000, help='pairs measured with geopy')
+def main(nr, geopy_nr):
+    lat0, lng0, lat1, lng1 = random_pairs(nr)
+
+    t_batch, dist = timeit(lambda: geo_dist_batch(lat0, lng0, lat1, lng1))
+    t_geopy, ref = timeit(lambda: np.array([
+        geodesic(i[:2], i[2:]).meters
+        for i in zip(lat0[:geopy_nr], lng0[:geopy_nr],
+                     lat1[:geopy_nr], lng1[:geopy_nr])]), repeat=1)
+
+    print(f"geo_dist_batch {nr / t_batch:.0f} pairs/s")
+    print(f"geopy geodesic {geopy_nr / t_geopy:.0f} pairs/s")
+    print(f"max abs error {np.abs(dist[:geopy_nr] - ref).max():.3e} m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import sys
+import subprocess
+from statistics import median
+from functools import partial
+import click
+
+MODULES = [
+    'geosys.maps',
+    'geosys.utils',
+    'geosys.cvt_geosys',
+]
+
+def import_time(mod):
+    """
+    cumulative import time of mod in a fresh interpreter, in ms
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + mod],
+                       capture_output=True, text=True, check=True)
+    for line in p.stderr.splitlines()[::-1]:
+        _, _, cumulative, name = (i.strip() for i in line.replace(':', '|').split('|'))
+        if name == mod:
+            return int(cumulative) / 1000
+    raise ValueError('no import time for ' + mod)
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.argument('modules', nargs=-1)
+@click.option('-r', '--repeat', default=5)
+@click.option('--max_ms', default=0., help='fail when a median is above, 0 is off')
+def main(modules, repeat, max_ms):
+    slow = []
+    for mod in modules or MODULES:
+        t = median(import_time(mod) for _ in range(repeat))
+        print(f"{mod} {t:.1f} ms")
+        if max_ms and t > max_ms:
+            slow.append(mod)
+
+    if slow:
+        sys.exit('import slower than {} ms: {}'.format(max_ms, ' '.join(slow)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import resource
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from functools import partial
+import numpy as np
+from PIL import Image
+import click
+from geosys.pano import (
+    PANO_TILE_W, CanvasSlots, align, get_tile_grid, stitch_slot, encode_slot)
+from bench_cvt import best_time
+
+# the implementation before the shared canvas, kept as the reference
+def old_stitch_pano(contents, tile_grid, size, real_size, out_f):
+    canvas = Image.new('RGB', size)
+    for (ti, pi), content in zip(tile_grid, contents):
+        img = Image.open(BytesIO(content))
+        canvas.paste(img, (pi * PANO_TILE_W, ti * PANO_TILE_W))
+    if real_size != size:
+        canvas = canvas.crop((0, 0) + real_size)
+    canvas.save(out_f)
+    return True
+
+def make_tiles(n, seed=0):
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for _ in range(n):
+        a = rng.integers(0, 255, (16, 16, 3), np.uint8)
+        img = Image.fromarray(a).resize((PANO_TILE_W, PANO_TILE_W))
+        buf = BytesIO()
+        img.save(buf, 'JPEG', quality=90)
+        tiles.append(buf.getvalue())
+    return tiles
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.option('-z', '--zooms', default='5', help='pano width 512 * 2**z')
+@click.option('--crop', default=0.75, help='real height / aligned height')
+@click.option('-r', '--repeat', default=3)
+@click.option('--old', is_flag=True, help='time the reference instead')
+def main(zooms, crop, repeat, old):
+    # run once with and once without --old. max rss is per process, so
+    # compare memory with one zoom per run. the slot canvas is mapped, its
+    # pages count towards the rss once touched
+    with tempfile.TemporaryDirectory() as tmp:
+        out_f = Path(tmp) / 'pano.jpg'
+        for z in map(int, zooms.split(',')):
+            real_w = PANO_TILE_W * 2 ** z
+            real_h = int(real_w / 2 * crop)
+            size = align(real_w, PANO_TILE_W), align(real_h, PANO_TILE_W)
+            real_size = real_w, real_h
+            grid = get_tile_grid(*size)
+            tiles = make_tiles(len(grid))
+            with CanvasSlots(size, 1) as slots:
+                slot = slots.free.get_nowait()
+
+                def new_stitch_pano(*args):
+                    return (stitch_slot(slot, slots.shape, tiles, grid, out_f)
+                            and encode_slot(slot, slots.shape, real_size, out_f))
+                fn = old_stitch_pano if old else new_stitch_pano
+                t, _ = best_time(
+                    lambda: fn(tiles, grid, size, real_size, out_f), repeat)
+            print(f'zoom {z} {real_w}x{real_h}: {t:.3g} s/pano, '
+                  f'max rss {max_rss_mb():.0f} MB')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os
+import json
+from functools import partial
+import numpy as np
+import click
+from geosys.cvt_geosys import (
+    wgs84_to_gcj02_batch, gcj02_to_wgs84_batch, gcj02_to_wgs84_newton,
+    gcj02_to_bd09_batch, bd09mc_to_wgs84_batch)
+from bench_cvt import random_points, best_time
+
+# the pure kernel cases show the thread scaling of the C loops alone, the
+# others include the numpy in_china test
+CASES = {
+    'wgs84_to_gcj02_batch': wgs84_to_gcj02_batch,
+    'gcj02_to_wgs84_batch': gcj02_to_wgs84_batch,
+    'gcj02_to_wgs84_newton': gcj02_to_wgs84_newton,
+    'gcj02_to_bd09_batch': gcj02_to_bd09_batch,
+    'bd09mc_to_wgs84_batch': bd09mc_to_wgs84_batch,
+}
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.argument('cases', nargs=-1)
+@click.option('-n', '--nr', default=1 << 22, help='points per call')
+@click.option('-w', '--workers', default='1,2,4,8,16,32', help='thread counts')
+@click.option('-r', '--repeat', default=3)
+@click.option('-o', '--out', default='', help='json file of the results')
+def main(cases, nr, workers, repeat, out):
+    workers = [int(i) for i in workers.split(',')]
+    lat, lng = random_points(nr)
+    buf = np.empty((2, nr))
+    results = {}
+    print(f'{os.cpu_count()} cpus, {nr} points')
+    for name in cases or CASES:
+        fn = CASES[name]
+        res = results[name] = {}
+        for w in workers:
+            t, _ = best_time(lambda: fn(lat, lng, out=buf, workers=w), repeat)
+            res[w] = nr / t
+            print(f'{name} workers {w}: {nr / t:.3g} pts/s, '
+                  f'x{res[w] / res[workers[0]]:.2f}')
+
+    if out:
+        json.dump({'cpus': os.cpu_count(), 'nr': nr, 'results': results},
+                  open(out, 'w'), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import re
+from pathlib import Path
+from functools import partial
+from lxml import etree
+import click
+from geosys.utils import fix_xml_error, parse_data
+from bench_cvt import best_time
+
+cur_d = Path(__file__).parent
+
+# the implementation before the single pass one, kept as the reference
+_old_formatter = '&amp;', '&lt;', '&gt;', '&apos;', '&quot;'
+_old_re = re.compile('&....')
+def old_fix_xml_error(s):
+    for i in _old_re.findall(s):
+        if any(i.startswith(j) for j in _old_formatter):
+            continue
+        s = re.sub(i, '&amp;' + i[1:], s)
+    return s
+
+def old_parse_data(bs):
+    s = bs.decode('utf8', errors='ignore')
+    s = old_fix_xml_error(s)
+    try:
+        return etree.fromstring(s.encode())
+    except etree.XMLSyntaxError:
+        # matches with regex characters like + or . were not substituted
+        return
+
+def load_samples(d, raw_amp):
+    """
+    cached responses as bytes, raw_amp puts an unescaped & into every
+    name attribute like the live qmap answers have
+    """
+    docs = [f.read_bytes() for f in sorted(Path(d).glob('*.xml'))]
+    docs = [i for i in docs if i]
+    if raw_amp:
+        docs = [re.sub(rb'name="', b'name="A&B ', i) for i in docs]
+    return docs
+
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.option('-d', '--data', default=str(cur_d.parent / 'samples/data/pano_cache'))
+@click.option('-r', '--repeat', default=5)
+@click.option('--concat', default=20, help='docs joined into the large case')
+def main(data, repeat, concat):
+    for raw_amp in False, True:
+        docs = load_samples(data, raw_amp)
+        mb = sum(map(len, docs)) / 1e6
+        text = [i.decode() for i in docs]
+        # one large body, where re.sub per match turns quadratic
+        big = text[0][:-len('</qqsv>\n')] + ''.join(
+            i[i.index('<qqsv>') + 6:-len('</qqsv>\n')]
+            for i in text[1:concat]) + '</qqsv>\n'
+        cases = {
+            'fix_xml_error old': lambda: [old_fix_xml_error(i) for i in text],
+            'fix_xml_error new': lambda: [fix_xml_error(i) for i in docs],
+            'fix_xml_error large old': lambda: old_fix_xml_error(big),
+            'fix_xml_error large new': lambda: fix_xml_error(big),
+            'parse old': lambda: [old_parse_data(i) for i in docs],
+            'parse new': lambda: [parse_data(i) for i in docs],
+        }
+        print(f'{len(docs)} docs, {mb:.2f} MB, raw & {raw_amp}, '
+              f'large {len(big) / 1e6:.2f} MB')
+        for name, fn in cases.items():
+            t, out = best_time(fn, repeat)
+            size = len(big) / 1e6 if 'large' in name else mb
+            failed = ''
+            if name.startswith('parse'):
+                failed = f', {sum(i is None for i in out)} failed'
+            print(f'  {name} {t * 1e3:.2f} ms, {size / t:.1f} MB/s{failed}')
+        # the old fix also escaped the & of character references like &#23433;
+        broken = sum('&amp;#' in old_fix_xml_error(i) for i in text)
+        print(f'  docs with character references broken by the old fix: {broken}')
+
+
+if __name__ == "__main__":
+    main()
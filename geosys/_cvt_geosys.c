@@ -28,8 +28,13 @@
 #if !defined(_CFFI_USE_EMBEDDING) && !defined(Py_LIMITED_API)
 #  ifdef _MSC_VER
 #    if !defined(_DEBUG) && !defined(Py_DEBUG) && !defined(Py_TRACE_REFS) && !defined(Py_REF_DEBUG) && !defined(_CFFI_NO_LIMITED_API)
-#      define Py_LIMITED_API
+#      if !defined(Py_GIL_DISABLED)
+#        define Py_LIMITED_API
+#      else
+#        define Py_LIMITED_API 0x030f0000
+#      endif
 #    endif
+
 #    include <pyconfig.h>
      /* sanity-check: Py_LIMITED_API will cause crashes if any of these
         are also defined.  Normally, the Python file PC/pyconfig.h does not
@@ -49,7 +54,11 @@
 #  else
 #    include <pyconfig.h>
 #    if !defined(Py_DEBUG) && !defined(Py_TRACE_REFS) && !defined(Py_REF_DEBUG) && !defined(_CFFI_NO_LIMITED_API)
-#      define Py_LIMITED_API
+#      if !defined(Py_GIL_DISABLED)
+#        define Py_LIMITED_API
+#      else
+#        define Py_LIMITED_API 0x030f0000
+#      endif
 #    endif
 #  endif
 #endif
@@ -59,6 +68,9 @@
 extern "C" {
 #endif
 #include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+
 
 /* This part is from file 'cffi/parse_c_type.h'.  It is copied at the
    beginning of C sources generated by CFFI's ffi.set_source(). */
@@ -281,11 +293,15 @@ static int search_in_struct_unions(const struct _cffi_type_context_s *ctx,
     typedef unsigned char _Bool;
 #  endif
 # endif
+# define _cffi_float_complex_t   _Fcomplex    /* include <complex.h> for it */
+# define _cffi_double_complex_t  _Dcomplex    /* include <complex.h> for it */
 #else
 # include <stdint.h>
 # if (defined (__SVR4) && defined (__sun)) || defined(_AIX) || defined(__hpux)
 #  include <alloca.h>
 # endif
+# define _cffi_float_complex_t   float _Complex
+# define _cffi_double_complex_t  double _Complex
 #endif
 
 #ifdef __GNUC__
@@ -304,13 +320,9 @@ static int search_in_struct_unions(const struct _cffi_type_context_s *ctx,
 #ifndef PYPY_VERSION
 
 
-#if PY_MAJOR_VERSION >= 3
-# define PyInt_FromLong PyLong_FromLong
-#endif
-
 #define _cffi_from_c_double PyFloat_FromDouble
 #define _cffi_from_c_float PyFloat_FromDouble
-#define _cffi_from_c_long PyInt_FromLong
+#define _cffi_from_c_long PyLong_FromLong
 #define _cffi_from_c_ulong PyLong_FromUnsignedLong
 #define _cffi_from_c_longlong PyLong_FromLongLong
 #define _cffi_from_c_ulonglong PyLong_FromUnsignedLongLong
@@ -322,12 +334,12 @@ static int search_in_struct_unions(const struct _cffi_type_context_s *ctx,
 #define _cffi_from_c_int(x, type)                                        \
     (((type)-1) > 0 ? /* unsigned */                                     \
         (sizeof(type) < sizeof(long) ?                                   \
-            PyInt_FromLong((long)x) :                                    \
+            PyLong_FromLong((long)x) :                                   \
          sizeof(type) == sizeof(long) ?                                  \
             PyLong_FromUnsignedLong((unsigned long)x) :                  \
             PyLong_FromUnsignedLongLong((unsigned long long)x)) :        \
         (sizeof(type) <= sizeof(long) ?                                  \
-            PyInt_FromLong((long)x) :                                    \
+            PyLong_FromLong((long)x) :                                   \
             PyLong_FromLongLong((long long)x)))
 
 #define _cffi_to_c_int(o, type)                                          \
@@ -603,7 +615,7 @@ void wgs84_to_gcj02 (double y, double x, double *ret)
   t4 = t3 * t3;
   t6 = x - 0.1050e3;
   t8 = 0.1e0 * t6 * t3;
-  t9 = sqrt(t6);
+  t9 = sqrt(fabs(t6));
   t11 = t6 * 0.3141592654e1;
   t13 = sin(0.60e1 * t11);
   t14 = 0.1333333333e2 * t13;
@@ -709,7 +721,7 @@ void wgs84_to_gcj02_jac (double y, double x, double *ret)
   t35 = t3 * t3;
   t37 = x - 0.1050e3;
   t39 = 0.1e0 * t37 * t3;
-  t40 = sqrt(t37);
+  t40 = sqrt(fabs(t37));
   t42 = t37 * 0.3141592654e1;
   t43 = 0.60e1 * t42;
   t44 = sin(t43);
@@ -735,7 +747,7 @@ void wgs84_to_gcj02_jac (double y, double x, double *ret)
   t85 = 0.12500e3 + x + 0.20e1 * y + 0.1e0 * t71 + t39 + 0.1e0 * t40 + t45 + t48 + 0.1333333333e2 * t74 + 0.2666666667e2 * t77 + 0.1000000000e3 * t80 + 0.2000000000e3 * t83;
   t91 = t59 * t59;
   t97 = 0.1e0 * y;
-  t98 = 0.1e1 / t40;
+  t98 = copysign(0.1e1, t37) / t40;
   t100 = cos(t43);
   t102 = 0.7999999998e2 * t100 * 0.3141592654e1;
   t103 = cos(t46);
@@ -806,16 +818,189 @@ void bd09_to_gcj02 (double y, double x, double *ret)
   ret[1] = t11 * t20;
 }
 
+void wgs84_to_gcj02_batch (const double *y, const double *x,
+                           const unsigned char *mask,
+                           double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    if (mask && !mask[i]) {
+      ret_y[i] = y[i];
+      ret_x[i] = x[i];
+      continue;
+    }
+    wgs84_to_gcj02(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
+
+void gcj02_to_wgs84_newton_batch (const double *y, const double *x,
+                                  const unsigned char *mask,
+                                  double *ret_y, double *ret_x, double *res,
+                                  size_t n, int iters, double tol)
+{
+  double f[2];
+  double jac[4];
+  double y0;
+  double x0;
+  double wy;
+  double wx;
+  double fy;
+  double fx;
+  double det;
+  double r;
+  size_t i;
+  int k;
+  for (i = 0; i < n; i++) {
+    y0 = y[i];
+    x0 = x[i];
+    wy = y0;
+    wx = x0;
+    r = 0.0;
+    if (!mask || mask[i]) {
+      for (k = 0; ; k++) {
+        wgs84_to_gcj02(wy, wx, f);
+        fy = f[0] - y0;
+        fx = f[1] - x0;
+        r = sqrt(fy * fy + fx * fx);
+        if (k == iters || r <= tol)
+          break;
+        /* jac is [[d lat, d lng] / d lat, [d lat, d lng] / d lng] */
+        wgs84_to_gcj02_jac(wy, wx, jac);
+        det = jac[0] * jac[3] - jac[2] * jac[1];
+        if (isfinite(det) && det != 0) {
+          wy -= (jac[3] * fy - jac[2] * fx) / det;
+          wx -= (jac[0] * fx - jac[1] * fy) / det;
+        } else {
+          /* jac blows up on lng 105 (sqrt term), take a fixed point step */
+          wy -= fy;
+          wx -= fx;
+        }
+      }
+    }
+    ret_y[i] = wy;
+    ret_x[i] = wx;
+    if (res)
+      res[i] = r;
+  }
+}
+
+void offset_lut_batch (const float *table, size_t ny, size_t nx,
+                       double lat0, double lng0, double dlat, double dlng,
+                       const double *y, const double *x,
+                       const unsigned char *mask,
+                       double *ret_y, double *ret_x, size_t n)
+{
+  /* table holds dlat then dlng planes of shape (ny, nx) */
+  const float *t0;
+  const float *t1;
+  double fy;
+  double fx;
+  double ty;
+  double tx;
+  size_t iy;
+  size_t ix;
+  size_t i;
+  for (i = 0; i < n; i++) {
+    fy = (y[i] - lat0) / dlat;
+    fx = (x[i] - lng0) / dlng;
+    ret_y[i] = y[i];
+    ret_x[i] = x[i];
+    if (mask && !mask[i])
+      continue;
+    /* clamp to the border cells, nan goes to 0 and stays nan in ret */
+    iy = fy >= 0 ? (fy < ny - 2 ? (size_t)fy : ny - 2) : 0;
+    ix = fx >= 0 ? (fx < nx - 2 ? (size_t)fx : nx - 2) : 0;
+    ty = fy - iy;
+    tx = fx - ix;
+    t0 = table + iy * nx + ix;
+    t1 = t0 + ny * nx;
+    ret_y[i] += (t0[0] * (1 - tx) + t0[1] * tx) * (1 - ty)
+      + (t0[nx] * (1 - tx) + t0[nx + 1] * tx) * ty;
+    ret_x[i] += (t1[0] * (1 - tx) + t1[1] * tx) * (1 - ty)
+      + (t1[nx] * (1 - tx) + t1[nx + 1] * tx) * ty;
+  }
+}
+
+void gcj02_to_bd09_batch (const double *y, const double *x,
+                          double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    gcj02_to_bd09(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
+
+void bd09_to_gcj02_batch (const double *y, const double *x,
+                          double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    bd09_to_gcj02(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
+
 
 /************************************************************/
 
 static void *_cffi_types[] = {
-/*  0 */ _CFFI_OP(_CFFI_OP_FUNCTION, 5), // void()(double, double, double *)
-/*  1 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14), // double
-/*  2 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
-/*  3 */ _CFFI_OP(_CFFI_OP_POINTER, 1), // double *
-/*  4 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
-/*  5 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 0), // void
+/*  0 */ _CFFI_OP(_CFFI_OP_FUNCTION, 48), // void()(double const *, double const *, double *, double *, size_t)
+/*  1 */ _CFFI_OP(_CFFI_OP_POINTER, 16), // double const *
+/*  2 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/*  3 */ _CFFI_OP(_CFFI_OP_POINTER, 16), // double *
+/*  4 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/*  5 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28), // size_t
+/*  6 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
+/*  7 */ _CFFI_OP(_CFFI_OP_FUNCTION, 48), // void()(double const *, double const *, unsigned char const *, double *, double *, double *, size_t, int, double)
+/*  8 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/*  9 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/* 10 */ _CFFI_OP(_CFFI_OP_POINTER, 47), // unsigned char const *
+/* 11 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 12 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 13 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 14 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28),
+/* 15 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 7), // int
+/* 16 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14), // double
+/* 17 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
+/* 18 */ _CFFI_OP(_CFFI_OP_FUNCTION, 48), // void()(double const *, double const *, unsigned char const *, double *, double *, size_t)
+/* 19 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/* 20 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/* 21 */ _CFFI_OP(_CFFI_OP_NOOP, 10),
+/* 22 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 23 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 24 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28),
+/* 25 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
+/* 26 */ _CFFI_OP(_CFFI_OP_FUNCTION, 48), // void()(double, double, double *)
+/* 27 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 28 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 29 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 30 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
+/* 31 */ _CFFI_OP(_CFFI_OP_FUNCTION, 48), // void()(float const *, size_t, size_t, double, double, double, double, double const *, double const *, unsigned char const *, double *, double *, size_t)
+/* 32 */ _CFFI_OP(_CFFI_OP_POINTER, 46), // float const *
+/* 33 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28),
+/* 34 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28),
+/* 35 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 36 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 37 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 38 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 14),
+/* 39 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/* 40 */ _CFFI_OP(_CFFI_OP_NOOP, 1),
+/* 41 */ _CFFI_OP(_CFFI_OP_NOOP, 10),
+/* 42 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 43 */ _CFFI_OP(_CFFI_OP_NOOP, 3),
+/* 44 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 28),
+/* 45 */ _CFFI_OP(_CFFI_OP_FUNCTION_END, 0),
+/* 46 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 13), // float
+/* 47 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 4), // unsigned char
+/* 48 */ _CFFI_OP(_CFFI_OP_PRIMITIVE, 0), // void
 };
 
 static void _cffi_d_bd09_to_gcj02(double x0, double x1, double * x2)
@@ -870,6 +1055,466 @@ _cffi_f_bd09_to_gcj02(PyObject *self, PyObject *args)
 #  define _cffi_f_bd09_to_gcj02 _cffi_d_bd09_to_gcj02
 #endif
 
+static void _cffi_d_bd09_to_gcj02_batch(double const * x0, double const * x1, double * x2, double * x3, size_t x4)
+{
+  bd09_to_gcj02_batch(x0, x1, x2, x3, x4);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_bd09_to_gcj02_batch(PyObject *self, PyObject *args)
+{
+  double const * x0;
+  double const * x1;
+  double * x2;
+  double * x3;
+  size_t x4;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+  PyObject *arg3;
+  PyObject *arg4;
+
+  if (!PyArg_UnpackTuple(args, "bd09_to_gcj02_batch", 5, 5, &arg0, &arg1, &arg2, &arg3, &arg4))
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg0, (char **)&x0);
+  if (datasize != 0) {
+    x0 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg0, (char **)&x0,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg1, (char **)&x1);
+  if (datasize != 0) {
+    x1 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg1, (char **)&x1,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg2, (char **)&x2);
+  if (datasize != 0) {
+    x2 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg2, (char **)&x2,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg3, (char **)&x3);
+  if (datasize != 0) {
+    x3 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg3, (char **)&x3,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x4 = _cffi_to_c_int(arg4, size_t);
+  if (x4 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { bd09_to_gcj02_batch(x0, x1, x2, x3, x4); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_bd09_to_gcj02_batch _cffi_d_bd09_to_gcj02_batch
+#endif
+
+static void _cffi_d_gcj02_to_bd09(double x0, double x1, double * x2)
+{
+  gcj02_to_bd09(x0, x1, x2);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_gcj02_to_bd09(PyObject *self, PyObject *args)
+{
+  double x0;
+  double x1;
+  double * x2;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+
+  if (!PyArg_UnpackTuple(args, "gcj02_to_bd09", 3, 3, &arg0, &arg1, &arg2))
+    return NULL;
+
+  x0 = (double)_cffi_to_c_double(arg0);
+  if (x0 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  x1 = (double)_cffi_to_c_double(arg1);
+  if (x1 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg2, (char **)&x2);
+  if (datasize != 0) {
+    x2 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg2, (char **)&x2,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { gcj02_to_bd09(x0, x1, x2); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_gcj02_to_bd09 _cffi_d_gcj02_to_bd09
+#endif
+
+static void _cffi_d_gcj02_to_bd09_batch(double const * x0, double const * x1, double * x2, double * x3, size_t x4)
+{
+  gcj02_to_bd09_batch(x0, x1, x2, x3, x4);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_gcj02_to_bd09_batch(PyObject *self, PyObject *args)
+{
+  double const * x0;
+  double const * x1;
+  double * x2;
+  double * x3;
+  size_t x4;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+  PyObject *arg3;
+  PyObject *arg4;
+
+  if (!PyArg_UnpackTuple(args, "gcj02_to_bd09_batch", 5, 5, &arg0, &arg1, &arg2, &arg3, &arg4))
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg0, (char **)&x0);
+  if (datasize != 0) {
+    x0 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg0, (char **)&x0,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg1, (char **)&x1);
+  if (datasize != 0) {
+    x1 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg1, (char **)&x1,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg2, (char **)&x2);
+  if (datasize != 0) {
+    x2 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg2, (char **)&x2,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg3, (char **)&x3);
+  if (datasize != 0) {
+    x3 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg3, (char **)&x3,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x4 = _cffi_to_c_int(arg4, size_t);
+  if (x4 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { gcj02_to_bd09_batch(x0, x1, x2, x3, x4); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_gcj02_to_bd09_batch _cffi_d_gcj02_to_bd09_batch
+#endif
+
+static void _cffi_d_gcj02_to_wgs84_newton_batch(double const * x0, double const * x1, unsigned char const * x2, double * x3, double * x4, double * x5, size_t x6, int x7, double x8)
+{
+  gcj02_to_wgs84_newton_batch(x0, x1, x2, x3, x4, x5, x6, x7, x8);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_gcj02_to_wgs84_newton_batch(PyObject *self, PyObject *args)
+{
+  double const * x0;
+  double const * x1;
+  unsigned char const * x2;
+  double * x3;
+  double * x4;
+  double * x5;
+  size_t x6;
+  int x7;
+  double x8;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+  PyObject *arg3;
+  PyObject *arg4;
+  PyObject *arg5;
+  PyObject *arg6;
+  PyObject *arg7;
+  PyObject *arg8;
+
+  if (!PyArg_UnpackTuple(args, "gcj02_to_wgs84_newton_batch", 9, 9, &arg0, &arg1, &arg2, &arg3, &arg4, &arg5, &arg6, &arg7, &arg8))
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg0, (char **)&x0);
+  if (datasize != 0) {
+    x0 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg0, (char **)&x0,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg1, (char **)&x1);
+  if (datasize != 0) {
+    x1 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg1, (char **)&x1,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(10), arg2, (char **)&x2);
+  if (datasize != 0) {
+    x2 = ((size_t)datasize) <= 640 ? (unsigned char const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(10), arg2, (char **)&x2,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg3, (char **)&x3);
+  if (datasize != 0) {
+    x3 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg3, (char **)&x3,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg4, (char **)&x4);
+  if (datasize != 0) {
+    x4 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg4, (char **)&x4,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg5, (char **)&x5);
+  if (datasize != 0) {
+    x5 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg5, (char **)&x5,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x6 = _cffi_to_c_int(arg6, size_t);
+  if (x6 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  x7 = _cffi_to_c_int(arg7, int);
+  if (x7 == (int)-1 && PyErr_Occurred())
+    return NULL;
+
+  x8 = (double)_cffi_to_c_double(arg8);
+  if (x8 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { gcj02_to_wgs84_newton_batch(x0, x1, x2, x3, x4, x5, x6, x7, x8); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_gcj02_to_wgs84_newton_batch _cffi_d_gcj02_to_wgs84_newton_batch
+#endif
+
+static void _cffi_d_offset_lut_batch(float const * x0, size_t x1, size_t x2, double x3, double x4, double x5, double x6, double const * x7, double const * x8, unsigned char const * x9, double * x10, double * x11, size_t x12)
+{
+  offset_lut_batch(x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_offset_lut_batch(PyObject *self, PyObject *args)
+{
+  float const * x0;
+  size_t x1;
+  size_t x2;
+  double x3;
+  double x4;
+  double x5;
+  double x6;
+  double const * x7;
+  double const * x8;
+  unsigned char const * x9;
+  double * x10;
+  double * x11;
+  size_t x12;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+  PyObject *arg3;
+  PyObject *arg4;
+  PyObject *arg5;
+  PyObject *arg6;
+  PyObject *arg7;
+  PyObject *arg8;
+  PyObject *arg9;
+  PyObject *arg10;
+  PyObject *arg11;
+  PyObject *arg12;
+
+  if (!PyArg_UnpackTuple(args, "offset_lut_batch", 13, 13, &arg0, &arg1, &arg2, &arg3, &arg4, &arg5, &arg6, &arg7, &arg8, &arg9, &arg10, &arg11, &arg12))
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(32), arg0, (char **)&x0);
+  if (datasize != 0) {
+    x0 = ((size_t)datasize) <= 640 ? (float const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(32), arg0, (char **)&x0,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x1 = _cffi_to_c_int(arg1, size_t);
+  if (x1 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  x2 = _cffi_to_c_int(arg2, size_t);
+  if (x2 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  x3 = (double)_cffi_to_c_double(arg3);
+  if (x3 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  x4 = (double)_cffi_to_c_double(arg4);
+  if (x4 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  x5 = (double)_cffi_to_c_double(arg5);
+  if (x5 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  x6 = (double)_cffi_to_c_double(arg6);
+  if (x6 == (double)-1 && PyErr_Occurred())
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg7, (char **)&x7);
+  if (datasize != 0) {
+    x7 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg7, (char **)&x7,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg8, (char **)&x8);
+  if (datasize != 0) {
+    x8 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg8, (char **)&x8,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(10), arg9, (char **)&x9);
+  if (datasize != 0) {
+    x9 = ((size_t)datasize) <= 640 ? (unsigned char const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(10), arg9, (char **)&x9,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg10, (char **)&x10);
+  if (datasize != 0) {
+    x10 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg10, (char **)&x10,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg11, (char **)&x11);
+  if (datasize != 0) {
+    x11 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg11, (char **)&x11,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x12 = _cffi_to_c_int(arg12, size_t);
+  if (x12 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { offset_lut_batch(x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_offset_lut_batch _cffi_d_offset_lut_batch
+#endif
+
 static void _cffi_d_wgs84_to_gcj02(double x0, double x1, double * x2)
 {
   wgs84_to_gcj02(x0, x1, x2);
@@ -922,6 +1567,96 @@ _cffi_f_wgs84_to_gcj02(PyObject *self, PyObject *args)
 #  define _cffi_f_wgs84_to_gcj02 _cffi_d_wgs84_to_gcj02
 #endif
 
+static void _cffi_d_wgs84_to_gcj02_batch(double const * x0, double const * x1, unsigned char const * x2, double * x3, double * x4, size_t x5)
+{
+  wgs84_to_gcj02_batch(x0, x1, x2, x3, x4, x5);
+}
+#ifndef PYPY_VERSION
+static PyObject *
+_cffi_f_wgs84_to_gcj02_batch(PyObject *self, PyObject *args)
+{
+  double const * x0;
+  double const * x1;
+  unsigned char const * x2;
+  double * x3;
+  double * x4;
+  size_t x5;
+  Py_ssize_t datasize;
+  struct _cffi_freeme_s *large_args_free = NULL;
+  PyObject *arg0;
+  PyObject *arg1;
+  PyObject *arg2;
+  PyObject *arg3;
+  PyObject *arg4;
+  PyObject *arg5;
+
+  if (!PyArg_UnpackTuple(args, "wgs84_to_gcj02_batch", 6, 6, &arg0, &arg1, &arg2, &arg3, &arg4, &arg5))
+    return NULL;
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg0, (char **)&x0);
+  if (datasize != 0) {
+    x0 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg0, (char **)&x0,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(1), arg1, (char **)&x1);
+  if (datasize != 0) {
+    x1 = ((size_t)datasize) <= 640 ? (double const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(1), arg1, (char **)&x1,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(10), arg2, (char **)&x2);
+  if (datasize != 0) {
+    x2 = ((size_t)datasize) <= 640 ? (unsigned char const *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(10), arg2, (char **)&x2,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg3, (char **)&x3);
+  if (datasize != 0) {
+    x3 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg3, (char **)&x3,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  datasize = _cffi_prepare_pointer_call_argument(
+      _cffi_type(3), arg4, (char **)&x4);
+  if (datasize != 0) {
+    x4 = ((size_t)datasize) <= 640 ? (double *)alloca((size_t)datasize) : NULL;
+    if (_cffi_convert_array_argument(_cffi_type(3), arg4, (char **)&x4,
+            datasize, &large_args_free) < 0)
+      return NULL;
+  }
+
+  x5 = _cffi_to_c_int(arg5, size_t);
+  if (x5 == (size_t)-1 && PyErr_Occurred())
+    return NULL;
+
+  Py_BEGIN_ALLOW_THREADS
+  _cffi_restore_errno();
+  { wgs84_to_gcj02_batch(x0, x1, x2, x3, x4, x5); }
+  _cffi_save_errno();
+  Py_END_ALLOW_THREADS
+
+  (void)self; /* unused */
+  if (large_args_free != NULL) _cffi_free_array_arguments(large_args_free);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+#else
+#  define _cffi_f_wgs84_to_gcj02_batch _cffi_d_wgs84_to_gcj02_batch
+#endif
+
 static void _cffi_d_wgs84_to_gcj02_jac(double x0, double x1, double * x2)
 {
   wgs84_to_gcj02_jac(x0, x1, x2);
@@ -975,9 +1710,15 @@ _cffi_f_wgs84_to_gcj02_jac(PyObject *self, PyObject *args)
 #endif
 
 static const struct _cffi_global_s _cffi_globals[] = {
-  { "bd09_to_gcj02", (void *)_cffi_f_bd09_to_gcj02, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 0), (void *)_cffi_d_bd09_to_gcj02 },
-  { "wgs84_to_gcj02", (void *)_cffi_f_wgs84_to_gcj02, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 0), (void *)_cffi_d_wgs84_to_gcj02 },
-  { "wgs84_to_gcj02_jac", (void *)_cffi_f_wgs84_to_gcj02_jac, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 0), (void *)_cffi_d_wgs84_to_gcj02_jac },
+  { "bd09_to_gcj02", (void *)_cffi_f_bd09_to_gcj02, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 26), (void *)_cffi_d_bd09_to_gcj02 },
+  { "bd09_to_gcj02_batch", (void *)_cffi_f_bd09_to_gcj02_batch, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 0), (void *)_cffi_d_bd09_to_gcj02_batch },
+  { "gcj02_to_bd09", (void *)_cffi_f_gcj02_to_bd09, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 26), (void *)_cffi_d_gcj02_to_bd09 },
+  { "gcj02_to_bd09_batch", (void *)_cffi_f_gcj02_to_bd09_batch, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 0), (void *)_cffi_d_gcj02_to_bd09_batch },
+  { "gcj02_to_wgs84_newton_batch", (void *)_cffi_f_gcj02_to_wgs84_newton_batch, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 7), (void *)_cffi_d_gcj02_to_wgs84_newton_batch },
+  { "offset_lut_batch", (void *)_cffi_f_offset_lut_batch, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 31), (void *)_cffi_d_offset_lut_batch },
+  { "wgs84_to_gcj02", (void *)_cffi_f_wgs84_to_gcj02, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 26), (void *)_cffi_d_wgs84_to_gcj02 },
+  { "wgs84_to_gcj02_batch", (void *)_cffi_f_wgs84_to_gcj02_batch, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 18), (void *)_cffi_d_wgs84_to_gcj02_batch },
+  { "wgs84_to_gcj02_jac", (void *)_cffi_f_wgs84_to_gcj02_jac, _CFFI_OP(_CFFI_OP_CPYTHON_BLTN_V, 26), (void *)_cffi_d_wgs84_to_gcj02_jac },
 };
 
 static const struct _cffi_type_context_s _cffi_type_context = {
@@ -987,12 +1728,12 @@ static const struct _cffi_type_context_s _cffi_type_context = {
   NULL,  /* no struct_unions */
   NULL,  /* no enums */
   NULL,  /* no typenames */
-  3,  /* num_globals */
+  9,  /* num_globals */
   0,  /* num_struct_unions */
   0,  /* num_enums */
   0,  /* num_typenames */
   NULL,  /* no includes */
-  6,  /* num_types */
+  49,  /* num_types */
   0,  /* flags */
 };
 
@@ -1006,30 +1747,18 @@ _cffi_pypyinit__cvt_geosys(const void *p[])
 {
     p[0] = (const void *)0x2601;
     p[1] = &_cffi_type_context;
-#if PY_MAJOR_VERSION >= 3
     return NULL;
-#endif
 }
 #  ifdef _MSC_VER
      PyMODINIT_FUNC
-#  if PY_MAJOR_VERSION >= 3
      PyInit__cvt_geosys(void) { return NULL; }
-#  else
-     init_cvt_geosys(void) { }
 #  endif
-#  endif
-#elif PY_MAJOR_VERSION >= 3
+#else
 PyMODINIT_FUNC
 PyInit__cvt_geosys(void)
 {
   return _cffi_init("geosys._cvt_geosys", 0x2601, &_cffi_type_context);
 }
-#else
-PyMODINIT_FUNC
-init_cvt_geosys(void)
-{
-  _cffi_init("geosys._cvt_geosys", 0x2601, &_cffi_type_context);
-}
 #endif
 
 #ifdef __GNUC__
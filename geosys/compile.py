@@ -9,7 +9,24 @@ builder.set_source("geosys._cvt_geosys", open(cur_d / "cvt_geosys_mpl.c").read()
 builder.cdef("""
 void wgs84_to_gcj02 (double y, double x, double *out);
 void wgs84_to_gcj02_jac (double y, double x, double *out);
+void gcj02_to_bd09 (double y, double x, double *out);
 void bd09_to_gcj02 (double y, double x, double *out);
+void wgs84_to_gcj02_batch (const double *y, const double *x,
+                           const unsigned char *mask,
+                           double *out_y, double *out_x, size_t n);
+void gcj02_to_wgs84_newton_batch (const double *y, const double *x,
+                                  const unsigned char *mask,
+                                  double *out_y, double *out_x, double *res,
+                                  size_t n, int iters, double tol);
+void offset_lut_batch (const float *table, size_t ny, size_t nx,
+                       double lat0, double lng0, double dlat, double dlng,
+                       const double *y, const double *x,
+                       const unsigned char *mask,
+                       double *out_y, double *out_x, size_t n);
+void gcj02_to_bd09_batch (const double *y, const double *x,
+                          double *out_y, double *out_x, size_t n);
+void bd09_to_gcj02_batch (const double *y, const double *x,
+                          double *out_y, double *out_x, size_t n);
 """)
 
 if __name__ == "__main__":
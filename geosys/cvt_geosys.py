@@ -1,10 +1,13 @@
+import os
 from pathlib import Path
+from itertools import islice
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 import json
 import math as M
-from Polygon import Polygon
-from geopy.distance import geodesic
-from scipy.optimize import leastsq
-# from ._cvt_geosys import ffi, lib
+import numpy as np
+from ._cvt_geosys import ffi, lib
 
 cur_d = Path(__file__).parent
 
@@ -28,19 +31,221 @@ def transform_point(T, X):
     return T[:, :-1].dot(X) + T[:, -1]
 
 def geo_dist(lat0, lng0, lat1, lng1):
-    return geodesic((lat0, lng0), (lat1, lng1)).meters
+    return float(geo_dist_batch(lat0, lng0, lat1, lng1))
 
 def geo_coord(lat, lng, clat=0, clng=0):
-    return ((1 if lat > clat else -1) * geo_dist(lat, lng, clat, lng),
-            (1 if lng > clng else -1) * geo_dist(lat, lng, lat, clng))
+    return tuple(geo_coord_batch(lat, lng, clat, clng).tolist())
+
+
+VINCENTY_ITERS = 200
+VINCENTY_TOL = 1e-12
+
+def geo_dist_batch(lat0, lng0, lat1, lng1):
+    """
+    ellipsoidal distance in meters on wgs84 (vincenty inverse), broadcasting
+    over the inputs so an anchor can be measured to many points. pairs that
+    do not converge (nearly antipodal) fall back to geopy, nan gives nan
+    """
+    lat0, lng0, lat1, lng1 = np.broadcast_arrays(
+        *(np.asarray(i, dtype=np.float64) for i in (lat0, lng0, lat1, lng1)))
+    a, f = EARTH_R_MAJOR, EARTH_FLATTENING
+    b = a * (1 - f)
+    L = np.radians((lng1 - lng0 + 180) % 360 - 180)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat0)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_ITERS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam,
+                                 cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # equatorial lines have cos2_alpha == 0
+            cos_2sm = np.where(
+                cos2_alpha == 0, 0,
+                cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (
+                    cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+            # nan inputs stay nan instead of counting as not converged
+            failed = ~(np.abs(lam - lam_prev) <= VINCENTY_TOL) & ~np.isnan(lam)
+            if not failed.any():
+                break
+
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    d_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2)
+        - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2)
+        * (-3 + 4 * cos_2sm ** 2)))
+    dist = np.array(b * A * (sigma - d_sigma))
+
+    flat = dist.reshape(-1)
+    if failed.any():
+        from geopy.distance import geodesic
+    for i in np.flatnonzero(failed):
+        flat[i] = geodesic((lat0.flat[i], lng0.flat[i]),
+                           (lat1.flat[i], lng1.flat[i])).meters
+    return dist
+
+def geo_dist_pairwise(lat0, lng0, lat1, lng1):
+    """
+    distance matrix between points 0 (n,) and points 1 (m,), shape (n, m)
+    """
+    lat0, lng0 = np.asarray(lat0)[:, None], np.asarray(lng0)[:, None]
+    return geo_dist_batch(lat0, lng0, lat1, lng1)
+
+def geo_dist_track(lat, lng):
+    """
+    distances between consecutive points of a track, shape (n - 1,)
+    """
+    lat, lng = np.asarray(lat), np.asarray(lng)
+    return geo_dist_batch(lat[:-1], lng[:-1], lat[1:], lng[1:])
+
+def geo_coord_batch(lat, lng, clat=0, clng=0):
+    """
+    local metric coords of points about (clat, clng), return an array of
+    shape (2, ...) with signed north and east distances in meters
+    """
+    lat, lng = np.asarray(lat), np.asarray(lng)
+    return np.stack((
+        np.where(lat > clat, 1, -1) * geo_dist_batch(lat, lng, clat, lng),
+        np.where(lng > clng, 1, -1) * geo_dist_batch(lat, lng, lat, clng)))
+
+
+def _max_rect(grid):
+    """
+    largest all True rectangle in a 2d bool grid as (i0, j0, i1, j1),
+    end exclusive, None if grid is all False
+    """
+    best, best_area = None, 0
+    h = np.zeros(grid.shape[1], dtype=int)
+    for i, row in enumerate(grid):
+        h = np.where(row, h + 1, 0)
+        stack = []
+        for j, cur in enumerate(h.tolist() + [0]):
+            start = j
+            while stack and stack[-1][1] >= cur:
+                start, hj = stack.pop()
+                if hj * (j - start) > best_area:
+                    best_area = hj * (j - start)
+                    best = (i - hj + 1, start, i + 1, j)
+            stack.append((start, cur))
+    return best
+
+
+# points left after the bbox tests, up to which contains_batch runs the
+# edge test per point instead of per edge
+RING_EDGE_LOOP_MIN = 128
+
+class RingIndex:
+    """
+    prebuilt containment test for a closed ring of (y, x) vertices: bounding
+    box reject, inner rectangle accept, then an exact even-odd edge test
+    """
+    def __init__(self, ring, grid_nr=64):
+        v0 = np.asarray(ring, dtype=np.float64)
+        v1 = np.roll(v0, -1, axis=0)
+        ok = v0[:, 1] != v1[:, 1]
+        (self.ey0, self.ex0), (self.ey1, self.ex1) = v0[ok].T, v1[ok].T
+        self.ek = (self.ey0 - self.ey1) / (self.ex0 - self.ex1)
+
+        self.bbox = tuple(v0.min(axis=0).tolist() + v0.max(axis=0).tolist())
+        self.inner = self._inner_rect(v0, v1, grid_nr)
+
+    def _inner_rect(self, v0, v1, grid_nr):
+        # cells touched by no edge bbox lie entirely on one side of the ring
+        y0, x0, y1, x1 = self.bbox
+        dy, dx = (y1 - y0) / grid_nr, (x1 - x0) / grid_nr
+        lo = np.minimum(v0, v1) - (y0, x0)
+        hi = np.maximum(v0, v1) - (y0, x0)
+        boundary = np.zeros((grid_nr, grid_nr), dtype=bool)
+        for (a0, b0), (a1, b1) in zip(lo, hi):
+            boundary[int(a0 / dy): int(a1 / dy) + 1,
+                     int(b0 / dx): int(b1 / dx) + 1] = True
+
+        cy = y0 + (np.arange(grid_nr) + 0.5) * dy
+        cx = x0 + (np.arange(grid_nr) + 0.5) * dx
+        cy, cx = np.meshgrid(cy, cx, indexing='ij')
+        rect = _max_rect(~boundary & self._edge_test_batch(cy, cx))
+        if rect is None:
+            return
+        i0, j0, i1, j1 = rect
+        return y0 + i0 * dy, x0 + j0 * dx, y0 + i1 * dy, x0 + j1 * dx
+
+    def _edge_test(self, y, x):
+        cross = (self.ex1 > x) != (self.ex0 > x)
+        cross &= y < self.ek * (x - self.ex1) + self.ey1
+        return bool(np.count_nonzero(cross) & 1)
+
+    def _edge_test_batch(self, y, x):
+        inside = np.zeros(y.shape, dtype=bool)
+        for y0, x0, x1, k in zip(self.ey1, self.ex1, self.ex0, self.ek):
+            cross = (x0 > x) != (x1 > x)
+            cross &= y < k * (x - x0) + y0
+            inside ^= cross
+        return inside
+
+    def contains(self, y, x):
+        y0, x0, y1, x1 = self.bbox
+        if not (y0 <= y <= y1 and x0 <= x <= x1):
+            return False
+        if self.inner:
+            y0, x0, y1, x1 = self.inner
+            if y0 <= y <= y1 and x0 <= x <= x1:
+                return True
+        return self._edge_test(y, x)
+
+    def contains_batch(self, y, x):
+        y0, x0, y1, x1 = self.bbox
+        mask = (y >= y0) & (y <= y1) & (x >= x0) & (x <= x1)
+        idx = np.flatnonzero(mask)
+        y, x = y.ravel()[idx], x.ravel()[idx]
+        if self.inner and idx.size:
+            y0, x0, y1, x1 = self.inner
+            accept = (y >= y0) & (y <= y1) & (x >= x0) & (x <= x1)
+            idx, y, x = idx[~accept], y[~accept], x[~accept]
+        if not idx.size:
+            return mask
+        if idx.size <= RING_EDGE_LOOP_MIN:
+            # few points, a loop over them vectorized over the edges is faster
+            mask.ravel()[idx] = [self._edge_test(*i) for i in zip(y, x)]
+            return mask
+        mask.ravel()[idx] = self._edge_test_batch(y, x)
+        return mask
 
 
 cache = {}
-def in_china(y, x):
+def get_china_borders():
     if 'china_borders' not in cache:
         cache['china_borders'] = json.load(open(cur_d / 'china_borders.json'))
+    return cache['china_borders']
+
+def get_china_index():
+    if 'china_index' not in cache:
+        cache['china_index'] = [RingIndex(b) for b in get_china_borders()]
+    return cache['china_index']
 
-    return any(Polygon(b).isInside(y, x) for b in cache['china_borders'])
+def in_china(y, x):
+    return any(i.contains(y, x) for i in get_china_index())
+
+def in_china_batch(y, x):
+    y, x = np.broadcast_arrays(np.asarray(y, dtype=np.float64),
+                               np.asarray(x, dtype=np.float64))
+    mask = np.zeros(y.shape, dtype=bool)
+    for i in get_china_index():
+        mask |= i.contains_batch(y, x)
+    return mask
 
 def check_in_china_fn(fn):
     def __fn(y, x):
@@ -51,25 +256,394 @@ def check_in_china_fn(fn):
     return __fn
 
 
-wgs84_to_gcj02 = check_in_china_fn(wgs84_to_gcj02)
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+class QuantizedLRU:
+    """
+    bounded lru cache of fn(y, x), keys are (y, x) quantized to digits
+    decimals, so points closer than the quantum share the first result
+    """
+    def __init__(self, fn, maxsize=1 << 16, digits=7):
+        self.fn = fn
+        self.maxsize = maxsize
+        self.scale = 10 ** digits
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.misses = 0
+
+    def __call__(self, y, x):
+        key = round(y * self.scale), round(x * self.scale)
+        with self.lock:
+            out = self.data.get(key)
+            if out is not None:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return out
+            self.misses += 1
+
+        out = tuple(self.fn(y, x))
+        with self.lock:
+            self.data[key] = out
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return out
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.data))
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+
+CONVERSION_CACHE_SIZE = 1 << 16
+CONVERSION_CACHE_DIGITS = 7  # ~1cm
+
+conversion_caches = {}
+def cached_conversion_fn(fn, name):
+    """
+    route fn through conversion_caches[name] while a cache is enabled
+    """
+    def __fn(y, x):
+        c = conversion_caches.get(name)
+        return c(y, x) if c else fn(y, x)
+    __fn.uncached = fn
+    return __fn
+
+def enable_conversion_cache(maxsize=CONVERSION_CACHE_SIZE,
+                            digits=CONVERSION_CACHE_DIGITS,
+                            names=('wgs84_to_gcj02', 'gcj02_to_wgs84')):
+    """
+    memoize the scalar conversions named, every caller converting points
+    one at a time (qmap_yx2ll, qmap_parse_pano_info, ...) goes through them
+    """
+    for name in names:
+        conversion_caches[name] = QuantizedLRU(
+            globals()[name].uncached, maxsize=maxsize, digits=digits)
+
+def disable_conversion_cache():
+    conversion_caches.clear()
+
+def conversion_cache_info():
+    return {k: v.info() for k, v in conversion_caches.items()}
+
+
+wgs84_to_gcj02 = cached_conversion_fn(
+    check_in_china_fn(wgs84_to_gcj02), 'wgs84_to_gcj02')
+
+def _as_f8(a):
+    return np.require(a, np.float64, 'C')
+
+def _ptr(a, tp='double *'):
+    if a is None:
+        return ffi.NULL
+    return ffi.cast(tp, a.ctypes.data)
+
+def _prepare_batch(y, x, out):
+    y, x = np.broadcast_arrays(_as_f8(y), _as_f8(x))
+    y, x = _as_f8(y), _as_f8(x)
+    shape = (2,) + y.shape
+    if out is None:
+        out = np.empty(shape)
+    elif (out.shape != shape or out.dtype != np.float64
+          or not out.flags.c_contiguous):
+        raise ValueError(
+            'out should be a C-contiguous float64 array of shape {}'.format(shape))
+    return y, x, out
+
+def _check_mask(mask, shape):
+    # the kernels read y.size bytes of mask, anything else would overrun it
+    if mask is None:
+        return
+    mask = np.asarray(mask)
+    if (mask.shape != shape or mask.dtype not in (np.bool_, np.uint8)
+            or not mask.flags.c_contiguous):
+        raise ValueError(
+            'mask should be a C-contiguous bool or uint8 array of shape {}'
+            .format(shape))
+    return mask
+
+
+# the cffi kernels release the GIL while they run, so with workers > 1 the
+# batch functions split their flat arrays into BATCH_CHUNK sized pieces and
+# convert them on a shared thread pool. workers <= 0 means one per cpu
+BATCH_CHUNK = 1 << 16
+
+def get_pool(workers):
+    key = 'pool', workers
+    if key not in cache:
+        cache[key] = ThreadPoolExecutor(workers, thread_name_prefix='geosys')
+    return cache[key]
+
+def _map_chunks(fn, arrays, workers=1, chunk=BATCH_CHUNK):
+    """
+    call fn(*pieces) on matching flat pieces of C-contiguous arrays, None
+    entries are passed as is. a single worker runs the pieces in order on
+    the calling thread, which still beats one call over a large array as
+    the numpy temporaries of in_china_batch stay in cache
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    flat = [a if a is None else a.reshape(-1) for a in arrays]
+    n = flat[0].size
+
+    def run(i):
+        fn(*(a if a is None else a[i: i + chunk] for a in flat))
+    if workers == 1 or n <= chunk:
+        for i in range(0, max(n, 1), chunk):
+            run(i)
+    else:
+        # list() to wait for the chunks and raise their errors
+        list(get_pool(workers).map(run, range(0, n, chunk)))
+
+def _wgs84_to_gcj02_kernel(y, x, mask, oy, ox):
+    lib.wgs84_to_gcj02_batch(
+        _ptr(y), _ptr(x), _ptr(mask, 'unsigned char *'),
+        _ptr(oy), _ptr(ox), y.size)
+
+def _wgs84_to_gcj02_batch(y, x, mask, out, workers=1):
+    _map_chunks(_wgs84_to_gcj02_kernel,
+                (y, x, mask, out[0, ...], out[1, ...]), workers)
+
+def _with_in_china(kernel):
+    # the in_china test is numpy, chunking it keeps temporaries small and
+    # lets it overlap with the kernels of the other threads
+    def __fn(y, x, mask, *args):
+        mask[...] = in_china_batch(y, x)
+        kernel(y, x, mask, *args)
+    return __fn
+
+
+# 'lut' interpolates precomputed offsets, see geosys.lut for the error bound
+GCJ02_MODES = 'exact', 'lut'
+
+def _check_mode(mode):
+    if mode not in GCJ02_MODES:
+        raise ValueError('mode should be one of {}'.format(GCJ02_MODES))
+    return mode == 'lut'
+
+def wgs84_to_gcj02_batch(y, x, out=None, mode='exact', workers=1):
+    """
+    convert arrays of wgs84 coords, points outside china are copied as is.
+    return ([lat, lng] stacked in an array of shape (2, ...), in_china mask)
+    """
+    use_lut = _check_mode(mode)
+    y, x, out = _prepare_batch(y, x, out)
+    mask = np.empty(y.shape, dtype=bool)
+    if use_lut:
+        from .lut import get_gcj02_lut
+        kernel = get_gcj02_lut().kernel
+    else:
+        kernel = _wgs84_to_gcj02_kernel
+    _map_chunks(_with_in_china(kernel),
+                (y, x, mask, out[0, ...], out[1, ...]), workers)
+    return out, mask
+
+
+GCJ02_NEWTON_ITERS = 8
+GCJ02_NEWTON_TOL = 0  # degrees, 0 means iterate to an exact round trip
+
+def _gcj02_to_wgs84_newton_kernel(iters=GCJ02_NEWTON_ITERS,
+                                  tol=GCJ02_NEWTON_TOL):
+    def __fn(y, x, mask, oy, ox, res):
+        lib.gcj02_to_wgs84_newton_batch(
+            _ptr(y), _ptr(x), _ptr(mask, 'unsigned char *'),
+            _ptr(oy), _ptr(ox), _ptr(res), y.size, iters, tol)
+    return __fn
+
+def gcj02_to_wgs84_newton(y, x, out=None, mask=None,
+                          iters=GCJ02_NEWTON_ITERS, tol=GCJ02_NEWTON_TOL,
+                          workers=1):
+    """
+    solve wgs84_to_gcj02(lat, lng) == (y, x) over whole arrays, each point
+    runs at most iters newton steps with the analytic wgs84_to_gcj02_jac and
+    stops once its residual <= tol. points where mask is False are copied.
+    return (out, per point residual in degrees)
+    """
+    y, x, out = _prepare_batch(y, x, out)
+    mask = _check_mask(mask, y.shape)
+    res = np.empty(y.shape)
+    _map_chunks(_gcj02_to_wgs84_newton_kernel(iters, tol),
+                (y, x, mask, out[0, ...], out[1, ...], res), workers)
+    return out, res
 
 def __gcj02_to_wgs84(y0, x0):
     """
     >>> gcj02, wgs84 = (39.906961, 116.397555), (39.905560, 116.391314)
     >>> ok(__gcj02_to_wgs84(*gcj02), wgs84, 1e-6)
     """
-    def wgs84_to_gcj02_fvec(x):
-        y1, x1 = wgs84_to_gcj02(*x)
-        return y1 - y0, x1 - x0
+    out, _ = gcj02_to_wgs84_newton(y0, x0)
+    return tuple(out.tolist())
 
-    def wgs84_to_gcj02_fjac(x):
-        return wgs84_to_gcj02_jac(*x)
 
-    x, flag = leastsq(wgs84_to_gcj02_fvec, (y0, x0), Dfun=wgs84_to_gcj02_fjac)
-    return x.tolist()
+gcj02_to_wgs84 = cached_conversion_fn(
+    check_in_china_fn(__gcj02_to_wgs84), 'gcj02_to_wgs84')
 
+def gcj02_to_wgs84_batch(y, x, out=None, mode='exact', workers=1, **kws):
+    """
+    inverse of wgs84_to_gcj02_batch, return (out, in_china mask).
+    kws are iters and tol of gcj02_to_wgs84_newton
+    """
+    use_lut = _check_mode(mode)
+    y, x, out = _prepare_batch(y, x, out)
+    mask = np.empty(y.shape, dtype=bool)
+    if use_lut:
+        from .lut import get_gcj02_lut
+        kernel = get_gcj02_lut(inverse=True).kernel
+    else:
+        newton = _gcj02_to_wgs84_newton_kernel(**kws)
+
+        def kernel(y, x, mask, oy, ox):
+            newton(y, x, mask, oy, ox, None)
+    _map_chunks(_with_in_china(kernel),
+                (y, x, mask, out[0, ...], out[1, ...]), workers)
+    return out, mask
+
+
+def gcj02_to_bd09(y, x):
+    out = ffi.new('double[2]')
+    lib.gcj02_to_bd09(y, x, out)
+    return tuple(out)
+
+def bd09_to_gcj02(y, x):
+    out = ffi.new('double[2]')
+    lib.bd09_to_gcj02(y, x, out)
+    return tuple(out)
+
+def _bd09_kernel(kernel):
+    def __fn(y, x, oy, ox):
+        kernel(_ptr(y), _ptr(x), _ptr(oy), _ptr(ox), y.size)
+    return __fn
+
+# baidu applies the bd09 offset everywhere, so unlike gcj02 there is no mask
+def gcj02_to_bd09_batch(y, x, out=None, workers=1):
+    y, x, out = _prepare_batch(y, x, out)
+    _map_chunks(_bd09_kernel(lib.gcj02_to_bd09_batch),
+                (y, x, out[0, ...], out[1, ...]), workers)
+    return out
+
+def bd09_to_gcj02_batch(y, x, out=None, workers=1):
+    y, x, out = _prepare_batch(y, x, out)
+    _map_chunks(_bd09_kernel(lib.bd09_to_gcj02_batch),
+                (y, x, out[0, ...], out[1, ...]), workers)
+    return out
+
+
+# bd09mc is baidu's own mercator, piecewise polynomials in latitude bands
+# taken from the baidu map js api. a row is the lng term (c0 + c1 * |x|)
+# then the lat polynomial c2 .. c8 in |y| / c9, with the band starts as
+# BD09MC_BANDS (meters) and BD09LL_BANDS (degrees)
+BD09MC_BANDS = (12890594.86, 8362377.87, 5591021, 3481989.83, 1678043.12, 0)
+BD09LL_BANDS = (75, 60, 45, 30, 15, 0)
+BD09MC_TO_LL = np.array([
+    [1.410526172116255e-8, 0.00000898305509648872, -1.9939833816331,
+     200.9824383106796, -187.2403703815547, 91.6087516669843,
+     -23.38765649603339, 2.57121317296198, -0.03801003308653, 17337981.2],
+    [-7.435856389565537e-9, 0.000008983055097726239, -0.78625201886289,
+     96.32687599759846, -1.85204757529826, -59.36935905485877,
+     47.40033549296737, -16.50741931063887, 2.28786674699375, 10260144.86],
+    [-3.030883460898826e-8, 0.00000898305509983578, 0.30071316287616,
+     59.74293618442277, 7.357984074871, -25.38371002664745,
+     13.45380521110908, -3.29883767235584, 0.32710905363475, 6856817.37],
+    [-1.981981304930552e-8, 0.000008983055099779535, 0.03278182852591,
+     40.31678527705744, 0.65659298677277, -4.44255534477492,
+     0.85341911805263, 0.12923347998204, -0.04625736007561, 4482777.06],
+    [3.09191371068437e-9, 0.000008983055096812155, 0.00006995724062,
+     23.10934304144901, -0.00023663490511, -0.6321817810242,
+     -0.00663494467273, 0.03430082397953, -0.00466043876332, 2555164.4],
+    [2.890871144776878e-9, 0.000008983055095805407, -3.068298e-8,
+     7.47137025468032, -0.00000353937994, -0.02145144861037,
+     -0.00001234426596, 0.00010322952773, -0.00000323890364, 826088.5],
+])
+BD09LL_TO_MC = np.array([
+    [-0.0015702102444, 111320.7020616939, 1704480524535203,
+     -10338987376042340, 26112667856603880, -35149669176653700,
+     26595700718403920, -10725012454188240, 1800819912950474, 82.5],
+    [0.0008277824516172526, 111320.7020463578, 647795574.6671607,
+     -4082003173.641316, 10774905663.51142, -15171875531.51559,
+     12053065338.62167, -5124939663.577472, 913311935.9512032, 67.5],
+    [0.00337398766765, 111320.7020202162, 4481351.045890365,
+     -23393751.19931662, 79682215.47186455, -115964993.2797253,
+     97236711.15602145, -43661946.33752821, 8477230.501135234, 52.5],
+    [0.00220636496208, 111320.7020209128, 51751.86112841131,
+     3796837.749470245, 992013.7397791013, -1221952.21711287,
+     1340652.697009075, -620943.6990984312, 144416.9293806241, 37.5],
+    [-0.0003441963504368392, 111320.7020576856, 278.2353980772752,
+     2485758.690035394, 6070.750963243378, 54821.18345352118,
+     9540.606633304236, -2710.55326746645, 1405.483844121726, 22.5],
+    [-0.0003218135878613132, 111320.7020701615, 0.00369383431289,
+     823725.6402795718, 0.46104986909093, 2351.343141331292,
+     1.58060784298199, 8.77738589078284, 0.37238884252424, 7.45],
+])
+BD09LL_MAX_LAT = 74
+
+def _bd09_band_poly(y, x, table, bands, out):
+    """
+    out = band polynomial of (y, x), the band of each point is picked by |y|
+    """
+    # y, x may alias out, keep what is needed of them before writing
+    ay, ax = np.abs(y), np.abs(x)
+    ny, nx = np.signbit(y), np.signbit(x)
+    # bands are descending, count the band starts above |y|
+    band = len(bands) - np.searchsorted(bands[::-1], ay, side='right')
+    c = table[np.minimum(band, len(bands) - 1)]
+    t = ay / c[..., 9]
+    oy, ox = out[0, ...], out[1, ...]
+    oy[...] = c[..., 8]
+    for k in range(7, 1, -1):
+        oy *= t
+        oy += c[..., k]
+    np.multiply(c[..., 1], ax, out=ox)
+    ox += c[..., 0]
+    np.negative(oy, out=oy, where=ny)
+    np.negative(ox, out=ox, where=nx)
+    return out
+
+def bd09mc_to_bd09_batch(y, x, out=None):
+    """
+    baidu mercator (north, east) in meters to bd09 [lat, lng], shape (2, ...)
+    """
+    y, x, out = _prepare_batch(y, x, out)
+    return _bd09_band_poly(y, x, BD09MC_TO_LL, BD09MC_BANDS, out)
+
+def bd09_to_bd09mc_batch(y, x, out=None):
+    """
+    bd09 [lat, lng] to baidu mercator (north, east) in meters, shape (2, ...)
+    lat is clamped to +-BD09LL_MAX_LAT and lng wrapped into [-180, 180)
+    """
+    y, x, out = _prepare_batch(y, x, out)
+    y = np.clip(y, -BD09LL_MAX_LAT, BD09LL_MAX_LAT)
+    x = (x + 180) % 360 - 180
+    return _bd09_band_poly(y, x, BD09LL_TO_MC, BD09LL_BANDS, out)
+
+def bd09mc_to_bd09(y, x):
+    return tuple(bd09mc_to_bd09_batch(y, x).tolist())
+
+def bd09_to_bd09mc(y, x):
+    return tuple(bd09_to_bd09mc_batch(y, x).tolist())
+
+# the pipelines below convert in place through out, so they cost one (2, ...)
+# buffer. those ending in wgs84 or starting from it return (out, in_china
+# mask) like the gcj02 ones, mode and kws go to the gcj02 step
+def bd09_to_wgs84_batch(y, x, out=None, mode='exact', workers=1, **kws):
+    out = bd09_to_gcj02_batch(y, x, out, workers)
+    return gcj02_to_wgs84_batch(
+        out[0, ...], out[1, ...], out, mode, workers, **kws)
+
+def wgs84_to_bd09_batch(y, x, out=None, mode='exact', workers=1):
+    out, mask = wgs84_to_gcj02_batch(y, x, out, mode, workers)
+    return gcj02_to_bd09_batch(out[0, ...], out[1, ...], out, workers), mask
+
+def bd09mc_to_wgs84_batch(y, x, out=None, mode='exact', workers=1, **kws):
+    out = bd09mc_to_bd09_batch(y, x, out)
+    return bd09_to_wgs84_batch(
+        out[0, ...], out[1, ...], out, mode, workers, **kws)
+
+def wgs84_to_bd09mc_batch(y, x, out=None, mode='exact', workers=1):
+    out, mask = wgs84_to_bd09_batch(y, x, out, mode, workers)
+    return bd09_to_bd09mc_batch(out[0, ...], out[1, ...], out), mask
 
-gcj02_to_wgs84 = check_in_china_fn(__gcj02_to_wgs84)
 
 EARTH_CIRCUM = 2 * M.pi * EARTH_R_MAJOR
 
@@ -95,6 +669,60 @@ def merc2ll(y, x, meter=True):
         x /= EARTH_CIRCUM
     return M.degrees(2 * M.atan(M.exp(pi2 * y)) - M.pi / 2), M.degrees(x * pi2)
 
+def prepare_proj(y, x, out, dtype):
+    """
+    broadcast y, x and check or make out of shape (2, ...) for a *_batch
+    projection, return (y, x, out[0], out[1], out)
+    """
+    if dtype is None:
+        dtype = np.result_type(y, x, np.float32)
+    y, x = np.broadcast_arrays(np.asarray(y), np.asarray(x))
+    shape = (2,) + y.shape
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or not np.issubdtype(out.dtype, np.floating):
+        raise ValueError(
+            'out should be a float array of shape {}'.format(shape))
+    return y, x, out[0, ...], out[1, ...], out
+
+def set_invalid(valid, *outs):
+    """
+    nan the outs where not valid, return valid
+    """
+    for i in outs:
+        i[~valid] = np.nan
+    return valid
+
+# the *_batch projections below take arrays, write [y, x] or [lat, lng] into
+# out of shape (2, ...), float32 inputs stay float32 unless dtype is given.
+# return (out, valid mask), invalid points are nan instead of raising
+def ll2merc_batch(lat, lng, meter=True, out=None, dtype=None):
+    lat, lng, y, x, out = prepare_proj(lat, lng, out, dtype)
+    np.radians(lng, out=x)
+    x /= pi2
+    np.radians(lat, out=y)
+    np.sin(y, out=y)
+    # 0.5 * log((1 + siny) / (1 - siny))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.arctanh(y, out=y)
+    y /= pi2
+    if meter:
+        x *= EARTH_CIRCUM
+        y *= EARTH_CIRCUM
+    return out, set_invalid(np.abs(lat) < 85, y, x)
+
+def merc2ll_batch(y, x, meter=True, out=None, dtype=None):
+    y, x, lat, lng, out = prepare_proj(y, x, out, dtype)
+    np.multiply(y, pi2 / EARTH_CIRCUM if meter else pi2, out=lat)
+    np.exp(lat, out=lat)
+    np.arctan(lat, out=lat)
+    lat *= 2
+    lat -= M.pi / 2
+    np.degrees(lat, out=lat)
+    np.multiply(x, pi2 / EARTH_CIRCUM if meter else pi2, out=lng)
+    np.degrees(lng, out=lng)
+    return out, set_invalid(np.isfinite(y) & np.isfinite(x), lat, lng)
+
 
 _geo_decodes = {
     'beijing': (39.9, 116.3),
@@ -120,6 +748,68 @@ def apply_ll2xyz(trans, lat, lng, elev=0):
     return transform_point(T, (x, -elev, z))
 
 
+_ARC_N = EARTH_FLATTENING / (2 - EARTH_FLATTENING)
+
+def meridian_arc(lat):
+    """
+    distance in meters from the equator along a meridian (helmert series)
+    """
+    n = _ARC_N
+    lat = np.radians(lat)
+    return EARTH_R_MAJOR / (1 + n) * (
+        (1 + n ** 2 / 4 + n ** 4 / 64) * lat
+        - 1.5 * (n - n ** 3 / 8) * np.sin(2 * lat)
+        + 15 / 16 * (n ** 2 - n ** 4 / 4) * np.sin(4 * lat)
+        - 35 / 48 * n ** 3 * np.sin(6 * lat)
+        + 315 / 512 * n ** 4 * np.sin(8 * lat))
+
+def make_ll2xyz_frame(trans):
+    """
+    precompute what apply_ll2xyz_batch needs from trans = (anchor, T) once
+    """
+    (clat, clng), T = trans
+    T = np.asarray(T, dtype=np.float64)
+    return float(meridian_arc(clat)), clng, T[:, :-1].T.copy(), T[:, -1].copy()
+
+def apply_ll2xyz_batch(trans, lat, lng, elev=0, out=None):
+    """
+    batch apply_ll2xyz, return xyz of shape (..., 3). north offsets are
+    meridian arcs and east offsets geo_dist_batch along the latitude, the
+    same as geo_coord at any distance from the anchor.
+    trans may also be a frame from make_ll2xyz_frame
+    """
+    arc0, clng, R, t = trans if len(trans) == 4 else make_ll2xyz_frame(trans)
+    lat, lng, elev = np.broadcast_arrays(
+        *(np.asarray(i, dtype=np.float64) for i in (lat, lng, elev)))
+    X = np.empty(lat.shape + (3,))
+    X[..., 0] = geo_dist_batch(lat, lng, lat, clng)
+    X[..., 0] *= np.where(lng > clng, 1, -1)
+    np.negative(elev, out=X[..., 1])
+    X[..., 2] = meridian_arc(lat) - arc0
+    out = np.matmul(X, R, out=out)
+    out += t
+    return out
+
+def iter_apply_ll2xyz(trans, rows, chunk_size=1 << 16):
+    """
+    stream apply_ll2xyz_batch over rows of (lat, lng[, elev]), an (n, 2|3)
+    array or any iterable of tuples, yielding (k, 3) arrays per chunk so
+    memory stays bounded by chunk_size
+    """
+    frame = make_ll2xyz_frame(trans)
+    if isinstance(rows, np.ndarray):
+        for i in range(0, len(rows), chunk_size):
+            yield apply_ll2xyz_batch(frame, *rows[i: i + chunk_size].T)
+        return
+
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield apply_ll2xyz_batch(frame, *np.array(chunk).T)
+
+
 EPSG3857_K0 = 0.15915494309189535
 EPSG3857_K1 = 0.5
 EPSG3857_K2 = 2**18
@@ -140,7 +830,46 @@ def merc2ll_epsg3857(y, x):
     lat = M.degrees(2 * M.atan(M.exp(y)) - M.pi / 2)
     return lat, lng
 
+def ll2merc_epsg3857_batch(lat, lng, out=None, dtype=None):
+    lat, lng, y, x, out = prepare_proj(lat, lng, out, dtype)
+    np.radians(lng, out=x)
+    x *= EPSG3857_K0
+    x += EPSG3857_K1
+    x *= EPSG3857_K2
+    np.radians(lat, out=y)
+    y /= 2
+    y += M.pi / 4
+    np.tan(y, out=y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.log(y, out=y)
+    y *= -EPSG3857_K0
+    y += EPSG3857_K1
+    y *= EPSG3857_K2
+    return out, set_invalid(np.abs(lat) < 85, y, x)
+
+def merc2ll_epsg3857_batch(y, x, out=None, dtype=None):
+    y, x, lat, lng, out = prepare_proj(y, x, out, dtype)
+    np.divide(x, EPSG3857_K2, out=lng)
+    lng -= EPSG3857_K1
+    lng /= EPSG3857_K0
+    np.degrees(lng, out=lng)
+    np.divide(y, EPSG3857_K2, out=lat)
+    lat -= EPSG3857_K1
+    lat /= -EPSG3857_K0
+    np.exp(lat, out=lat)
+    np.arctan(lat, out=lat)
+    lat *= 2
+    lat -= M.pi / 2
+    np.degrees(lat, out=lat)
+    return out, set_invalid(np.isfinite(y) & np.isfinite(x), lat, lng)
+
 def unit_ll_meter(lat, lng):
-    dy = geo_dist(lat, lng, lat + 1, lng)
-    dx = geo_dist(lat, lng, lat, lng + 1)
-    return dy, dx
+    return tuple(unit_ll_meter_batch(lat, lng).tolist())
+
+def unit_ll_meter_batch(lat, lng):
+    """
+    meters per degree of lat and lng at each point, shape (2, ...)
+    """
+    lat, lng = np.asarray(lat), np.asarray(lng)
+    return np.stack((geo_dist_batch(lat, lng, lat + 1, lng),
+                     geo_dist_batch(lat, lng, lat, lng + 1)))
@@ -35,7 +35,7 @@ void wgs84_to_gcj02 (double y, double x, double *ret)
   t4 = t3 * t3;
   t6 = x - 0.1050e3;
   t8 = 0.1e0 * t6 * t3;
-  t9 = sqrt(t6);
+  t9 = sqrt(fabs(t6));
   t11 = t6 * 0.3141592654e1;
   t13 = sin(0.60e1 * t11);
   t14 = 0.1333333333e2 * t13;
@@ -141,7 +141,7 @@ void wgs84_to_gcj02_jac (double y, double x, double *ret)
   t35 = t3 * t3;
   t37 = x - 0.1050e3;
   t39 = 0.1e0 * t37 * t3;
-  t40 = sqrt(t37);
+  t40 = sqrt(fabs(t37));
   t42 = t37 * 0.3141592654e1;
   t43 = 0.60e1 * t42;
   t44 = sin(t43);
@@ -167,7 +167,7 @@ void wgs84_to_gcj02_jac (double y, double x, double *ret)
   t85 = 0.12500e3 + x + 0.20e1 * y + 0.1e0 * t71 + t39 + 0.1e0 * t40 + t45 + t48 + 0.1333333333e2 * t74 + 0.2666666667e2 * t77 + 0.1000000000e3 * t80 + 0.2000000000e3 * t83;
   t91 = t59 * t59;
   t97 = 0.1e0 * y;
-  t98 = 0.1e1 / t40;
+  t98 = copysign(0.1e1, t37) / t40;
   t100 = cos(t43);
   t102 = 0.7999999998e2 * t100 * 0.3141592654e1;
   t103 = cos(t46);
@@ -237,3 +237,133 @@ void bd09_to_gcj02 (double y, double x, double *ret)
   ret[0] = -t11 * t18;
   ret[1] = t11 * t20;
 }
+
+void wgs84_to_gcj02_batch (const double *y, const double *x,
+                           const unsigned char *mask,
+                           double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    if (mask && !mask[i]) {
+      ret_y[i] = y[i];
+      ret_x[i] = x[i];
+      continue;
+    }
+    wgs84_to_gcj02(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
+
+void gcj02_to_wgs84_newton_batch (const double *y, const double *x,
+                                  const unsigned char *mask,
+                                  double *ret_y, double *ret_x, double *res,
+                                  size_t n, int iters, double tol)
+{
+  double f[2];
+  double jac[4];
+  double y0;
+  double x0;
+  double wy;
+  double wx;
+  double fy;
+  double fx;
+  double det;
+  double r;
+  size_t i;
+  int k;
+  for (i = 0; i < n; i++) {
+    y0 = y[i];
+    x0 = x[i];
+    wy = y0;
+    wx = x0;
+    r = 0.0;
+    if (!mask || mask[i]) {
+      for (k = 0; ; k++) {
+        wgs84_to_gcj02(wy, wx, f);
+        fy = f[0] - y0;
+        fx = f[1] - x0;
+        r = sqrt(fy * fy + fx * fx);
+        if (k == iters || r <= tol)
+          break;
+        /* jac is [[d lat, d lng] / d lat, [d lat, d lng] / d lng] */
+        wgs84_to_gcj02_jac(wy, wx, jac);
+        det = jac[0] * jac[3] - jac[2] * jac[1];
+        if (isfinite(det) && det != 0) {
+          wy -= (jac[3] * fy - jac[2] * fx) / det;
+          wx -= (jac[0] * fx - jac[1] * fy) / det;
+        } else {
+          /* jac blows up on lng 105 (sqrt term), take a fixed point step */
+          wy -= fy;
+          wx -= fx;
+        }
+      }
+    }
+    ret_y[i] = wy;
+    ret_x[i] = wx;
+    if (res)
+      res[i] = r;
+  }
+}
+
+void offset_lut_batch (const float *table, size_t ny, size_t nx,
+                       double lat0, double lng0, double dlat, double dlng,
+                       const double *y, const double *x,
+                       const unsigned char *mask,
+                       double *ret_y, double *ret_x, size_t n)
+{
+  /* table holds dlat then dlng planes of shape (ny, nx) */
+  const float *t0;
+  const float *t1;
+  double fy;
+  double fx;
+  double ty;
+  double tx;
+  size_t iy;
+  size_t ix;
+  size_t i;
+  for (i = 0; i < n; i++) {
+    fy = (y[i] - lat0) / dlat;
+    fx = (x[i] - lng0) / dlng;
+    ret_y[i] = y[i];
+    ret_x[i] = x[i];
+    if (mask && !mask[i])
+      continue;
+    /* clamp to the border cells, nan goes to 0 and stays nan in ret */
+    iy = fy >= 0 ? (fy < ny - 2 ? (size_t)fy : ny - 2) : 0;
+    ix = fx >= 0 ? (fx < nx - 2 ? (size_t)fx : nx - 2) : 0;
+    ty = fy - iy;
+    tx = fx - ix;
+    t0 = table + iy * nx + ix;
+    t1 = t0 + ny * nx;
+    ret_y[i] += (t0[0] * (1 - tx) + t0[1] * tx) * (1 - ty)
+      + (t0[nx] * (1 - tx) + t0[nx + 1] * tx) * ty;
+    ret_x[i] += (t1[0] * (1 - tx) + t1[1] * tx) * (1 - ty)
+      + (t1[nx] * (1 - tx) + t1[nx + 1] * tx) * ty;
+  }
+}
+
+void gcj02_to_bd09_batch (const double *y, const double *x,
+                          double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    gcj02_to_bd09(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
+
+void bd09_to_gcj02_batch (const double *y, const double *x,
+                          double *ret_y, double *ret_x, size_t n)
+{
+  double ret[2];
+  size_t i;
+  for (i = 0; i < n; i++) {
+    bd09_to_gcj02(y[i], x[i], ret);
+    ret_y[i] = ret[0];
+    ret_x[i] = ret[1];
+  }
+}
@@ -0,0 +1,534 @@
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import http.client
+from pathlib import Path
+from threading import Lock
+from collections import OrderedDict
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urlunsplit, urljoin, urlencode, parse_qsl
+from urllib.request import (
+    Request, ProxyHandler, build_opener, getproxies, proxy_bypass)
+from concurrent.futures import ThreadPoolExecutor, Future
+
+HTTP_POOL_SIZE = 16  # idle keep-alive connections kept per host
+HTTP_MAX_REDIRECTS = 5
+HTTP_CONCURRENCY = 32  # requests in flight in total
+HTTP_HOST_CONCURRENCY = 4  # requests in flight per host
+# same agent as urlopen, some map servers answer differently to others
+HTTP_HEADERS = {
+    'User-Agent': 'Python-urllib/{}.{}'.format(*sys.version_info[:2]),
+    'Accept-Encoding': 'identity',
+}
+_redirects = 301, 302, 303, 307, 308
+# what a keep-alive connection closed by the server looks like on reuse
+_stale_errors = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, BrokenPipeError)
+
+class HTTPPool:
+    """
+    persistent HTTP/1.1 connections kept per (scheme, host, port) and shared
+    by all threads, a connection is used by one request at a time and goes
+    back to the pool once its response is read. urls with a proxy, from
+    http_proxy / https_proxy by default, go through urlopen instead
+    """
+    def __init__(self, maxsize=HTTP_POOL_SIZE, headers=None, proxies=None):
+        self.maxsize = maxsize
+        self.headers = dict(HTTP_HEADERS, **(headers or {}))
+        self.proxies = getproxies() if proxies is None else proxies
+        self.opener = None
+        self.idle = {}
+        self.lock = Lock()
+        self.connects = 0
+
+    def _get_conn(self, key, timeout, fresh=False):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns and not fresh:
+                conn = conns.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.connects += 1
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=timeout), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def _put_conn(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _request(self, url, timeout, headers):
+        u = urlsplit(url)
+        key = u.scheme, u.hostname, u.port
+        path = (u.path or '/') + ('?' + u.query if u.query else '')
+        headers = dict(self.headers, **(headers or {}))
+        for fresh in False, True:
+            conn, reused = self._get_conn(key, timeout, fresh)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except _stale_errors:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._put_conn(key, conn)
+            return resp, body
+
+    def _proxied(self, url):
+        u = urlsplit(url)
+        return bool(self.proxies.get(u.scheme)) and not proxy_bypass(u.hostname)
+
+    def _urlopen(self, url, timeout, headers):
+        if self.opener is None:
+            self.opener = build_opener(ProxyHandler(self.proxies))
+        req = Request(url, headers=dict(self.headers, **(headers or {})))
+        with self.opener.open(req, timeout=timeout) as resp:
+            return resp.read()
+
+    def request(self, url, timeout=None, headers=None):
+        """
+        GET url following redirects and return the body, raise HTTPError
+        for status >= 400 like urlopen
+        """
+        if self._proxied(url):
+            return self._urlopen(url, timeout, headers)
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            resp, body = self._request(url, timeout, headers)
+            location = resp.headers.get('Location')
+            if resp.status in _redirects and location:
+                url = urljoin(url, location)
+                continue
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            return body
+        raise HTTPError(url, resp.status, 'too many redirects', resp.headers, None)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+cache = {}
+def get_http_pool():
+    """
+    the process wide pool used by geosys.utils.request_retry
+    """
+    if 'pool' not in cache:
+        cache['pool'] = HTTPPool()
+    return cache['pool']
+
+
+# per host limits applied to every request_retry call, the rate adapts to
+# 429 answers between HTTP_MIN_RATE and the configured rate
+HTTP_HOST_RATE = 25.  # requests per second
+HTTP_HOST_BURST = 25
+HTTP_MIN_RATE = 0.5
+HTTP_BACKOFF_BASE = 0.5  # seconds, doubled per attempt then jittered
+HTTP_BACKOFF_MAX = 60.
+HTTP_BREAKER_FAILS = 8  # consecutive failures that open a host's breaker
+HTTP_BREAKER_COOLDOWN = 30.  # seconds until an open breaker lets a trial
+
+class CircuitOpenError(Exception):
+    pass
+
+class TokenBucket:
+    """
+    rate limit shared by threads, reserve() takes a token and returns how
+    long the caller has to sleep for it
+    """
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.t = clock()
+        self.lock = Lock()
+
+    def reserve(self):
+        with self.lock:
+            t = self.clock()
+            self.tokens = min(self.burst, self.tokens + (t - self.t) * self.rate)
+            self.t = t
+            # going negative queues the callers behind each other
+            self.tokens -= 1
+            return max(0., -self.tokens / self.rate)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(HTTP_MIN_RATE, self.rate / 2)
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 64)
+
+class CircuitBreaker:
+    """
+    closed until fails consecutive failures, then open for cooldown seconds,
+    then half open: one trial request closes it again or reopens it
+    """
+    def __init__(self, fails=HTTP_BREAKER_FAILS, cooldown=HTTP_BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.fails = fails
+        self.cooldown = cooldown
+        self.clock = clock
+        self.nr = 0
+        self.opened = None
+        self.trial = False
+        self.lock = Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if self.clock() - self.opened < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'open' or (state == 'half_open' and self.trial):
+                return False
+            self.trial = state == 'half_open'
+            return True
+
+    def success(self):
+        with self.lock:
+            self.nr = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.nr += 1
+            if self.trial or self.nr >= self.fails:
+                self.opened = self.clock()
+            self.trial = False
+
+class HostLimiter:
+    """
+    a TokenBucket and a CircuitBreaker per host
+    """
+    def __init__(self, rate=HTTP_HOST_RATE, burst=HTTP_HOST_BURST,
+                 fails=HTTP_BREAKER_FAILS, cooldown=HTTP_BREAKER_COOLDOWN,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.make_bucket = lambda: TokenBucket(rate, burst, clock)
+        self.make_breaker = lambda: CircuitBreaker(fails, cooldown, clock)
+        self.sleep = sleep
+        self.hosts = {}
+        self.lock = Lock()
+
+    def get(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = self.make_bucket(), self.make_breaker()
+            return self.hosts[host]
+
+    def acquire(self, host):
+        bucket, breaker = self.get(host)
+        if not breaker.allow():
+            raise CircuitOpenError(host)
+        wait = bucket.reserve()
+        self.sleep(wait)
+        return wait
+
+    def success(self, host):
+        bucket, breaker = self.get(host)
+        bucket.recover()
+        breaker.success()
+
+    def failure(self, host, throttled=False):
+        """
+        a 429 slows the host down, other failures count towards its breaker
+        """
+        bucket, breaker = self.get(host)
+        if throttled:
+            bucket.throttled()
+            breaker.success()
+        else:
+            breaker.failure()
+
+    def is_open(self, host):
+        return self.get(host)[1].state == 'open'
+
+def get_limiter():
+    if 'limiter' not in cache:
+        cache['limiter'] = HostLimiter()
+    return cache['limiter']
+
+def set_limiter(**kws):
+    """
+    replace the shared limiter, kws as HostLimiter
+    """
+    cache['limiter'] = HostLimiter(**kws)
+    return cache['limiter']
+
+def backoff_delay(attempt, retry_after=None, base=HTTP_BACKOFF_BASE,
+                  cap=HTTP_BACKOFF_MAX):
+    """
+    full jitter exponential backoff, a Retry-After in seconds is a floor
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after and str(retry_after).isdigit():
+        delay = max(delay, min(cap, float(retry_after)))
+    return delay
+
+def is_throttle_status(code):
+    return code == 429
+
+def is_retry_status(code):
+    return code == 429 or code >= 500
+
+
+HTTP_CACHE_DIR = Path(os.environ.get(
+    'GEOSYS_CACHE_DIR', Path.home() / '.cache' / 'geosys')) / 'http'
+HTTP_CACHE_TTL = 30 * 24 * 3600.  # seconds, None keeps responses forever
+HTTP_CACHE_MAX_BYTES = 4 << 30
+# hosts of numbered mirrors serving the same content share cache entries
+HTTP_CACHE_MIRRORS = [r'^(sv|mapsv|geo)\d+\.']
+
+def normalize_url(url, mirrors=HTTP_CACHE_MIRRORS):
+    """
+    lower case scheme and host, no default port or fragment, sorted query,
+    numbered mirror hosts folded to {server}
+    """
+    u = urlsplit(url)
+    scheme, host = u.scheme.lower(), (u.hostname or '').lower()
+    for i in mirrors:
+        host = re.sub(i, r'\1{server}.', host)
+    if u.port and u.port != {'http': 80, 'https': 443}.get(scheme):
+        host += ':{}'.format(u.port)
+    query = urlencode(sorted(parse_qsl(u.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, u.path or '/', query, ''))
+
+class ResponseCache:
+    """
+    raw response bodies on disk, named by the sha1 of the normalized url.
+    a file's mtime is when it was stored (for ttl) and its atime when it was
+    last read (for lru), so several processes can share one directory.
+    past max_bytes the least recently used tenth is evicted
+    """
+    def __init__(self, root=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL,
+                 max_bytes=HTTP_CACHE_MAX_BYTES, clock=time.time):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = Lock()
+        self.index = None  # key -> size, least recently used first
+        self.size = 0
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(normalize_url(url).encode()).hexdigest()
+
+    def path(self, key):
+        return self.root / key[:2] / key
+
+    def _load_index(self):
+        # the scan and the reads of get run outside the lock, it only guards
+        # the in memory index
+        if self.index is not None:
+            return
+        entries = []
+        for d in self.root.glob('??'):
+            for i in os.scandir(d):
+                if i.name.endswith('.tmp'):
+                    continue
+                st = i.stat()
+                entries.append((st.st_atime, i.name, st.st_size))
+        index = OrderedDict((k, n) for _, k, n in sorted(entries))
+        with self.lock:
+            if self.index is None:
+                self.index = index
+                self.size = sum(index.values())
+
+    def get(self, url):
+        key = self.key(url)
+        f = self.path(key)
+        self._load_index()
+        try:
+            st = f.stat()
+            expired = self.ttl is not None and \
+                self.clock() - st.st_mtime > self.ttl
+            if not expired:
+                body = f.read_bytes()
+                os.utime(f, (self.clock(), st.st_mtime))
+        except FileNotFoundError:
+            # evicted by another process
+            with self.lock:
+                self._drop(key, missing=True)
+                self.misses += 1
+            return
+        with self.lock:
+            if expired:
+                self._drop(key)
+                self.misses += 1
+                return
+            self.size += len(body) - self.index.pop(key, 0)
+            self.index[key] = len(body)
+            self.hits += 1
+        return body
+
+    def put(self, url, body):
+        key = self.key(url)
+        f = self.path(key)
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_name('{}.{}.tmp'.format(key, os.getpid()))
+        tmp.write_bytes(body)
+        t = self.clock()
+        os.utime(tmp, (t, t))
+        os.replace(tmp, f)
+        self._load_index()
+        with self.lock:
+            self.size += len(body) - self.index.pop(key, 0)
+            self.index[key] = len(body)
+            if self.size > self.max_bytes:
+                self._evict(self.max_bytes * 0.9)
+
+    def _drop(self, key, missing=False):
+        self.size -= self.index.pop(key, 0)
+        if not missing:
+            try:
+                self.path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, size):
+        while self.index and self.size > size:
+            self._drop(next(iter(self.index)))
+
+    def clear(self):
+        self._load_index()
+        with self.lock:
+            self._evict(0)
+
+def get_response_cache():
+    """
+    the cache request_retry reads and fills, None unless enabled
+    """
+    return cache.get('responses')
+
+def set_response_cache(root=HTTP_CACHE_DIR, **kws):
+    """
+    share a ResponseCache at root between all requests, kws as
+    ResponseCache, root None disables it
+    """
+    cache['responses'] = ResponseCache(root, **kws) if root else None
+    return cache['responses']
+
+
+class SingleFlight:
+    """
+    concurrent do(key, fn) calls with the same key run fn once, callers
+    arriving while it runs wait for it and get the same result or error
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+
+        try:
+            out = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(out)
+            return out
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+def get_single_flight():
+    if 'single_flight' not in cache:
+        cache['single_flight'] = SingleFlight()
+    return cache['single_flight']
+
+
+class AsyncFetcher:
+    """
+    asyncio front of a blocking fetch(url), request_retry by default. calls
+    run on a thread pool with at most limit in flight in total and
+    host_limit per host, so all tiles of many panos can be awaited at once
+    """
+    def __init__(self, fetch=None, limit=HTTP_CONCURRENCY,
+                 host_limit=HTTP_HOST_CONCURRENCY):
+        if fetch is None:
+            from .utils import request_retry as fetch
+        self.fn = fetch
+        self.host_limit = host_limit
+        self.sem = asyncio.Semaphore(limit)
+        self.host_sems = {}
+        self.inflight = {}
+        self.executor = ThreadPoolExecutor(limit, thread_name_prefix='geosys')
+
+    def _host_sem(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.host_sems:
+            self.host_sems[host] = asyncio.Semaphore(self.host_limit)
+        return self.host_sems[host]
+
+    async def _fetch(self, url):
+        # take the host slot first, a request waiting on a busy host should
+        # not hold one of the global slots
+        async with self._host_sem(url), self.sem:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.fn, url)
+
+    async def fetch(self, url):
+        """
+        awaits of the same normalized url share one fetch and its slots
+        """
+        key = normalize_url(url)
+        if key not in self.inflight:
+            task = self.inflight[key] = asyncio.ensure_future(self._fetch(url))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # a cancelled waiter must not cancel the fetch of the others
+        return await asyncio.shield(self.inflight[key])
+
+    async def fetch_all(self, urls):
+        return await asyncio.gather(*map(self.fetch, urls))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -8,7 +8,7 @@ def load_xml(f, fix_err=False):
     if not fix_err:
         return etree.parse(f)
 
-    s = open(f).read()
+    s = open(f, 'rb').read()
     s = fix_xml_error(s)
     return etree.fromstring(s)
 
@@ -0,0 +1,142 @@
+import os
+import json
+from pathlib import Path
+import numpy as np
+from ._cvt_geosys import lib
+from .cvt_geosys import (
+    get_china_index, _ptr, _check_mask, _map_chunks, _wgs84_to_gcj02_batch,
+    gcj02_to_wgs84_newton)
+from .metrics import log
+
+# grid steps in degrees (lat, lng), the gcj02 offset has a 1/3 degree period
+# term in lng, so lng needs the finer step. with these steps bilinear
+# interpolation stays within GCJ02_LUT_ERR of the exact kernel
+GCJ02_LUT_STEPS = (1 / 64, 1 / 384)
+GCJ02_LUT_ERR = 0.01  # meters
+GCJ02_LUT_MARGIN = 0.25  # degrees around the china border bbox
+GCJ02_LUT_DIR = Path(os.environ.get(
+    'GEOSYS_CACHE_DIR', Path.home() / '.cache' / 'geosys'))
+
+class OffsetLUT:
+    """
+    (dlat, dlng) offsets of a conversion sampled on a regular lat/lng grid,
+    saved as a (2, ny, nx) float32 .npy with a .json sidecar for the grid,
+    loaded memory mapped and interpolated bilinearly
+    """
+    def __init__(self, table, origin, steps):
+        self.table = np.require(table, np.float32, 'C')
+        self.origin = tuple(origin)
+        self.steps = tuple(steps)
+
+    @classmethod
+    def build(cls, fn, bounds, steps, f=None, block=256):
+        """
+        sample fn(y, x) -> converted [lat, lng] over bounds
+        (lat0, lng0, lat1, lng1), written block by block to f if given.
+        f and its sidecar appear once complete, a table is never partial
+        """
+        lat0, lng0, lat1, lng1 = bounds
+        ny = int(np.ceil((lat1 - lat0) / steps[0])) + 1
+        nx = int(np.ceil((lng1 - lng0) / steps[1])) + 1
+        shape = (2, ny, nx)
+        if f:
+            f = Path(f)
+            f.parent.mkdir(parents=True, exist_ok=True)
+            tmp = f.with_name('{}.{}.tmp.npy'.format(f.stem, os.getpid()))
+            table = np.lib.format.open_memmap(
+                tmp, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            table = np.empty(shape, dtype=np.float32)
+
+        xs = lng0 + np.arange(nx) * steps[1]
+        for i in range(0, ny, block):
+            ys = lat0 + np.arange(i, min(i + block, ny)) * steps[0]
+            y, x = np.meshgrid(ys, xs, indexing='ij')
+            table[:, i: i + block] = fn(y, x) - (y, x)
+
+        lut = cls(table, (lat0, lng0), steps)
+        if f:
+            table.flush()
+            lut.save_meta(tmp)
+            # the sidecar first, a table on disk always has one
+            os.replace(tmp.with_suffix('.json'), f.with_suffix('.json'))
+            os.replace(tmp, f)
+        return lut
+
+    def save_meta(self, f):
+        json.dump({'origin': self.origin, 'steps': self.steps},
+                  open(Path(f).with_suffix('.json'), 'w'))
+
+    def save(self, f):
+        np.save(f, self.table)
+        self.save_meta(f)
+
+    @classmethod
+    def load(cls, f, mmap_mode='r'):
+        meta = json.load(open(Path(f).with_suffix('.json')))
+        return cls(np.load(f, mmap_mode=mmap_mode), **meta)
+
+    def kernel(self, y, x, mask, oy, ox):
+        _, ny, nx = self.table.shape
+        lib.offset_lut_batch(
+            _ptr(self.table, 'float *'), ny, nx, *self.origin, *self.steps,
+            _ptr(y), _ptr(x), _ptr(mask, 'unsigned char *'),
+            _ptr(oy), _ptr(ox), y.size)
+
+    def apply(self, y, x, out, mask=None, workers=1):
+        """
+        out = (y, x) + interpolated offsets where mask, else (y, x).
+        y, x and out are C-contiguous float64 as from _prepare_batch
+        """
+        mask = _check_mask(mask, y.shape)
+        _map_chunks(self.kernel, (y, x, mask, out[0, ...], out[1, ...]),
+                    workers)
+        return out
+
+
+def china_lut_bounds(margin=GCJ02_LUT_MARGIN):
+    bboxes = np.array([i.bbox for i in get_china_index()])
+    lat0, lng0 = bboxes[:, :2].min(axis=0) - margin
+    lat1, lng1 = bboxes[:, 2:].max(axis=0) + margin
+    return float(lat0), float(lng0), float(lat1), float(lng1)
+
+def _wgs84_to_gcj02_grid(y, x):
+    out = np.empty((2,) + y.shape)
+    _wgs84_to_gcj02_batch(y, x, None, out)
+    return out
+
+def _gcj02_to_wgs84_grid(y, x):
+    return gcj02_to_wgs84_newton(y, x)[0]
+
+
+cache = {}
+def _lut_key(inverse, lut_dir):
+    name = 'gcj02_to_wgs84' if inverse else 'wgs84_to_gcj02'
+    return name, Path(lut_dir or GCJ02_LUT_DIR)
+
+def build_gcj02_lut(inverse=False, lut_dir=None):
+    """
+    build the offset table get_gcj02_lut loads and save it under lut_dir.
+    a table is 2 x 2290 x 23752 float32, 435MB on disk, and takes ~11s for
+    wgs84_to_gcj02 and ~75s for the newton inverse on one core
+    """
+    k = _lut_key(inverse, lut_dir)
+    f = k[1] / (k[0] + '.npy')
+    log('building', f)
+    fn = _gcj02_to_wgs84_grid if inverse else _wgs84_to_gcj02_grid
+    cache[k] = OffsetLUT.build(fn, china_lut_bounds(), GCJ02_LUT_STEPS, f=f)
+    return cache[k]
+
+def get_gcj02_lut(inverse=False, lut_dir=None):
+    """
+    memory mapped offset table of wgs84_to_gcj02, or of gcj02_to_wgs84 when
+    inverse. a missing table is built by build_gcj02_lut on first use, run
+    it ahead to keep that out of the first mode='lut' call
+    """
+    k = _lut_key(inverse, lut_dir)
+    if k not in cache:
+        f = k[1] / (k[0] + '.npy')
+        if not f.exists():
+            return build_gcj02_lut(inverse, lut_dir)
+        cache[k] = OffsetLUT.load(f)
+    return cache[k]
@@ -1,13 +1,26 @@
+import os
+import json
 import math as M
-from shapely.geometry import Point
-from .cvt_geosys import gcj02_to_wgs84, wgs84_to_gcj02
+# numpy, shapely and cvt_geosys are imported by the functions needing them,
+# so scripts only using the url templates start fast
+
+# every template can be replaced by the environment variable GEOSYS_<NAME>,
+# e.g. to point the crawlers at a geosys.standin server. the upstream
+# templates stay in URL_DEFAULTS
+URL_DEFAULTS = {}
+def _url(name, default):
+    URL_DEFAULTS[name] = default
+    return os.environ.get('GEOSYS_' + name, default)
+
 
 MAP_TYPES = ['qmap']
 QMAP_PANO_ADDR = 'http://sv.map.qq.com'
-QMAP_PANO_BY_ID_URL = QMAP_PANO_ADDR + '/sv?svid={id}'
-QMAP_PANO_BY_YX_URL = QMAP_PANO_ADDR + '/xf?x={x}&y={y}&r=500&cb=0'
-QMAP_PANO_IMG_URL = \
-    'http://sv{server}.map.qq.com/tile?svid={id}&x={pan}&y={tilt}&level={zoom}'
+QMAP_PANO_BY_ID_URL = _url('QMAP_PANO_BY_ID_URL', QMAP_PANO_ADDR + '/sv?svid={id}')
+QMAP_PANO_BY_YX_URL = _url(
+    'QMAP_PANO_BY_YX_URL', QMAP_PANO_ADDR + '/xf?x={x}&y={y}&r=500&cb=0')
+QMAP_PANO_IMG_URL = _url(
+    'QMAP_PANO_IMG_URL',
+    'http://sv{server}.map.qq.com/tile?svid={id}&x={pan}&y={tilt}&level={zoom}')
 
 AMAP_PANO_ADDR = "http://wsv.amap.com"
 AMAP_PANO_BY_ID_URL = AMAP_PANO_ADDR + "/AnGeoPanoramaServer?data=vector&id={id}"
@@ -20,9 +33,12 @@ AMAP_PANO_IMG_URL = \
     "data=image&id={id}&level={zoom}&x={pan}&y={tilt}"
 
 
-BMAP_PANO_IMG_URL = \
-    "http://mapsv{server}.bdimg.com/scape/?"\
-    "qt=pdata&sid={id}&pos={tilt}_{pan}&z={zoom}"
+BMAP_PANO_BY_ID_URL = _url(
+    'BMAP_PANO_BY_ID_URL', "https://mapsv0.bdimg.com/?qt=sdata&sid={id}")
+BMAP_PANO_IMG_URL = _url(
+    'BMAP_PANO_IMG_URL',
+    "http://mapsv{server}.bdimg.com/scape/?"
+    "qt=pdata&sid={id}&pos={tilt}_{pan}&z={zoom}")
 
 GMAP_PANO_IMG_URL = \
     "http://geo{server}.ggpht.com/cbk?"\
@@ -34,6 +50,7 @@ QMAP_K2 = 0.017453292519943295
 
 def qmap_ll2yx(lat, lng, is_gcj02=True):
     if is_gcj02:
+        from .cvt_geosys import wgs84_to_gcj02
         lat, lng = wgs84_to_gcj02(lat, lng)
     x = QMAP_K0 * lng
     y = QMAP_K0 * M.log(M.tan(QMAP_K1 * (90 + lat))) / QMAP_K2
@@ -43,10 +60,50 @@ def qmap_yx2ll(y, x, is_gcj02=True):
     lng = x / QMAP_K0
     lat = M.atan(M.exp(QMAP_K2 * y / QMAP_K0)) / QMAP_K1 - 90
     if is_gcj02:
+        from .cvt_geosys import gcj02_to_wgs84
         lat, lng = gcj02_to_wgs84(lat, lng)
     return lat, lng
 
+def qmap_ll2yx_batch(lat, lng, is_gcj02=True, out=None, dtype=None):
+    """
+    array version of qmap_ll2yx, return (out [y, x] of shape (2, ...), valid)
+    with nan for |lat| >= 85, see ll2merc_batch
+    """
+    import numpy as np
+    from .cvt_geosys import wgs84_to_gcj02_batch, prepare_proj, set_invalid
+    lat, lng, y, x, out = prepare_proj(lat, lng, out, dtype)
+    valid = np.abs(lat) < 85
+    if is_gcj02:
+        (lat, lng), _ = wgs84_to_gcj02_batch(lat, lng)
+    np.multiply(lng, QMAP_K0, out=x)
+    np.add(lat, 90, out=y)
+    y *= QMAP_K1
+    np.tan(y, out=y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.log(y, out=y)
+    y *= QMAP_K0 / QMAP_K2
+    return out, set_invalid(valid, y, x)
+
+def qmap_yx2ll_batch(y, x, is_gcj02=True, out=None, dtype=None):
+    """
+    array version of qmap_yx2ll, return (out [lat, lng] of shape (2, ...), valid)
+    """
+    import numpy as np
+    from .cvt_geosys import gcj02_to_wgs84_batch, prepare_proj, set_invalid
+    y, x, lat, lng, out = prepare_proj(y, x, out, dtype)
+    np.divide(x, QMAP_K0, out=lng)
+    np.multiply(y, QMAP_K2 / QMAP_K0, out=lat)
+    np.exp(lat, out=lat)
+    np.arctan(lat, out=lat)
+    lat /= QMAP_K1
+    lat -= 90
+    if is_gcj02:
+        out[...], _ = gcj02_to_wgs84_batch(lat, lng)
+    return out, set_invalid(np.isfinite(y) & np.isfinite(x), lat, lng)
+
 def qmap_parse_pano_info(pano, bnd=None):
+    from shapely.geometry import Point
+    from .cvt_geosys import gcj02_to_wgs84
     if pano is None or pano.find('error') is not None:
         return
 
@@ -78,3 +135,14 @@ def qmap_parse_pano_info(pano, bnd=None):
         },
         'links': links
     }
+
+# the pano info servers answer unknown ids with status 200, these keep such
+# answers out of the response cache as request_retry cache_ok
+def qmap_pano_ok(bs):
+    return b'<error' not in bs
+
+def bmap_pano_ok(bs):
+    try:
+        return json.loads(bs)['result']['error'] == 0
+    except (ValueError, KeyError, TypeError):
+        return False
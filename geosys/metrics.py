@@ -0,0 +1,180 @@
+import json
+import time
+import atexit
+from pathlib import Path
+from bisect import bisect_left
+from threading import Lock, Thread, Event
+from contextlib import contextmanager
+
+# upper bounds in seconds, +Inf is implied
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_DUMP_INTERVAL = 10  # seconds
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def cumulative(self):
+        out, n = [], 0
+        for i in self.counts:
+            n += i
+            out.append(n)
+        return out
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q quantile
+        """
+        if not self.count:
+            return 0.
+        k = q * self.count
+        for le, n in zip(self.buckets + (float('inf'),), self.cumulative()):
+            if n >= k:
+                return le
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _prom_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', r'\"'))
+                          for k, v in labels) + '}'
+
+class Metrics:
+    """
+    thread safe counters and histograms keyed by name and labels, with
+    json and prometheus text snapshots
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0) + value
+
+    def observe(self, name, value, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            if k not in self.histograms:
+                self.histograms[k] = Histogram()
+            self.histograms[k].observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def get(self, name, **labels):
+        return self.counters.get(_key(name, labels), 0)
+
+    def snapshot(self):
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': v}
+                for (name, labels), v in sorted(self.counters.items())]
+            histograms = [
+                {'name': name, 'labels': dict(labels), 'count': h.count,
+                 'sum': h.sum, 'p50': h.quantile(0.5), 'p99': h.quantile(0.99),
+                 'buckets': dict(zip(map(str, h.buckets + ('+Inf',)),
+                                     h.cumulative()))}
+                for (name, labels), h in sorted(self.histograms.items())]
+        return {'time': time.time(), 'uptime': time.time() - self.started,
+                'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for (name, labels), v in sorted(self.counters.items()):
+                lines.append('{}{} {}'.format(name, _prom_labels(labels), v))
+            for (name, labels), h in sorted(self.histograms.items()):
+                for le, n in zip(h.buckets + ('+Inf',), h.cumulative()):
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _prom_labels(labels, le=le), n))
+                lines.append('{}_sum{} {}'.format(name, _prom_labels(labels), h.sum))
+                lines.append('{}_count{} {}'.format(
+                    name, _prom_labels(labels), h.count))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, f):
+        """
+        write a snapshot to f, prometheus text unless f ends with .json
+        """
+        f = Path(f)
+        if f.suffix == '.json':
+            s = json.dumps(self.snapshot(), indent=2)
+        else:
+            s = self.to_prometheus()
+        tmp = f.with_name(f.name + '.tmp')
+        tmp.write_text(s)
+        tmp.replace(f)
+
+    def start_dump(self, f, interval=METRICS_DUMP_INTERVAL):
+        """
+        dump to f every interval seconds from a daemon thread and at exit
+        """
+        stop = Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.dump(f)
+        Thread(target=run, daemon=True, name='geosys-metrics').start()
+
+        def final():
+            stop.set()
+            self.dump(f)
+        atexit.register(final)
+        return final
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+cache = {'quiet': False}
+def get_metrics():
+    if 'metrics' not in cache:
+        cache['metrics'] = Metrics()
+    return cache['metrics']
+
+def set_quiet(quiet=True):
+    """
+    quiet drops the per request lines of log, warnings still print
+    """
+    cache['quiet'] = quiet
+
+def log(*args):
+    if not cache['quiet']:
+        print(*args)
+
+def url_labels(url):
+    """
+    host and endpoint labels of url, the endpoint is the path plus the
+    qt or data query parameter that selects the api on baidu and amap
+    """
+    from urllib.parse import urlsplit, parse_qs
+    parts = urlsplit(url)
+    endpoint = parts.path or '/'
+    query = parse_qs(parts.query)
+    for k in 'qt', 'data':
+        if k in query:
+            endpoint += '?{}={}'.format(k, query[k][0])
+            break
+    return {'host': parts.netloc, 'endpoint': endpoint}
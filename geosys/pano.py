@@ -0,0 +1,433 @@
+import os
+import mmap
+import json
+import shutil
+import struct
+import asyncio
+import tempfile
+import math as M
+from io import BytesIO
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+PANO_TILE_W = 512
+# canvases shared between processes live in files here, in memory if it can
+PANO_SLOT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def align(x, dx):
+    return M.ceil(x / dx) * dx
+
+def pano_size(w, zoom, tile_w=PANO_TILE_W):
+    """
+    (w, h) at zoom of a pano w wide at full resolution, halved until it
+    fits 2**zoom tiles
+    """
+    while w > tile_w * 2**zoom:
+        w /= 2
+    return int(w), int(w / 2)
+
+def get_tile_grid(w, h, tile_w=PANO_TILE_W):
+    return [(ti, pi) for ti in range(int(h / tile_w))
+            for pi in range(int(w / tile_w))]
+
+def as_image(buf, size=None):
+    """
+    RGBX PIL image over the (h, w, 4) uint8 buf without a copy, size (w, h)
+    crops it from the top left through the row stride. pastes write into buf
+    """
+    h, w = buf.shape[:2]
+    img = Image.frombuffer(
+        'RGBX', size or (w, h), buf, 'raw', 'RGBX', buf.strides[0], 1)
+    # mapped images are flagged read only, so paste would copy them first
+    img.readonly = 0
+    return img
+
+def decode_tile(content, tile_w=PANO_TILE_W):
+    """
+    the tile image of content, None if it is missing, broken or not
+    tile_w wide
+    """
+    if content is None:
+        return
+    try:
+        img = Image.open(BytesIO(content))
+        img.load()
+    except OSError:
+        return
+    if img.size[0] != tile_w:
+        return
+    return img
+
+def save_image(img, out_f, **kws):
+    """
+    save an RGBX or RGB image, out_f only appears once complete
+    """
+    out_f = Path(out_f)
+    fmt = Image.registered_extensions().get(out_f.suffix.lower())
+    if fmt != 'JPEG':
+        img = img.convert('RGB')
+    tmp = out_f.with_name(out_f.name + '.tmp')
+    img.save(tmp, fmt, **kws)
+    tmp.replace(out_f)
+
+def paste_tiles(buf, contents, tile_grid, out_f, tile_w=PANO_TILE_W):
+    """
+    decode the tiles into buf, False if one is missing or broken
+    """
+    canvas = as_image(buf)
+    for (ti, pi), content in zip(tile_grid, contents):
+        img = decode_tile(content, tile_w)
+        if img is None:
+            why = 'failed' if content is None else 'is not a tile image'
+            print(f'{out_f} tile {ti} {pi} {why}, skip')
+            return False
+        canvas.paste(img, (pi * tile_w, ti * tile_w))
+    return True
+
+
+class CanvasSlots:
+    """
+    nr canvases of size in files under root, so the stitch and encode
+    stages of a pipeline can map the same canvas from other processes.
+    get() waits for a free one, which bounds the panos in memory to nr.
+    each is w * h * 4 bytes of /dev/shm, or of the temp dir when /dev/shm
+    is too small: 32MB for a 4096 wide pano, 128MB for 8192 wide
+    """
+    def __init__(self, size, nr, root=PANO_SLOT_DIR):
+        w, h = size
+        self.shape = h, w, 4
+        if root and shutil.disk_usage(root).free < nr * h * w * 4:
+            root = None  # a small /dev/shm, as in containers
+        self.dir = Path(tempfile.mkdtemp(prefix='geosys-canvas-', dir=root))
+        self.free = asyncio.Queue()
+        for i in range(nr):
+            f = self.dir / str(i)
+            with open(f, 'wb') as fp:
+                fp.truncate(h * w * 4)
+            self.free.put_nowait(str(f))
+
+    async def get(self):
+        return await self.free.get()
+
+    def put(self, f):
+        self.free.put_nowait(f)
+
+    def close(self):
+        for k in [k for k in _slot_maps if Path(k[0]).parent == self.dir]:
+            del _slot_maps[k]
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_slot_maps = {}  # (slot file, shape): its map in this process
+def map_slot(f, shape):
+    """
+    the canvas in slot file f, mapped once per process
+    """
+    k = f, shape
+    if k not in _slot_maps:
+        _slot_maps[k] = np.memmap(f, np.uint8, 'r+', shape=shape)
+    return _slot_maps[k]
+
+def stitch_slot(f, shape, contents, tile_grid, out_f, tile_w=PANO_TILE_W):
+    return paste_tiles(map_slot(f, shape), contents, tile_grid, out_f, tile_w)
+
+def encode_slot(f, shape, real_size, out_f, factor=1):
+    """
+    write the canvas in slot f, box downsampled by factor
+    """
+    img = as_image(map_slot(f, shape), real_size)
+    if factor > 1:
+        img = img.reduce(factor)
+    save_image(img, out_f)
+    return True
+
+
+# a pano in one file with the tiles kept as downloaded:
+#   magic | tile bytes ... | index | json meta | trailer | magic
+# the index rows are TILE_INDEX_DTYPE, the trailer is (index offset,
+# index rows, meta length) as TILE_TRAILER
+TILE_MAGIC = b'GEOTILE1'
+TILE_INDEX_DTYPE = np.dtype([
+    ('zoom', '<u1'), ('tilt', '<u2'), ('pan', '<u2'),
+    ('offset', '<u8'), ('length', '<u4')])
+TILE_TRAILER = struct.Struct('<QQI')
+
+def check_tile(content, tile_w=PANO_TILE_W):
+    """
+    True if content is an image tile_w wide, from its header only
+    """
+    if not content:
+        return False
+    try:
+        return Image.open(BytesIO(content)).size[0] == tile_w
+    except OSError:
+        return False
+
+def write_tile_archive(f, tiles, **meta):
+    """
+    write tiles {(zoom, tilt, pan): bytes} to f unchanged, meta as
+    TileArchive.meta
+    """
+    f = Path(f)
+    tmp = f.with_name(f.name + '.tmp')
+    index = np.zeros(len(tiles), TILE_INDEX_DTYPE)
+    with open(tmp, 'wb') as fp:
+        fp.write(TILE_MAGIC)
+        for row, (k, content) in zip(index, sorted(tiles.items())):
+            row['zoom'], row['tilt'], row['pan'] = k
+            row['offset'], row['length'] = fp.tell(), len(content)
+            fp.write(content)
+        index_offset = fp.tell()
+        fp.write(index.tobytes())
+        meta = json.dumps(meta).encode()
+        fp.write(meta)
+        fp.write(TILE_TRAILER.pack(index_offset, len(index), len(meta)))
+        fp.write(TILE_MAGIC)
+    tmp.replace(f)
+
+def save_tile_archive(contents, tile_grid, size, real_size, out_f, zoom=0,
+                      tile_w=PANO_TILE_W):
+    """
+    the no re-encode counterpart of stitch_slot, the tiles are checked
+    from their headers and written to a tile archive at out_f
+    """
+    for (ti, pi), content in zip(tile_grid, contents):
+        if not check_tile(content, tile_w):
+            why = 'failed' if content is None else 'is not a tile image'
+            print(f'{out_f} tile {ti} {pi} {why}, skip')
+            return False
+    tiles = {(zoom, ti, pi): c for (ti, pi), c in zip(tile_grid, contents)}
+    write_tile_archive(out_f, tiles, zoom=zoom, tile_w=tile_w, size=size,
+                       real_size=real_size)
+    return True
+
+class TileArchive:
+    """
+    memory mapped reader of write_tile_archive files, tiles are returned
+    as memoryviews of the map, regions are decoded from the tiles they
+    overlap
+    """
+    def __init__(self, f):
+        self.fp = open(f, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        n = len(TILE_MAGIC)
+        if self.mm[:n] != TILE_MAGIC or self.mm[-n:] != TILE_MAGIC:
+            self.close()
+            raise ValueError('not a tile archive: {}'.format(f))
+        end = len(self.mm) - n - TILE_TRAILER.size
+        index_offset, nr, meta_len = TILE_TRAILER.unpack_from(self.mm, end)
+        self.index = np.frombuffer(
+            self.mm, TILE_INDEX_DTYPE, nr, index_offset)
+        self.meta = json.loads(self.mm[end - meta_len: end])
+        self.rows = {(int(i['zoom']), int(i['tilt']), int(i['pan'])): j
+                     for j, i in enumerate(self.index)}
+
+    @property
+    def zooms(self):
+        return sorted({k[0] for k in self.rows})
+
+    def tile(self, ti, pi, zoom=None):
+        zoom = self.meta['zoom'] if zoom is None else zoom
+        i = self.rows.get((zoom, ti, pi))
+        if i is None:
+            return
+        row = self.index[i]
+        start = int(row['offset'])
+        return memoryview(self.mm)[start: start + int(row['length'])]
+
+    def region(self, box=None, zoom=None):
+        """
+        RGB image of box (x0, y0, x1, y1) in pixels of zoom, the real size
+        of the pano by default
+        """
+        zoom = self.meta['zoom'] if zoom is None else zoom
+        tile_w = self.meta['tile_w']
+        if box is None:
+            scale = 2 ** (zoom - self.meta['zoom'])
+            box = (0, 0) + tuple(int(i * scale) for i in self.meta['real_size'])
+        x0, y0, x1, y1 = box
+        out = Image.new('RGB', (x1 - x0, y1 - y0))
+        for ti in range(y0 // tile_w, (y1 - 1) // tile_w + 1):
+            for pi in range(x0 // tile_w, (x1 - 1) // tile_w + 1):
+                content = self.tile(ti, pi, zoom)
+                if content is None:
+                    continue
+                img = Image.open(BytesIO(content))
+                out.paste(img, (pi * tile_w - x0, ti * tile_w - y0))
+        return out
+
+    def close(self):
+        # views of the map must be released before it closes
+        self.index = None
+        if hasattr(self, 'mm'):
+            self.mm.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TileManifest:
+    """
+    resume state of a download under root, a row of bits per pano: bit 0
+    is set once the pano is written, bit 1 + i once tile i is kept by
+    PartialTiles. the rows are a memory mapped file, their pids a text
+    file appended to, so loading the state of 100k panos reads two files
+    """
+    def __init__(self, root, tile_nr):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta_f = self.root / 'manifest.json'
+        if meta_f.exists():
+            meta = json.load(open(meta_f))
+            if meta['tile_nr'] != tile_nr:
+                raise ValueError('{} is for {} tiles, not {}'.format(
+                    meta_f, meta['tile_nr'], tile_nr))
+        else:
+            json.dump({'tile_nr': tile_nr}, open(meta_f, 'w'))
+        self.tile_nr = tile_nr
+        self.row_bytes = (tile_nr + 8) // 8
+        self.pids_f = self.root / 'pids.txt'
+        self.bits_f = self.root / 'bits'
+        pids = self.pids_f.read_text().split() if self.pids_f.exists() else []
+        self.rows = {pid: i for i, pid in enumerate(pids)}
+        self.pids_fp = open(self.pids_f, 'a')
+        self.bits = None
+        self._map(max(len(pids), 1024))
+
+    def _map(self, capacity):
+        size = capacity * self.row_bytes
+        if not self.bits_f.exists() or self.bits_f.stat().st_size < size:
+            with open(self.bits_f, 'ab') as fp:
+                fp.truncate(size)
+        if self.bits is not None:
+            self.bits.flush()
+        self.bits = np.memmap(self.bits_f, np.uint8, 'r+').reshape(
+            -1, self.row_bytes)
+
+    def row(self, pid, add=True):
+        i = self.rows.get(pid)
+        if i is None:
+            if not add:
+                return
+            i = self.rows[pid] = len(self.rows)
+            self.pids_fp.write(pid + '\n')
+            self.pids_fp.flush()
+            if i >= len(self.bits):
+                self._map(2 * len(self.bits))
+        return self.bits[i]
+
+    def _get(self, pid, bit):
+        row = self.row(pid, add=False)
+        return row is not None and bool(row[bit >> 3] & (1 << (bit & 7)))
+
+    def _set(self, pid, bit):
+        row = self.row(pid)
+        row[bit >> 3] |= 1 << (bit & 7)
+
+    def _clear(self, pid, bit):
+        row = self.row(pid, add=False)
+        if row is not None:
+            row[bit >> 3] &= ~(1 << (bit & 7)) & 0xff
+
+    def is_done(self, pid):
+        return self._get(pid, 0)
+
+    def set_done(self, pid):
+        self._set(pid, 0)
+
+    def clear_done(self, pid):
+        self._clear(pid, 0)
+
+    def has_tile(self, pid, i):
+        return self._get(pid, i + 1)
+
+    def set_tile(self, pid, i):
+        self._set(pid, i + 1)
+
+    def tiles(self, pid):
+        """
+        indices of the tiles kept for pid
+        """
+        row = self.row(pid, add=False)
+        if row is None:
+            return []
+        bits = np.unpackbits(row, bitorder='little')[1: self.tile_nr + 1]
+        return np.flatnonzero(bits).tolist()
+
+    def done_mask(self, pids):
+        rows = np.array([self.rows.get(i, -1) for i in pids], dtype=np.int64)
+        out = np.zeros(len(pids), bool)
+        ok = rows >= 0
+        out[ok] = self.bits[rows[ok], 0] & 1
+        return out
+
+    def close(self):
+        self.bits.flush()
+        self.pids_fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class PartialTiles:
+    """
+    tiles of unfinished panos, a file per pano of (tile index, length)
+    records each followed by the tile bytes. a record cut short by a crash
+    is dropped on load
+    """
+    record = struct.Struct('<II')
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.fps = {}
+
+    def path(self, pid):
+        return self.root / (pid + '.part')
+
+    def load(self, pid):
+        f = self.path(pid)
+        if not f.exists():
+            return {}
+        bs, out, off = f.read_bytes(), {}, 0
+        while off + self.record.size <= len(bs):
+            i, n = self.record.unpack_from(bs, off)
+            off += self.record.size
+            if off + n > len(bs):
+                break
+            out[i] = bs[off: off + n]
+            off += n
+        return out
+
+    def append(self, pid, i, content):
+        fp = self.fps.get(pid)
+        if fp is None:
+            fp = self.fps[pid] = open(self.path(pid), 'ab')
+        fp.write(self.record.pack(i, len(content)) + content)
+        fp.flush()
+
+    def close(self, pid):
+        fp = self.fps.pop(pid, None)
+        if fp:
+            fp.close()
+
+    def remove(self, pid):
+        self.close(pid)
+        self.path(pid).unlink(missing_ok=True)
+
+    def close_all(self):
+        for pid in list(self.fps):
+            self.close(pid)
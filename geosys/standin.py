@@ -0,0 +1,289 @@
+import re
+import json
+import time
+import zlib
+import random
+import threading
+from io import BytesIO
+from pathlib import Path
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .maps import URL_DEFAULTS
+
+# a local stand-in for the pano servers, replaying recorded responses:
+#   qmap info   <root>/**/<svid>.xml  as saved by grab_region_pano_info
+#   bmap sdata  <root>/**/<sid>.json  as saved by grab_line_pano_info
+#   tiles       <root>/record/tiles/<map>/<id>/<zoom>_<tilt>_<pan>.jpg, else
+#               cut from a stitched pano <root>/**/<id>.jpg
+# misses are fetched from URL_DEFAULTS and saved under <root>/record when
+# recording
+STANDIN_ROOT = Path(__file__).parents[1] / 'samples' / 'data'
+STANDIN_TILE_W = 512
+STANDIN_PANO_W = 8192  # full width of qmap and bmap panos
+STANDIN_CHUNK = 16 << 10  # bytes written at a time when bandwidth is limited
+
+# template name: path and query of the stand-in url
+STANDIN_URLS = {
+    'QMAP_PANO_BY_ID_URL': '/qmap/sv?svid={id}',
+    'QMAP_PANO_BY_YX_URL': '/qmap/xf?x={x}&y={y}&r=500&cb=0',
+    'QMAP_PANO_IMG_URL': '/qmap/tile?svid={id}&x={pan}&y={tilt}&level={zoom}',
+    'BMAP_PANO_BY_ID_URL': '/bmap/?qt=sdata&sid={id}',
+    'BMAP_PANO_IMG_URL': '/bmap/scape/?qt=pdata&sid={id}&pos={tilt}_{pan}&z={zoom}',
+}
+# zoom in the url minus the zoom of download_map_pano
+STANDIN_Z_OFF = {'qmap': -3, 'bmap': 1}
+
+_qmap_basic = re.compile(rb'<basic [^>]*?\bx="([-0-9.]+)" y="([-0-9.]+)"')
+
+class Fixtures:
+    """
+    recorded responses found under root, indexed by pano id
+    """
+    def __init__(self, root=STANDIN_ROOT):
+        self.root = Path(root)
+        self.record_dir = self.root / 'record'
+        self.qmap, self.bmap, self.panos, self.qmap_yx = {}, {}, {}, {}
+        for f in self.root.rglob('*'):
+            self.add(f)
+
+    def add(self, f):
+        if f.suffix == '.xml':
+            self.qmap[f.stem] = f
+            m = _qmap_basic.search(f.read_bytes())
+            if m:
+                self.qmap_yx[f.stem] = float(m[2]), float(m[1])
+        elif f.suffix == '.json':
+            self.bmap[f.stem] = f
+        elif f.suffix == '.jpg' and 'tiles' not in f.relative_to(self.root).parts:
+            self.panos[f.stem] = f
+
+    def nearest_qmap(self, y, x, r):
+        best, best_d = None, r * r
+        for pid, (py, px) in self.qmap_yx.items():
+            d = (py - y) ** 2 + (px - x) ** 2
+            if d <= best_d:
+                best, best_d = pid, d
+        return best
+
+    def tile_f(self, map_type, pid, zoom, ti, pi):
+        return self.record_dir / 'tiles' / map_type / pid / \
+            '{}_{}_{}.jpg'.format(zoom, ti, pi)
+
+    def save(self, f, body):
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(body)
+        self.add(f)
+
+def _pick(index, pid):
+    # a stable stand-in for an unknown id
+    return sorted(index)[zlib.crc32(pid.encode()) % len(index)]
+
+
+@lru_cache(maxsize=16)
+def _load_pano(f):
+    from PIL import Image
+    img = Image.open(f)
+    img.load()
+    return img
+
+@lru_cache(maxsize=4096)
+def render_tile(f, w, ti, pi, quality=90):
+    """
+    jpeg of tile (ti, pi) of the pano f scaled to width w, black beyond
+    the pano like the real servers
+    """
+    from PIL import Image
+    img = _load_pano(f)
+    s = img.size[0] / w
+    tw = STANDIN_TILE_W
+    box = [round(i * s) for i in (pi * tw, ti * tw, (pi + 1) * tw, (ti + 1) * tw)]
+    tile = img.crop(box).resize((tw, tw), Image.BILINEAR)
+    buf = BytesIO()
+    tile.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        srv = self.server
+        parts = urlsplit(self.path)
+        q = dict(parse_qsl(parts.query))
+        route = parts.path.strip('/').replace('/', '_') or 'root'
+        if 'qt' in q:
+            route += '_' + q['qt']
+        fn = getattr(self, 'route_' + route, None)
+        with srv.lock:
+            srv.hits[route] = srv.hits.get(route, 0) + 1
+            r = srv.rng.random()
+            delay = srv.latency + srv.jitter * srv.rng.random()
+        if delay:
+            time.sleep(delay)
+
+        if fn is None:
+            return self.send(404)
+        if r < srv.error_rate:
+            return self.send(503)
+        if r < srv.error_rate + srv.throttle_rate:
+            return self.send(429, Retry_After='1')
+        try:
+            out = fn(q)
+        except (KeyError, ValueError):
+            return self.send(400)
+        if out is None:
+            return self.send(404)
+        body, ctype = out
+        self.send(200, body, Content_Type=ctype)
+
+    def send(self, status, body=b'', **headers):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k.replace('_', '-'), v)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for i in range(0, len(body), STANDIN_CHUNK):
+            chunk = body[i: i + STANDIN_CHUNK]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+    def fixture(self, index, pid, name, f, **kws):
+        """
+        body of index[pid], else recorded from upstream template name
+        """
+        srv = self.server
+        if pid not in index and srv.any_id and index:
+            pid = _pick(index, pid)
+        if pid in index:
+            return index[pid].read_bytes()
+        if not srv.record:
+            return
+        body = srv.upstream(name, id=pid, **kws)
+        if body:
+            srv.fixtures.save(f, body)
+        return body
+
+    def route_qmap_sv(self, q):
+        pid = q['svid']
+        f = self.server.fixtures.record_dir / 'pano_cache' / (pid + '.xml')
+        body = self.fixture(self.server.fixtures.qmap, pid,
+                            'QMAP_PANO_BY_ID_URL', f)
+        return body and (body, 'text/xml')
+
+    def route_qmap_xf(self, q):
+        pid = self.server.fixtures.nearest_qmap(
+            float(q['y']), float(q['x']), float(q.get('r', 500)))
+        detail = {}
+        if pid:
+            y, x = self.server.fixtures.qmap_yx[pid]
+            detail = {'svid': pid, 'x': str(x), 'y': str(y)}
+        body = json.dumps({'detail': detail})
+        if 'cb' in q:
+            body = '{}({});'.format(q['cb'], body)
+        return body.encode(), 'application/javascript'
+
+    def route_bmap_sdata(self, q):
+        pid = q['sid']
+        f = self.server.fixtures.record_dir / 'cache' / (pid + '.json')
+        body = self.fixture(self.server.fixtures.bmap, pid,
+                            'BMAP_PANO_BY_ID_URL', f)
+        return body and (body, 'application/json')
+
+    def tile(self, map_type, pid, zoom, ti, pi, name):
+        srv = self.server
+        fixtures = srv.fixtures
+        f = fixtures.tile_f(map_type, pid, zoom, ti, pi)
+        if f.exists():
+            return f.read_bytes(), 'image/jpeg'
+
+        panos = fixtures.panos
+        if pid not in panos and srv.any_id and panos:
+            pid = _pick(panos, pid)
+        if pid in panos:
+            w = min(STANDIN_TILE_W << max(zoom - STANDIN_Z_OFF[map_type], 0),
+                    STANDIN_PANO_W)
+            if ti * STANDIN_TILE_W >= w / 2 or pi * STANDIN_TILE_W >= w:
+                return
+            return render_tile(str(panos[pid]), w, ti, pi), 'image/jpeg'
+
+        if srv.record:
+            body = srv.upstream(name, id=pid, zoom=zoom, tilt=ti, pan=pi)
+            if body:
+                fixtures.save(f, body)
+                return body, 'image/jpeg'
+
+    def route_qmap_tile(self, q):
+        return self.tile('qmap', q['svid'], int(q['level']), int(q['y']),
+                         int(q['x']), 'QMAP_PANO_IMG_URL')
+
+    def route_bmap_scape_pdata(self, q):
+        ti, pi = map(int, q['pos'].split('_'))
+        return self.tile('bmap', q['sid'], int(q['z']), ti, pi,
+                         'BMAP_PANO_IMG_URL')
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    serves the pano url templates of geosys.maps from Fixtures, with
+    injected latency (+ uniform jitter) in seconds, a fraction of 503s
+    (error_rate) and 429s (throttle_rate) and a bandwidth limit in
+    bytes/s per response. any_id serves unknown ids from some fixture,
+    record fetches misses from the real servers and saves them
+    """
+    daemon_threads = True
+
+    def __init__(self, root=STANDIN_ROOT, host='127.0.0.1', port=0,
+                 latency=0., jitter=0., error_rate=0., throttle_rate=0.,
+                 bandwidth=0, any_id=False, record=False, seed=0):
+        super().__init__((host, port), StandInHandler)
+        self.fixtures = Fixtures(root)
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.throttle_rate = error_rate, throttle_rate
+        self.bandwidth = bandwidth
+        self.any_id, self.record = any_id, record
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def templates(self):
+        return {k: self.url + v for k, v in STANDIN_URLS.items()}
+
+    def env(self):
+        """
+        environment pointing geosys.maps of a new process at this server
+        """
+        return {'GEOSYS_' + k: v for k, v in self.templates().items()}
+
+    def upstream(self, name, **kws):
+        from .utils import request_retry
+        return request_retry(URL_DEFAULTS[name].format(server=0, **kws))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.thread:
+            self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
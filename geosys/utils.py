@@ -1,60 +1,157 @@
 import re
 import json
-from time import sleep
-from urllib.request import urlopen
+from time import sleep, perf_counter
 from urllib.error import HTTPError
-from lxml import etree
-
-_xml_formatter = {
-    '&': '&amp;',
-    '<': '&lt;',
-    '>': '&gt;',
-    "'": '&apos;',
-    '"': '&quot;',
-}
-_xml_re = re.compile('&....')
+
+# a & that does not start one of the xml predefined entities or a character
+# reference is a raw ampersand the server forgot to escape
+_xml_amp = rb'&(?!(?:amp|lt|gt|apos|quot|#[0-9]+|#x[0-9a-fA-F]+);)'
+_xml_re = re.compile(_xml_amp.decode())
+_xml_re_b = re.compile(_xml_amp)
 def fix_xml_error(s):
-    for i in _xml_re.findall(s):
-        if any(i.startswith(j) for j in _xml_formatter.values()):
-            continue
-        s = re.sub(i, '&amp;' + i[1:], s)
-    return s
+    """
+    escape raw ampersands in one pass over str or bytes
+    """
+    if isinstance(s, str):
+        return _xml_re.sub('&amp;', s)
+    return _xml_re_b.sub(b'&amp;', s)
 
 
 TIMEOUT_BASE = 4  # seconds
+TIMEOUT_MAX = 64
+
+def enable_response_cache(root=None, **kws):
+    """
+    keep raw response bodies of request_retry on disk under root, see
+    geosys.http_.ResponseCache for ttl and max_bytes
+    """
+    from .http_ import set_response_cache, HTTP_CACHE_DIR
+    return set_response_cache(root or HTTP_CACHE_DIR, **kws)
+
+def disable_response_cache():
+    from .http_ import set_response_cache
+    set_response_cache(None)
+
+def request_retry(url, retry=8, verbose=False, cache_ok=None):
+    """
+    GET url through the response cache when enabled, then the shared
+    keep-alive pool and per host limiter of geosys.http_. timeouts and
+    connection errors retry with a longer timeout, 429 and 5xx retry after
+    a jittered backoff (429 also lowers the host rate), other HTTP errors
+    and open breakers return None. concurrent calls for the same normalized
+    url share one upstream request. every call is counted per host and
+    endpoint in geosys.metrics.get_metrics(). a body cache_ok(body) is
+    False for, like an error sent with status 200, is returned but not cached
+    """
+    from .http_ import get_response_cache, get_single_flight, normalize_url
+    from .metrics import get_metrics, url_labels
+    metrics, labels = get_metrics(), url_labels(url)
+    metrics.inc('http_calls_total', **labels)
+    responses = get_response_cache()
+    if responses:
+        out = responses.get(url)
+        if out is not None:
+            metrics.inc('http_cache_total', result='hit', **labels)
+            return out
+        metrics.inc('http_cache_total', result='miss', **labels)
 
-def request_retry(url, retry=8, verbose=False):
+    leader = []
+
+    def run():
+        leader.append(True)
+        return _request_retry(url, retry, responses, labels, cache_ok)
+    out = get_single_flight().do(normalize_url(url), run)
+    if not leader:
+        metrics.inc('http_coalesced_total', **labels)
+    return out
+
+def _request_retry(url, retry, responses, labels, cache_ok=None):
+    from .http_ import (
+        get_http_pool, get_limiter, backoff_delay, is_retry_status,
+        is_throttle_status, CircuitOpenError)
+    from .metrics import get_metrics, log
+    pool, limiter, metrics = get_http_pool(), get_limiter(), get_metrics()
+    host = labels['host']
     timeout = TIMEOUT_BASE
     for i in range(retry):
         try:
-            print('requesting', url)
-            return urlopen(url, timeout=timeout).read()
-        except HTTPError as e:
-            print(url, str(e))
+            metrics.observe('http_rate_wait_seconds', limiter.acquire(host),
+                            host=host)
+        except CircuitOpenError:
+            metrics.inc('http_requests_total', status='circuit_open', **labels)
+            print(url, 'skipped, circuit open for', host)
             return
+        t = perf_counter()
+        try:
+            log('requesting', url)
+            out = pool.request(url, timeout=timeout)
+        except HTTPError as e:
+            metrics.observe('http_request_seconds', perf_counter() - t, **labels)
+            metrics.inc('http_requests_total', status=e.code, **labels)
+            if not is_retry_status(e.code):
+                limiter.success(host)
+                print(url, str(e))
+                return
+            limiter.failure(host, throttled=is_throttle_status(e.code))
+            delay = backoff_delay(i, e.headers.get('Retry-After'))
+            err = str(e)
         except Exception as e:
-            print('{} {}. retry {}'.format(url, str(e), i + 1))
-            sleep(timeout)
-            timeout *= 2
+            metrics.observe('http_request_seconds', perf_counter() - t, **labels)
+            metrics.inc('http_requests_total', status=type(e).__name__,
+                        **labels)
+            limiter.failure(host)
+            delay = backoff_delay(i)
+            timeout = min(timeout * 2, TIMEOUT_MAX)
+            err = str(e)
+        else:
+            metrics.observe('http_request_seconds', perf_counter() - t, **labels)
+            metrics.inc('http_requests_total', status='2xx', **labels)
+            metrics.inc('http_response_bytes_total', len(out), **labels)
+            limiter.success(host)
+            if responses and (cache_ok is None or cache_ok(out)):
+                responses.put(url, out)
+            return out
+        metrics.inc('http_retries_total', **labels)
+        print('{} {}. retry {} in {:.1f}s'.format(url, err, i + 1, delay))
+        sleep(delay)
+    metrics.inc('http_failures_total', **labels)
     print("request_retry failed on url", url)
     return
 
-def request_data(url, retry=10, verbose=False):
-    bs = request_retry(url, retry=retry, verbose=verbose)
-    s = bs.decode('utf8', errors='ignore')
+def parse_data(bs, url=''):
+    """
+    parse a response body, JSONP (fn / cb in url) is unwrapped. works on the
+    bytes, only bodies that are not valid utf8 are decoded with errors ignored
+    """
+    if not bs:
+        return
     if 'fn' in url or 'cb' in url:
-        off = s.find('(')
-        if off and s[-2:] == ');':
-            s = s[off + 1:-2]
+        off = bs.find(b'(')
+        if off > 0 and bs[-2:] == b');':
+            bs = bs[off + 1:-2]
 
-    if s.startswith('<?xml'):
+    if bs.startswith(b'<?xml'):
+        from lxml import etree
+        try:
+            return etree.fromstring(fix_xml_error(bs))
+        except etree.XMLSyntaxError:
+            pass
         try:
-            s = fix_xml_error(s)
-            return etree.fromstring(s.encode())
+            s = bs.decode('utf8', errors='ignore').encode()
+            return etree.fromstring(fix_xml_error(s))
         except etree.XMLSyntaxError:
             print('xml syntax error for', url)
             return
-    elif s.startswith('{'):
-        return json.loads(s)
+    elif bs.startswith(b'{'):
+        try:
+            return json.loads(bs)
+        except UnicodeDecodeError:
+            return json.loads(bs.decode('utf8', errors='ignore'))
+
+    raise ValueError('unknown response format for {}'.format(url))
 
-    raise
+def request_data(url, retry=10, verbose=False, cache_ok=None):
+    bs = request_retry(url, retry=retry, verbose=verbose, cache_ok=cache_ok)
+    if bs is None:
+        return
+    return parse_data(bs, url)
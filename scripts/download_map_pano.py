@@ -1,10 +1,11 @@
 #!/usr/bin/env python
+import os
 from pathlib import Path
-import math as M
-from io import BytesIO
+import asyncio
+import multiprocessing
+from urllib.parse import urlsplit
 from functools import partial
-from PIL import Image
-import yaml
+from concurrent.futures import ProcessPoolExecutor
 try:
     from geosys.maps import (
         QMAP_PANO_IMG_URL,
@@ -12,10 +13,17 @@ try:
         GMAP_PANO_IMG_URL,
         AMAP_PANO_IMG_URL
     )
-    from geosys.utils import request_retry
+    from geosys.http_ import (
+        AsyncFetcher, HTTP_CONCURRENCY, HTTP_HOST_CONCURRENCY,
+        HTTP_HOST_RATE, HTTP_CACHE_DIR, get_limiter, set_limiter,
+        set_response_cache)
+    from geosys.metrics import get_metrics, set_quiet, log
+    from geosys.pano import (
+        PANO_TILE_W, align, pano_size, get_tile_grid, save_tile_archive,
+        CanvasSlots, stitch_slot, encode_slot, check_tile, TileManifest,
+        PartialTiles)
 except:
     import sys
-    import os
     sys.path.append(os.getcwd())
     from geosys.maps import (
         QMAP_PANO_IMG_URL,
@@ -23,11 +31,28 @@ except:
         GMAP_PANO_IMG_URL,
         AMAP_PANO_IMG_URL
     )
-    from geosys.utils import request_retry
+    from geosys.http_ import (
+        AsyncFetcher, HTTP_CONCURRENCY, HTTP_HOST_CONCURRENCY,
+        HTTP_HOST_RATE, HTTP_CACHE_DIR, get_limiter, set_limiter,
+        set_response_cache)
+    from geosys.metrics import get_metrics, set_quiet, log
+    from geosys.pano import (
+        PANO_TILE_W, align, pano_size, get_tile_grid, save_tile_archive,
+        CanvasSlots, stitch_slot, encode_slot, check_tile, TileManifest,
+        PartialTiles)
 import click
 
 map_types = 'gmap', 'bmap', 'amap', 'qmap'
-TILE_W = 512
+# jpg stitches and re-encodes, tiles keeps the downloaded tiles in one
+# geosys.pano.TileArchive file
+out_formats = 'jpg', 'tiles'
+TILE_W = PANO_TILE_W
+PANO_CONCURRENCY = 8  # panos downloaded at the same time
+PANO_STITCH_WORKERS = 2  # processes
+PANO_ENCODE_WORKERS = 2
+# stitched panos held in memory at most, a canvas is w * h * 4 bytes: 32MB
+# at qmap zoom 3, 128MB for an 8192 wide pano
+PANO_CANVASES = 4
 
 class MapPanoDownloader:
     def __init__(self, server_nr, url, w, zoom, z_off=0):
@@ -46,9 +71,14 @@ class MapPanoDownloader:
         kws = {'id': pid, 'tilt': ti, 'pan': pi, 'zoom': self.zoom + self.z_off}
 
         if self.server_nr > 1:
-            out = self.url.format(server=self.server_ids[self.cur_server],
-                                  **kws)
-            self.cur_server = (self.cur_server + 1) % self.server_nr
+            # skip mirrors whose circuit breaker is open, unless all are
+            limiter = get_limiter()
+            for _ in range(self.server_nr):
+                out = self.url.format(
+                    server=self.server_ids[self.cur_server], **kws)
+                self.cur_server = (self.cur_server + 1) % self.server_nr
+                if not limiter.is_open(urlsplit(out).netloc):
+                    break
             return out
 
         return self.url.format(**kws)
@@ -81,12 +111,202 @@ MapPanoDownloaders = {
     'amap': AMapPanoDownloder,
 }
 
-def align(x, dx):
-    return M.ceil(x / dx) * dx
+def get_executor(workers):
+    """
+    a pool of `workers` processes, None runs in the loop's threads. they
+    are not forked from this process, whose fetch threads may hold locks
+    (stdout's for one) that a forked child would wait on forever
+    """
+    if workers <= 0:
+        return
+    method = 'forkserver' if 'forkserver' in \
+        multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context(method))
 
-def get_tile_grid(w, h):
-    return [(ti, pi) for ti in range(int(h / TILE_W))
-            for pi in range(int(w / TILE_W))]
+async def download_panos(mpd, pids, out, zoom, concurrency, host_concurrency,
+                         pano_concurrency, fmt='jpg', stitch_workers=0,
+                         encode_workers=0, resume=True, levels=(),
+                         canvases=PANO_CANVASES):
+    """
+    fetch -> stitch -> encode pipeline. up to pano_concurrency panos are
+    fetched and queued for stitching, stitching (or writing tile archives)
+    and encoding run in pools of stitch_workers and encode_workers
+    processes, 0 runs the stage in one thread of this process. at most
+    canvases stitched panos are in memory, whatever the workers. with resume
+    fetched tiles and finished panos are checkpointed under out/.resume per
+    fmt, zoom and levels, so a restarted run only fetches what is missing,
+    done panos whose outputs were deleted are fetched again. levels are
+    lower zooms box downsampled from the zoom download into out/z<level> jpgs
+    """
+    # yaml reads numeric ids as ints
+    pids = [str(i) for i in pids]
+    real_size = real_w, real_h = pano_size(mpd.w, zoom, TILE_W)
+    w, h = align(real_w, TILE_W), align(real_h, TILE_W)
+    tile_grid = get_tile_grid(w, h)
+    # the level sizes follow the halving of mpd.w, so a level can be the
+    # size of zoom when w caps it
+    levels = sorted({i for i in levels if i < zoom})
+    factors = [real_w // pano_size(mpd.w, i, TILE_W)[0] for i in levels]
+    for i in levels:
+        (out / f'z{i}').mkdir(exist_ok=True)
+
+    # (dir, suffix) of the outputs of a pano
+    out_dirs = [(out, '.' + fmt)] + [(out / f'z{i}', '.jpg') for i in levels]
+
+    def get_outs(pid):
+        return [d / (pid + suffix) for d, suffix in out_dirs]
+
+    loop = asyncio.get_running_loop()
+    pano_sem = asyncio.Semaphore(pano_concurrency)
+    metrics = get_metrics()
+    fetched = asyncio.Queue(pano_concurrency)
+    stitched = asyncio.Queue()
+    stitch_nr, encode_nr = max(1, stitch_workers), max(1, encode_workers)
+
+    def finished(pid, ok):
+        metrics.inc('panos_total', result='done' if ok else 'failed')
+        if ok and manifest:
+            manifest.set_done(pid)
+            parts.remove(pid)
+
+    async def fetch_tile(pid, i, url):
+        content = await fetcher.fetch(url)
+        if manifest and check_tile(content):
+            parts.append(pid, i, content)
+            manifest.set_tile(pid, i)
+        return content
+
+    async def fetch(pid):
+        outs = get_outs(pid)
+        out_f = outs[0]
+        if all(i.exists() for i in outs):
+            if manifest:
+                manifest.set_done(pid)
+            metrics.inc('panos_total', result='exists')
+            log(f"{out_f} exists")
+            return
+        async with pano_sem:
+            log(f"proessing {out_f}")
+            have = parts.load(pid) if manifest and manifest.tiles(pid) else {}
+            if have:
+                log(f"{out_f} resumes with {len(have)} tiles")
+            t = loop.time()
+            new = await asyncio.gather(*(
+                fetch_tile(pid, i, mpd.get_url(pid, ti, pi))
+                for i, (ti, pi) in enumerate(tile_grid) if i not in have))
+            metrics.observe('pano_fetch_seconds', loop.time() - t)
+            metrics.inc('tiles_total', len(have), result='resumed')
+            new = iter(new)
+            contents = [have[i] if i in have else next(new)
+                        for i in range(len(tile_grid))]
+            if parts:
+                parts.close(pid)
+            if any(i is None for i in contents):
+                # the tiles fetched are kept for the next run
+                print(f'{out_f} tiles failed, skip')
+                finished(pid, False)
+                return
+            # waits while the stitch stage is behind
+            await fetched.put((pid, out_f, contents))
+
+    async def run(stage, out_f, ex, fn, *args):
+        t = loop.time()
+        try:
+            return await loop.run_in_executor(ex, fn, *args)
+        except Exception as e:
+            print(f'{out_f} {stage} failed: {e!r}')
+        finally:
+            metrics.observe(f'pano_{stage}_seconds', loop.time() - t)
+
+    async def stitch():
+        while True:
+            item = await fetched.get()
+            if item is None:
+                return
+            pid, out_f, contents = item
+            if fmt == 'tiles':
+                ok = await run('stitch', out_f, stitch_ex, save_tile_archive,
+                               contents, tile_grid, (w, h), real_size, out_f,
+                               zoom)
+                if not ok or not levels:
+                    finished(pid, ok)
+                    continue
+            slot = await slots.get()
+            ok = await run('stitch', out_f, stitch_ex, stitch_slot, slot,
+                           slots.shape, contents, tile_grid, out_f)
+            if ok:
+                stitched.put_nowait((pid, out_f, slot))
+            else:
+                slots.put(slot)
+                finished(pid, False)
+
+    async def encode():
+        while True:
+            item = await stitched.get()
+            if item is None:
+                return
+            pid, out_f, slot = item
+            targets = list(zip(get_outs(pid), [1] + factors))
+            if fmt == 'tiles':
+                targets = targets[1:]
+            try:
+                # the levels are encoded at the same time
+                oks = await asyncio.gather(*(
+                    run('encode', f, encode_ex, encode_slot, slot,
+                        slots.shape, real_size, f, factor)
+                    for f, factor in targets))
+            finally:
+                slots.put(slot)
+            finished(pid, all(oks))
+
+    manifest = parts = None
+    if resume:
+        resume_dir = out / '.resume' / '_'.join(
+            [fmt] + [f'z{i}' for i in [zoom] + levels])
+        manifest = TileManifest(resume_dir, len(tile_grid))
+        parts = PartialTiles(resume_dir / 'parts')
+        # the done bits skip the tile state of finished panos, a pano whose
+        # outputs were removed since is downloaded again
+        done = manifest.done_mask(pids)
+        # one listing per output dir instead of a stat per file
+        listed = [(set(os.listdir(d)), suffix) for d, suffix in out_dirs]
+        for i, pid in enumerate(pids):
+            if done[i] and not all(pid + suffix in names
+                                   for names, suffix in listed):
+                manifest.clear_done(pid)
+                done[i] = False
+        metrics.inc('panos_total', int(done.sum()), result='exists')
+        log(f'{done.sum()} panos done before')
+        pids = [i for i, d in zip(pids, done) if not d]
+
+    stitch_ex = get_executor(stitch_workers)
+    encode_ex = get_executor(encode_workers)
+    # a canvas is taken by a stitch and given back after its encode
+    slots = None
+    if fmt == 'jpg' or levels:
+        slots = CanvasSlots((w, h), max(1, canvases))
+    try:
+        stitchers = [asyncio.create_task(stitch()) for _ in range(stitch_nr)]
+        encoders = [asyncio.create_task(encode()) for _ in range(encode_nr)]
+        with AsyncFetcher(limit=concurrency,
+                          host_limit=host_concurrency) as fetcher:
+            await asyncio.gather(*map(fetch, pids))
+        for _ in stitchers:
+            await fetched.put(None)
+        await asyncio.gather(*stitchers)
+        for _ in encoders:
+            stitched.put_nowait(None)
+        await asyncio.gather(*encoders)
+    finally:
+        for ex in stitch_ex, encode_ex:
+            if ex:
+                ex.shutdown()
+        if slots:
+            slots.close()
+        if manifest:
+            parts.close_all()
+            manifest.close()
 
 
 click.option = partial(click.option, show_default=True)
@@ -95,73 +315,58 @@ click.option = partial(click.option, show_default=True)
 @click.option('-o', '--out', default='')
 @click.option('-t', '--map_type', type=click.Choice(map_types), default='qmap')
 @click.option('-z', '--zoom', default=3, help='needed zoom')
-def main(src, out, map_type, zoom):
+@click.option('-l', '--levels', default='',
+              help='lower zooms made from the -z download, e.g. 0,1,2')
+@click.option('-f', '--fmt', type=click.Choice(out_formats), default='jpg',
+              help='stitched jpg or the tiles as downloaded')
+@click.option('-c', '--concurrency', default=HTTP_CONCURRENCY,
+              help='tile requests in flight')
+@click.option('--host_concurrency', default=HTTP_HOST_CONCURRENCY,
+              help='tile requests in flight per server')
+@click.option('-p', '--pano_concurrency', default=PANO_CONCURRENCY,
+              help='panos downloaded at the same time')
+@click.option('--stitch_workers', default=PANO_STITCH_WORKERS,
+              help='decode and stitch processes, 0 for a thread')
+@click.option('--encode_workers', default=PANO_ENCODE_WORKERS,
+              help='encode processes, 0 for a thread')
+@click.option('--canvases', default=PANO_CANVASES,
+              help='stitched panos in memory (/dev/shm) at most, '
+              'w * h * 4 bytes each')
+@click.option('--resume/--no_resume', default=True,
+              help='keep tiles of unfinished panos for a restart')
+@click.option('--host_rate', default=HTTP_HOST_RATE,
+              help='max requests per second per server')
+@click.option('--http_cache', default='',
+              help=f'tile response cache, e.g. {HTTP_CACHE_DIR}. resumed '
+              'downloads keep their tiles without it')
+@click.option('-q', '--quiet', is_flag=True, help='no per request output')
+@click.option('--metrics', default='',
+              help='metrics snapshot file, .json or prometheus text')
+def main(src, out, map_type, zoom, levels, fmt, concurrency, host_concurrency,
+         pano_concurrency, stitch_workers, encode_workers, canvases, resume,
+         host_rate, http_cache, quiet, metrics):
+    set_quiet(quiet)
+    if metrics:
+        get_metrics().start_dump(metrics)
+    set_limiter(rate=host_rate, burst=max(1, int(host_rate)))
+    set_response_cache(http_cache)
     src = Path(src)
     if src.exists():
-        pids = list(yaml.load(open(src)).keys())
+        import yaml
+        pids = list(yaml.full_load(open(src)).keys())
         if not out:
             out = src.parent / src.stem
             out.mkdir(exist_ok=True)
     else:
-        pids = [src]
+        pids = [src.name]
         if not out:
             out = src.parent
 
     mpd = MapPanoDownloaders[map_type](zoom)
-
-    real_w = mpd.w
-    while real_w > TILE_W * 2**zoom:
-        real_w /= 2
-    real_w = int(real_w)
-    real_h = int(real_w / 2)
-    w, h = align(real_w, TILE_W), align(real_h, TILE_W)
-    need_crop = real_w < w or real_h < h
-    tile_grid = get_tile_grid(w, h)
-
-    canvas = Image.new('RGB', (int(w), int(h)))
-
-    for pid in pids:
-        out_f = (out / pid).with_suffix('.jpg')
-        print(f"proessing {out_f}")
-        if out_f.exists():
-            print(f"{out_f} exists")
-            continue
-
-        keys, urls = [], []
-        for ti, pi in tile_grid:
-            keys.append((ti, pi))
-            urls.append(mpd.get_url(pid, ti, pi))
-
-        content0 = request_retry(urls[0])
-        try:
-            b = BytesIO(content0)
-            img = Image.open(b)
-            img_w, img_h = img.size
-            if img_w != TILE_W:
-                print('img_w({}) !='.format(img_w), TILE_W)
-                exit()
-
-        except OSError:
-            print('OSError, set white')
-            exit()
-
-        contents = [request_retry(i) for i in urls[1:]]
-        contents = [content0] + contents
-        for (ti, pi), content in zip(keys, contents):
-            try:
-                b = BytesIO(content)
-                img = Image.open(b)
-
-            except OSError:
-                print('OSError, set white')
-                exit()
-
-            canvas.paste(img, (pi * TILE_W, ti * TILE_W))
-
-        if need_crop:
-            canvas = canvas.crop((0, 0, real_w, real_h))
-
-        canvas.save(out_f)
+    asyncio.run(download_panos(
+        mpd, pids, Path(out), zoom, concurrency, host_concurrency,
+        pano_concurrency, fmt, stitch_workers, encode_workers, resume,
+        [int(i) for i in levels.split(',') if i], canvases))
 
 
 if __name__ == "__main__":
@@ -6,20 +6,32 @@ import sys
 import os
 # from geosys.utils import request_data
 try:
-    from geosys.utils import request_data
+    from geosys.utils import request_data, enable_response_cache
+    from geosys.maps import BMAP_PANO_BY_ID_URL, bmap_pano_ok
+    from geosys.http_ import HTTP_CACHE_DIR
+    from geosys.metrics import get_metrics, set_quiet
+    from geosys.cvt_geosys import bd09mc_to_wgs84_batch, geo_dist_batch
 except: # For Scons Build
     sys.path.append(os.getcwd())
-    from geosys.utils import request_data
+    from geosys.utils import request_data, enable_response_cache
+    from geosys.maps import BMAP_PANO_BY_ID_URL, bmap_pano_ok
+    from geosys.http_ import HTTP_CACHE_DIR
+    from geosys.metrics import get_metrics, set_quiet
+    from geosys.cvt_geosys import bd09mc_to_wgs84_batch, geo_dist_batch
 import json
 import warnings
+import numpy as np
 from typing import Any, Optional, Tuple, List
 
+# RX/RY in the pano json are baidu mercator (bd09mc) meters * 100
+BMAP_MC_SCALE = 100
+
 class BMapPanoGrabber():
     def __init__(self, out: str, **kwargs: Any) -> None:
         """
         Initialize the BMapPanoGrabber instance.
 
-        If the download fails, please try to change the base_url
+        If the download fails, please try to change the url (BMAP_PANO_BY_ID_URL)
         because Baidu may modify the url
 
         cache dictionary is used to save json files
@@ -33,7 +45,7 @@ class BMapPanoGrabber():
         for key, value in kwargs.items():
             setattr(self, key, value)
         self.out = out
-        self.base_url = "https://mapsv0.bdimg.com/?qt=sdata&sid="
+        self.url = BMAP_PANO_BY_ID_URL
         if os.path.exists(self.out) == False:
             os.mkdir(self.out)
             os.mkdir(Path(self.out,"cache"))
@@ -46,7 +58,7 @@ class BMapPanoGrabber():
 
         Eg. https://mapsv0.bdimg.com/?qt=sdata&sid=02015800001407191123100206A
         """
-        return f"{self.base_url}{pid}"
+        return self.url.format(id=pid)
 
     def _local_json(self, pid: str) -> Path:
         """
@@ -69,7 +81,8 @@ class BMapPanoGrabber():
         out_path = self._local_json(pid)
         if os.path.exists(out_path):
             return True
-        data = request_data(self._url_json(pid),verbose=True)
+        data = request_data(self._url_json(pid), verbose=True,
+                            cache_ok=bmap_pano_ok)
         if data == None:
             return False
         with open(out_path, 'w', encoding='utf-8') as file:
@@ -106,6 +119,21 @@ class BMapPanoGrabber():
             warnings.warn(f"{pid} dose not have position information! (omitted)")
             return None
 
+    def get_positions_wgs84(self, pids: List[str]) -> Tuple[Any, Any]:
+        """
+        Convert the positions of many panos to wgs84 in one pass.
+
+        Returns:
+            tuple: ([lat, lng] array of shape (2, n), mask of panos that have
+                a position), lat and lng are nan where the mask is False.
+        """
+        positions = [self.get_position(pid) for pid in pids]
+        found = np.array([p is not None for p in positions], dtype=bool)
+        rx, ry = np.array([p or (np.nan, np.nan) for p in positions],
+                          dtype=float).reshape(-1, 2).T
+        out, _ = bd09mc_to_wgs84_batch(ry / BMAP_MC_SCALE, rx / BMAP_MC_SCALE)
+        return out, found
+
     def get_road_pids(self, pid: str, save: bool = False) -> List[str]:
         """
         Get the panorama IDs of the roads connected to a given panorama.
@@ -197,13 +225,12 @@ class BMapPanoGrabber():
         # 对距离进行筛选
         if dis == 0:
             return pids
-        center = self.get_position(pid)
-        assert isinstance(center,tuple)
-        def is_within_distance(item):
-            point = self.get_position(item)
-            return False if not isinstance(point, tuple) else \
-                (point[0]-center[0])**2+(point[1]-center[1])**2 < (100*dis)**2
-        return list(filter(is_within_distance, pids))
+        center, found = self.get_positions_wgs84([pid])
+        assert found[0]
+        (lat, lng), _ = self.get_positions_wgs84(pids)
+        # nan distances of panos without a position compare False
+        within = geo_dist_batch(center[0], center[1], lat, lng) < dis
+        return [p for p, ok in zip(pids, within) if ok]
 
     def write_pids(self, pids: List[str]) -> None:
         """
@@ -220,7 +247,17 @@ click.option = partial(click.option, show_default=True)
 @click.option('-o', '--out', default='', help="output path")
 @click.option('-d', '--dis', default=0, help="distance filter")
 @click.option('-l', '--level', default=2, help="expand level")
-def main(pid, out, dis, level):
+@click.option('--http_cache', default='',
+              help=f"response cache shared by crawls, e.g. {HTTP_CACHE_DIR}")
+@click.option('-q', '--quiet', is_flag=True, help="no per request output")
+@click.option('--metrics', default='',
+              help="metrics snapshot file, .json or prometheus text")
+def main(pid, out, dis, level, http_cache, quiet, metrics):
+    set_quiet(quiet)
+    if metrics:
+        get_metrics().start_dump(metrics)
+    if http_cache:
+        enable_response_cache(http_cache)
     # 初始化下载器
     grabber = BMapPanoGrabber(out)
 
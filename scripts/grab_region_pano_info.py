@@ -12,15 +12,19 @@ from geosys.maps import (
     QMAP_PANO_BY_ID_URL,
     QMAP_PANO_BY_YX_URL,
     qmap_parse_pano_info,
+    qmap_pano_ok,
     qmap_ll2yx,
     AMAP_PANO_BY_ID_URL,
     AMAP_PANO_BY_YX_URL,
 )
 
-from geosys.utils import request_data
+from geosys.utils import request_data, enable_response_cache
+from geosys.http_ import HTTP_CACHE_DIR
+from geosys.metrics import get_metrics, set_quiet, log
 from geosys.cvt_geosys import (
     geo_dist, in_china, is_latlng, gcj02_to_wgs84,
-    wgs84_to_gcj02, unit_ll_meter)
+    wgs84_to_gcj02, unit_ll_meter, enable_conversion_cache,
+    conversion_cache_info)
 from geosys.io_ import load_txt, save_txt
 
 def PR2ptr(R):
@@ -85,6 +89,9 @@ class MapPanoGrabber:
 
         return self.by_id.format(server=self.inc_server(), id=q)
 
+    def pano_ok(self, bs):
+        return True
+
     def get_by_yx_url(self, q):
         y, x = q
         if self.server_nr <= 1:
@@ -95,25 +102,31 @@ class MapPanoGrabber:
         return (self.cache / name).with_suffix(self.pano_data_fmt)
 
     def add_failed_pano(self, n):
-        print("add failed_pano", len(self.failed_panos), n)
+        log("add failed_pano", len(self.failed_panos), n)
         self.failed_panos.add(n)
 
     def request_pano_data(self, q):
         self.total += 1
-        print('current request', self.total)
+        log('current request', self.total)
+        metrics = get_metrics()
         if isinstance(q, str):
             if q in self.failed_panos:
+                metrics.inc('crawl_requests_total', by='id', result='failed')
                 return
 
             info_f = self.cache_info_f(q)
             if info_f.exists():
+                metrics.inc('crawl_requests_total', by='id', result='cached')
                 return load_txt(info_f)
 
-            pano = request_data(self.get_by_id_url(q), verbose=True)
+            pano = request_data(self.get_by_id_url(q), verbose=True,
+                                cache_ok=self.pano_ok)
             if not pano:
-                print('pano is None')
+                metrics.inc('crawl_requests_total', by='id', result='none')
+                log('pano is None')
                 self.add_failed_pano(q)
                 return
+            metrics.inc('crawl_requests_total', by='id', result='ok')
 
             if not info_f.exists():
                 save_txt(pano, info_f)
@@ -121,13 +134,16 @@ class MapPanoGrabber:
         elif is_latlng(q):
             pano = request_data(self.get_by_yx_url(q))
             if not pano:
-                print('pano is None')
+                metrics.inc('crawl_requests_total', by='yx', result='none')
+                log('pano is None')
                 return
 
             i = self.pano_id(pano)
             if not i:
-                print('no pano_id\n', pformat(pano))
+                metrics.inc('crawl_requests_total', by='yx', result='no_id')
+                log('no pano_id\n', pformat(pano))
                 return
+            metrics.inc('crawl_requests_total', by='yx', result='ok')
 
         else:
             raise
@@ -315,6 +331,9 @@ class QMapPanoGrabber(MapPanoGrabber):
         super().__init__(cache, 1, QMAP_PANO_BY_ID_URL, QMAP_PANO_BY_YX_URL,
                          pano_data_fmt='.xml')
 
+    def pano_ok(self, bs):
+        return qmap_pano_ok(bs)
+
     def pano_id(self, p):
         return p['detail']['svid']
 
@@ -387,7 +406,22 @@ MapPanoGrabbers = {
               default='qmap')
 @click.option('--floor', default=0, help='for multi floors in gmap')
 @click.option('--cache_dir', default='info_cache')
-def main(regions, out, map_type, floor, cache_dir):
+@click.option('--conv_cache', default=0,
+              help='coordinate conversion cache size, e.g. 65536, 0 to disable')
+@click.option('--http_cache', default='',
+              help=f'response cache shared by crawls, e.g. {HTTP_CACHE_DIR}')
+@click.option('-q', '--quiet', is_flag=True, help='no per request output')
+@click.option('--metrics', default='',
+              help='metrics snapshot file, .json or prometheus text')
+def main(regions, out, map_type, floor, cache_dir, conv_cache, http_cache,
+         quiet, metrics):
+    set_quiet(quiet)
+    if metrics:
+        get_metrics().start_dump(metrics)
+    if conv_cache:
+        enable_conversion_cache(maxsize=conv_cache)
+    if http_cache:
+        enable_response_cache(http_cache)
     regions = Path(regions)
     if not out:
         out = (regions.parent / str(regions.stem + '_panos')).with_suffix('.yaml')
@@ -416,6 +450,9 @@ def main(regions, out, map_type, floor, cache_dir):
             print(f"# size {len(panos)}", file=fp)
             yaml.dump(panos, fp)
 
+    if conv_cache:
+        log('conversion cache', conversion_cache_info())
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+from functools import partial
+import click
+from geosys.standin import StandInServer, STANDIN_ROOT
+
+click.option = partial(click.option, show_default=True)
+@click.command()
+@click.option('-r', '--root', default=str(STANDIN_ROOT), help='fixture dir')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8765)
+@click.option('--latency', default=0., help='seconds added to each response')
+@click.option('--jitter', default=0., help='max uniform extra latency, seconds')
+@click.option('--error_rate', default=0., help='fraction answered with 503')
+@click.option('--throttle_rate', default=0., help='fraction answered with 429')
+@click.option('--bandwidth', default=0, help='bytes/s per response, 0 unlimited')
+@click.option('--any_id', is_flag=True, help='serve unknown ids from fixtures')
+@click.option('--record', is_flag=True, help='fetch and save missing fixtures')
+def main(root, host, port, latency, jitter, error_rate, throttle_rate,
+         bandwidth, any_id, record):
+    srv = StandInServer(
+        root, host, port, latency=latency, jitter=jitter,
+        error_rate=error_rate, throttle_rate=throttle_rate,
+        bandwidth=bandwidth, any_id=any_id, record=record)
+    print('# point the crawlers at this server with')
+    for k, v in srv.env().items():
+        print("export {}='{}'".format(k, v))
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    srv.server_close()
+
+
+if __name__ == "__main__":
+    main()
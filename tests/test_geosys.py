@@ -1,5 +1,10 @@
+import sys
+import subprocess
+import numpy as np
+import pytest
 from geosys import __version__
 from geosys.cvt_geosys import *
+from geosys.maps import qmap_ll2yx, qmap_yx2ll, qmap_ll2yx_batch, qmap_yx2ll_batch
 
 def test_version():
     assert __version__ == '0.1.0'
@@ -10,5 +15,183 @@ def test_wgs84():
     wgs84_1 = wgs84_to_gcj02(*gcj02_to_wgs84(*gcj02))
     assert wgs84_1 == gcj02
 
+def test_in_china():
+    assert in_china(39.9, 116.3) and in_china(31.2, 121.4)
+    assert not in_china(47.5, -120.5) and not in_china(10, 110)
+
+    lat, lng = np.meshgrid(np.linspace(15, 56, 60), np.linspace(70, 137, 80))
+    mask = in_china_batch(lat, lng)
+    assert mask.shape == lat.shape
+    assert mask.tolist() == [
+        [in_china(*i) for i in zip(*row)] for row in zip(lat, lng)]
+    # small batches take the per point edge test
+    assert in_china_batch(lat[:, 20], lng[:, 20]).tolist() == \
+        mask[:, 20].tolist()
+    assert not in_china_batch([10.], [10.]).any()
+
+    for i in get_china_index():
+        y0, x0, y1, x1 = i.inner
+        assert i._edge_test_batch(np.array([y0, y0, y1, y1]),
+                                  np.array([x0, x1, x0, x1])).all()
+
+def test_wgs84_batch():
+    lat = np.array([39.905560, 31.2323076784, 47.5, 22.3])
+    lng = np.array([116.391314, 121.4691562490, -120.5, 114.2])
+    out = np.empty((2, 4))
+    gcj02, mask = wgs84_to_gcj02_batch(lat, lng, out=out)
+    assert gcj02 is out
+    assert mask.tolist() == [in_china(*i) for i in zip(lat, lng)]
+    for i in range(4):
+        assert tuple(gcj02[:, i]) == wgs84_to_gcj02(lat[i], lng[i])
+
+    wgs84, _ = gcj02_to_wgs84_batch(*gcj02)
+    assert np.allclose(wgs84, [lat, lng], rtol=0, atol=1e-9)
+
+def test_gcj02_newton():
+    lat, lng = np.meshgrid(np.linspace(20, 50, 7), np.linspace(106, 134, 9))
+    gcj02, mask = wgs84_to_gcj02_batch(lat, lng)
+    wgs84, res = gcj02_to_wgs84_newton(*gcj02, mask=mask)
+    assert res.shape == lat.shape
+    assert res.max() < 1e-12
+    assert np.allclose(wgs84, [lat, lng], rtol=0, atol=1e-12)
+
+    _, res = gcj02_to_wgs84_newton(*gcj02, mask=mask, iters=1)
+    assert res.max() > 1e-9
+
+    for bad in mask[:-1], mask.astype(float), mask[:, ::-1]:
+        with pytest.raises(ValueError):
+            gcj02_to_wgs84_newton(*gcj02, mask=bad)
+
+def test_batch_workers():
+    rng = np.random.default_rng(0)
+    lat, lng = rng.uniform(18, 54, (2, 3, BATCH_CHUNK))
+    for fn in (wgs84_to_gcj02_batch, gcj02_to_wgs84_batch,
+               bd09mc_to_wgs84_batch, wgs84_to_bd09_batch):
+        out, mask = fn(lat, lng + 55)
+        out1, mask1 = fn(lat, lng + 55, workers=3)
+        assert (out == out1).all() and (mask == mask1).all()
+    out, res = gcj02_to_wgs84_newton(lat, lng + 55, iters=2)
+    out1, res1 = gcj02_to_wgs84_newton(lat, lng + 55, iters=2, workers=0)
+    assert (out == out1).all() and (res == res1).all()
+
+def test_geo_dist():
+    from geopy.distance import geodesic
+    rng = np.random.default_rng(0)
+    lat0, lat1 = rng.uniform(-89, 89, (2, 500))
+    lng0, lng1 = rng.uniform(-180, 180, (2, 500))
+    lat1[:3], lng1[:3] = -lat0[:3], lng0[:3] + 179.9  # nearly antipodal
+    lat1[3], lng1[3] = lat0[3], lng0[3]
+    ref = [geodesic(*i).meters for i in zip(zip(lat0, lng0), zip(lat1, lng1))]
+    assert np.abs(geo_dist_batch(lat0, lng0, lat1, lng1) - ref).max() < 1e-3
+    assert geo_dist_batch(lat0[3], lng0[3], lat1[3], lng1[3]) == 0
+    assert np.isnan(geo_dist_batch(np.nan, 0, 0, 0))
+
+    assert geo_dist_pairwise(lat0[:4], lng0[:4], lat1, lng1).shape == (4, 500)
+    assert np.allclose(geo_dist_track(lat0[:3], lng0[:3]),
+                       [geo_dist(lat0[i], lng0[i], lat0[i + 1], lng0[i + 1])
+                        for i in range(2)])
+
+    y, x = geo_coord_batch(lat0, lng0, 39.9, 116.3)
+    assert (y > 0).tolist() == (lat0 > 39.9).tolist()
+    assert np.allclose(geo_coord(lat0[0], lng0[0], 39.9, 116.3), (y[0], x[0]))
+
+def test_bd09_batch():
+    # a pano of samples/data/XinjiangTaZhiXiLu, RX/RY are bd09mc * 100
+    bd09 = bd09mc_to_bd09(5096074.91, 9591570.91)
+    assert np.allclose(bd09, (41.758015, 86.161610), rtol=0, atol=1e-6)
+    assert bd09_to_gcj02(*gcj02_to_bd09(39.90872, 116.39749)) == \
+        tuple(bd09_to_gcj02_batch(*gcj02_to_bd09_batch(39.90872, 116.39749)))
+
+    rng = np.random.default_rng(0)
+    lat, lng = rng.uniform(20, 50, 1000), rng.uniform(100, 130, 1000)
+    lat[0], lng[0] = -lat[0], -lng[0]
+    bd09 = gcj02_to_bd09_batch(lat, lng)
+    assert geo_dist_batch(lat, lng, *bd09_to_gcj02_batch(*bd09)).max() < 1
+    mc = bd09_to_bd09mc_batch(lat, lng)
+    assert (np.sign(mc) == np.sign([lat, lng])).all()
+    assert geo_dist_batch(lat, lng, *bd09mc_to_bd09_batch(*mc)).max() < 1
+
+    mc, mask = wgs84_to_bd09mc_batch(lat, lng)
+    wgs84, mask1 = bd09mc_to_wgs84_batch(*mc)
+    same = mask == mask1
+    assert same.mean() > 0.99 and mask.any() and not mask.all()
+    assert geo_dist_batch(lat, lng, *wgs84)[same].max() < 1
+
+def test_proj_batch():
+    lat = np.array([39.9, 31.2, -33.9, 60.1])
+    lng = np.array([116.3, 121.4, 151.2, -150.0])
+    for fn, fn_batch, inv_batch in [
+            (ll2merc, ll2merc_batch, merc2ll_batch),
+            (ll2merc_epsg3857, ll2merc_epsg3857_batch, merc2ll_epsg3857_batch),
+            (qmap_ll2yx, qmap_ll2yx_batch, qmap_yx2ll_batch)]:
+        out = np.empty((2, 4))
+        yx, valid = fn_batch(lat, lng, out=out)
+        assert yx is out and valid.all()
+        ref = np.transpose([fn(*i) for i in zip(lat, lng)])
+        assert np.allclose(yx, ref, rtol=1e-12)
+        ll, valid = inv_batch(*yx)
+        assert np.allclose(ll, [lat, lng], rtol=0, atol=1e-9)
+
+    ll, _ = qmap_yx2ll_batch(*qmap_ll2yx_batch(lat, lng)[0])
+    ref = [qmap_yx2ll(*qmap_ll2yx(*i)) for i in zip(lat, lng)]
+    assert np.allclose(ll, np.transpose(ref))
+
+    yx, valid = ll2merc_batch(np.array([10, 85, np.nan, -89], np.float32), 3)
+    assert yx.dtype == np.float32
+    assert valid.tolist() == [True, False, False, False]
+    assert np.isnan(yx[:, 1:]).all()
+
+def test_apply_ll2xyz_batch():
+    T = np.hstack([np.eye(3)[[2, 0, 1]], [[1], [2], [3]]])
+    trans = ((39.9, 116.3), T)
+    rng = np.random.default_rng(0)
+    rows = np.stack([39.9 + rng.uniform(-0.05, 0.05, 100),
+                     116.3 + rng.uniform(-0.05, 0.05, 100),
+                     rng.uniform(0, 50, 100)], 1)
+    xyz = apply_ll2xyz_batch(trans, *rows.T)
+    assert xyz.shape == (100, 3)
+    assert np.abs(xyz - [apply_ll2xyz(trans, *i) for i in rows]).max() < 1e-3
+    # far from the anchor too
+    far = np.array([[40.9, 117.3, 0], [36.9, 113.3, 10], [39.9, 119.3, 5]])
+    assert np.abs(apply_ll2xyz_batch(trans, *far.T)
+                  - [apply_ll2xyz(trans, *i) for i in far]).max() < 1e-3
+
+    chunks = list(iter_apply_ll2xyz(trans, rows, chunk_size=30))
+    assert [len(i) for i in chunks] == [30, 30, 30, 10]
+    assert (np.concatenate(chunks) == xyz).all()
+    chunks = iter_apply_ll2xyz(trans, map(tuple, rows), chunk_size=30)
+    assert (np.concatenate(list(chunks)) == xyz).all()
+
+def test_lazy_imports():
+    # scripts only needing url templates and request_retry stay light
+    code = ('import sys, geosys.maps, geosys.utils; print(" ".join('
+            'i for i in ["numpy", "geopy", "shapely", "lxml", "geosys.cvt_geosys"]'
+            ' if i in sys.modules))')
+    p = subprocess.run([sys.executable, '-c', code],
+                       capture_output=True, text=True, check=True)
+    assert p.stdout.strip() == ''
+
+def test_conversion_cache():
+    calls = []
+    lru = QuantizedLRU(lambda y, x: calls.append((y, x)) or (y, x),
+                       maxsize=2, digits=3)
+    assert lru(1.0001, 2.0) == (1.0001, 2.0)
+    assert lru(1.0002, 2.0) == (1.0001, 2.0)  # same quantized key
+    lru(3, 4)
+    lru(5, 6)  # evicts (1, 2)
+    lru(1, 2)
+    assert len(calls) == 4
+    assert lru.info() == (1, 4, 2, 2)
+
+    gcj02 = (39.906961, 116.397555)
+    enable_conversion_cache()
+    try:
+        wgs84 = gcj02_to_wgs84(*gcj02)
+        assert gcj02_to_wgs84(*gcj02) == wgs84
+        assert conversion_cache_info()['gcj02_to_wgs84'].hits == 1
+        assert wgs84_to_gcj02(*wgs84) == gcj02
+    finally:
+        disable_conversion_cache()
+
 if __name__ == "__main__":
     test_wgs84()
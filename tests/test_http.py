@@ -0,0 +1,376 @@
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from geosys import http_
+from geosys.http_ import (
+    HTTPPool, AsyncFetcher, TokenBucket, CircuitBreaker, HostLimiter,
+    ResponseCache)
+from geosys import utils
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connects += 1
+
+    def send(self, status, body=b'', **headers):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k.replace('_', '-'), v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        hits = self.server.hits
+        hits[self.path] = hits.get(self.path, 0) + 1
+        if self.path.startswith('/tile/'):
+            self.send(200, self.path.encode())
+        elif self.path.startswith('/json'):
+            self.send(200, b'cb({"id": 1});')
+        elif self.path == '/redirect':
+            self.send(302, Location='/tile/0')
+        elif self.path == '/close':
+            self.send(200, b'bye', Connection='close')
+            self.close_connection = True
+        elif self.path == '/drop':
+            # closes without telling, like an idle timeout on the server
+            self.send(200, b'drop')
+            self.close_connection = True
+        elif self.path == '/flaky':
+            self.send(200 if hits['/flaky'] > 2 else 503, b'ok')
+        elif self.path == '/throttle':
+            if hits['/throttle'] == 1:
+                self.send(429, Retry_After='3')
+            else:
+                self.send(200, b'ok')
+        elif self.path == '/slow':
+            time.sleep(0.2)
+            self.send(200, b'slow')
+        elif self.path == '/down':
+            self.send(500)
+        else:
+            self.send(404)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    srv.connects = 0
+    srv.hits = {}
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    yield srv, 'http://127.0.0.1:{}'.format(srv.server_port)
+    srv.shutdown()
+    srv.server_close()
+
+def test_pool_keep_alive(server):
+    srv, url = server
+    pool = HTTPPool()
+    assert [pool.request(f'{url}/tile/{i}') for i in range(10)] == \
+        [f'/tile/{i}'.encode() for i in range(10)]
+    assert srv.connects == pool.connects == 1
+
+    assert pool.request(url + '/redirect') == b'/tile/0'
+    assert pool.request(url + '/close') == b'bye'
+    assert pool.request(url + '/tile/1') == b'/tile/1'
+    assert srv.connects == 2
+
+    # connections dropped by the server are replaced transparently
+    assert pool.request(url + '/drop') == b'drop'
+    assert pool.request(url + '/tile/2') == b'/tile/2'
+    assert srv.connects == 3
+
+    with pytest.raises(utils.HTTPError):
+        pool.request(url + '/missing')
+
+    with ThreadPoolExecutor(4) as ex:
+        out = list(ex.map(pool.request, [f'{url}/tile/{i}' for i in range(40)]))
+    assert out == [f'/tile/{i}'.encode() for i in range(40)]
+    assert pool.connects <= 3 + 4
+    pool.close()
+
+def test_pool_proxy(server, monkeypatch):
+    srv, url = server
+    monkeypatch.delenv('no_proxy', raising=False)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    # the test server stands in for the proxy, it gets the absolute url
+    pool = HTTPPool(proxies={'http': url})
+    with pytest.raises(utils.HTTPError):
+        pool.request('http://geosys.invalid/tile/0')
+    assert srv.hits == {'http://geosys.invalid/tile/0': 1}
+    assert pool.connects == 0
+    assert HTTPPool(proxies={}).request(url + '/tile/0') == b'/tile/0'
+
+def test_request_retry(server, monkeypatch):
+    srv, url = server
+    monkeypatch.setitem(utils.__dict__, 'print', lambda *a: None)
+    monkeypatch.setitem(http_.cache, 'limiter', HostLimiter(fails=3))
+    delays = []
+    monkeypatch.setattr(utils, 'sleep', delays.append)
+    assert utils.request_retry(url + '/tile/1') == b'/tile/1'
+    assert utils.request_retry(url + '/missing') is None
+    assert utils.request_data(url + '/json?cb=cb') == {'id': 1}
+    assert delays == []
+
+    assert utils.request_retry(url + '/flaky') == b'ok'
+    assert srv.hits['/flaky'] == 3 and len(delays) == 2
+    assert utils.request_retry(url + '/throttle') == b'ok'
+    assert delays[-1] >= 3  # Retry-After
+    assert http_.get_limiter().get(url.split('/')[2])[0].rate < \
+        http_.HTTP_HOST_RATE
+
+def test_async_fetcher():
+    lock = threading.Lock()
+    active, peak = {}, {}
+
+    def fetch(url):
+        host = url.split('/')[2]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            active['all'] = active.get('all', 0) + 1
+            for k in host, 'all':
+                peak[k] = max(peak.get(k, 0), active[k])
+        time.sleep(0.01)
+        with lock:
+            active[host] -= 1
+            active['all'] -= 1
+        return url
+
+    urls = [f'http://sv{i % 3}.test/tile/{i}' for i in range(60)]
+
+    async def run():
+        with AsyncFetcher(fetch, limit=5, host_limit=2) as fetcher:
+            return await fetcher.fetch_all(urls)
+    assert asyncio.run(run()) == urls
+    assert peak.pop('all') == 5
+    assert max(peak.values()) == 2
+
+class Clock:
+    t = 0.
+
+    def __call__(self):
+        return self.t
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(10, 2, clock)
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.1, 0.2]
+    clock.t = 1
+    assert bucket.reserve() == 0
+    bucket.throttled()
+    assert bucket.rate == 5
+    for _ in range(1000):
+        bucket.recover()
+    assert bucket.rate == 10
+
+def test_circuit_breaker(server, monkeypatch):
+    clock = Clock()
+    breaker = CircuitBreaker(fails=2, cooldown=10, clock=clock)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    clock.t = 10
+    assert breaker.allow() and not breaker.allow()  # a single trial
+    breaker.failure()
+    assert breaker.state == 'open'
+    clock.t = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == 'closed'
+
+    srv, url = server
+    monkeypatch.setitem(utils.__dict__, 'print', lambda *a: None)
+    monkeypatch.setitem(http_.cache, 'limiter', HostLimiter(fails=3))
+    delays = []
+    monkeypatch.setattr(utils, 'sleep', delays.append)
+    assert utils.request_retry(url + '/down') is None
+    assert srv.hits['/down'] == 3 and len(delays) == 3
+    assert http_.get_limiter().is_open(url.split('/')[2])
+    assert utils.request_retry(url + '/tile/1') is None
+
+def test_normalize_url():
+    from geosys.http_ import normalize_url
+    assert normalize_url('HTTP://SV3.map.qq.com:80/tile?y=1&x=2#a') == \
+        'http://sv{server}.map.qq.com/tile?x=2&y=1'
+    assert normalize_url('http://sv.map.qq.com/sv?svid=1') == \
+        'http://sv.map.qq.com/sv?svid=1'
+    assert normalize_url('http://h:8080') == 'http://h:8080/'
+
+def test_response_cache(tmp_path, server, monkeypatch):
+    clock = Clock()
+    cache = ResponseCache(tmp_path, ttl=10, max_bytes=100, clock=clock)
+    cache.put('http://sv1.a/t?x=1', b'a' * 40)
+    assert cache.get('http://sv2.a/t?x=1') == b'a' * 40
+    clock.t = 1
+    cache.put('http://b/', b'b' * 40)
+    clock.t = 2
+    cache.get('http://sv1.a/t?x=1')
+    clock.t = 3
+    cache.put('http://c/', b'c' * 40)  # over 100 bytes, b is the oldest used
+    assert cache.get('http://b/') is None
+    assert cache.size == 80 and cache.get('http://c/') == b'c' * 40
+
+    # the index of a new instance follows the access times on disk
+    cache = ResponseCache(tmp_path, ttl=10, max_bytes=100, clock=clock)
+    cache.put('http://d/', b'd' * 40)
+    assert cache.get('http://sv1.a/t?x=1') is None
+    clock.t = 14
+    assert cache.get('http://c/') is None  # expired
+    assert sorted(i.name for i in tmp_path.glob('*/*')) == [cache.key('http://d/')]
+
+    srv, url = server
+    monkeypatch.setitem(utils.__dict__, 'print', lambda *a: None)
+    monkeypatch.setitem(http_.cache, 'responses', None)
+    utils.enable_response_cache(tmp_path / 'http')
+    assert utils.request_retry(url + '/tile/1') == b'/tile/1'
+    assert utils.request_retry(url + '/tile/1') == b'/tile/1'
+    assert utils.request_retry(url + '/missing') is None
+    assert utils.request_retry(url + '/missing') is None
+    assert srv.hits == {'/tile/1': 1, '/missing': 2}
+    # bodies a caller rejects are returned but not kept
+    for _ in range(2):
+        assert utils.request_retry(url + '/tile/2', cache_ok=bool) == b'/tile/2'
+        assert utils.request_retry(url + '/tile/3',
+                                   cache_ok=lambda bs: False) == b'/tile/3'
+    assert srv.hits['/tile/2'] == 1 and srv.hits['/tile/3'] == 2
+    from geosys.maps import qmap_pano_ok, bmap_pano_ok
+    assert not qmap_pano_ok(b'<?xml version="1.0"?><qqsv><error>1</error></qqsv>')
+    assert bmap_pano_ok(b'{"result": {"error": 0}, "content": []}')
+    assert not bmap_pano_ok(b'{"result": {"error": 404}}')
+    utils.disable_response_cache()
+    assert utils.request_retry(url + '/tile/1') == b'/tile/1'
+    assert srv.hits['/tile/1'] == 2
+
+def test_single_flight(server, monkeypatch):
+    srv, url = server
+    monkeypatch.setitem(utils.__dict__, 'print', lambda *a: None)
+    monkeypatch.setitem(http_.cache, 'single_flight', http_.SingleFlight())
+    with ThreadPoolExecutor(8) as ex:
+        out = list(ex.map(utils.request_retry, [url + '/slow'] * 8))
+    assert out == [b'slow'] * 8
+    assert srv.hits['/slow'] == 1
+    assert http_.get_single_flight().shared == 7
+    assert http_.get_single_flight().calls == {}
+
+    flight = http_.SingleFlight()
+    with pytest.raises(ZeroDivisionError):
+        flight.do('k', lambda: 1 / 0)
+    assert flight.do('k', lambda: 1) == 1
+
+    calls = []
+
+    def fetch(url):
+        calls.append(url)
+        time.sleep(0.05)
+        return url
+
+    async def run():
+        with AsyncFetcher(fetch) as fetcher:
+            return await fetcher.fetch_all(
+                ['http://sv1.a/t?x=1', 'http://sv2.a/t?x=1', 'http://b/'])
+    assert asyncio.run(run()) == ['http://sv1.a/t?x=1'] * 2 + ['http://b/']
+    assert calls == ['http://sv1.a/t?x=1', 'http://b/']
+
+def test_metrics(server, tmp_path, monkeypatch, capsys):
+    import json
+    from geosys import metrics
+    from geosys.metrics import Metrics, url_labels
+    srv, url = server
+    m = Metrics()
+    monkeypatch.setitem(metrics.cache, 'metrics', m)
+    monkeypatch.setitem(http_.cache, 'limiter', HostLimiter(fails=3))
+    monkeypatch.setitem(http_.cache, 'responses', None)
+    monkeypatch.setattr(utils, 'sleep', lambda d: None)
+    metrics.set_quiet()
+    try:
+        assert utils.request_retry(url + '/tile/1') == b'/tile/1'
+        assert utils.request_retry(url + '/flaky') == b'ok'
+        assert utils.request_retry(url + '/missing') is None
+    finally:
+        metrics.set_quiet(False)
+    assert 'requesting' not in capsys.readouterr().out
+
+    host = url.split('/')[2]
+    assert url_labels(url + '/tile?x=1') == {'host': host, 'endpoint': '/tile'}
+    assert url_labels('https://mapsv0.bdimg.com/?qt=sdata&sid=1') == \
+        {'host': 'mapsv0.bdimg.com', 'endpoint': '/?qt=sdata'}
+    tile = url_labels(url + '/tile/1')
+    flaky = url_labels(url + '/flaky')
+    assert m.get('http_requests_total', status='2xx', **tile) == 1
+    assert m.get('http_response_bytes_total', **tile) == 7
+    assert m.get('http_requests_total', status=503, **flaky) == 2
+    assert m.get('http_retries_total', **flaky) == 2
+    assert m.get('http_requests_total', status=404,
+                 **url_labels(url + '/missing')) == 1
+    assert m.histograms[('http_request_seconds', tuple(sorted(flaky.items())))
+                        ].count == 3
+
+    m.dump(tmp_path / 'm.json')
+    snap = json.load(open(tmp_path / 'm.json'))
+    assert {i['name'] for i in snap['counters']} >= {
+        'http_calls_total', 'http_requests_total', 'http_retries_total'}
+    m.dump(tmp_path / 'm.prom')
+    text = (tmp_path / 'm.prom').read_text()
+    assert 'http_retries_total{endpoint="/flaky",host="%s"} 2' % host in text
+    assert 'http_request_seconds_bucket{endpoint="/flaky",host="%s",le="+Inf"} 3' \
+        % host in text
+
+def test_standin(tmp_path, monkeypatch):
+    from io import BytesIO
+    from PIL import Image
+    from geosys.standin import StandInServer
+    from geosys.maps import URL_DEFAULTS
+    pool = HTTPPool()
+    with StandInServer() as srv:
+        t = srv.templates()
+        xml = pool.request(t['QMAP_PANO_BY_ID_URL'].format(
+            id='10011049160219135739400'))
+        assert b'svid="10011049160219135739400"' in xml
+        pano = utils.parse_data(pool.request(t['QMAP_PANO_BY_YX_URL'].format(
+            x=12949600, y=4865770)), 'cb=0')
+        assert pano['detail']['svid'] == '10011049160219135739400'
+        pano = utils.parse_data(pool.request(t['BMAP_PANO_BY_ID_URL'].format(
+            id='09002200001504160309468516P')))
+        assert pano['content'][0]['ID'] == '09002200001504160309468516P'
+        with pytest.raises(utils.HTTPError):
+            pool.request(t['QMAP_PANO_BY_ID_URL'].format(id='missing'))
+
+        # qmap level 0 is zoom 3 of download_map_pano, 8x4 tiles
+        tile = t['QMAP_PANO_IMG_URL'].format(
+            id='10011049160219135739400', zoom=0, tilt=3, pan=7, server=0)
+        assert Image.open(BytesIO(pool.request(tile))).size == (512, 512)
+        with pytest.raises(utils.HTTPError):
+            pool.request(tile.replace('y=3', 'y=4'))
+
+    with StandInServer(error_rate=0.5, latency=0.01, any_id=True) as srv:
+        tile = srv.templates()['BMAP_PANO_IMG_URL'].format(
+            id='unknown', zoom=1, tilt=0, pan=0, server=0)
+        codes = []
+        for _ in range(20):
+            try:
+                codes.append(len(pool.request(tile)) > 0)
+            except utils.HTTPError as e:
+                codes.append(e.code)
+        assert set(codes) == {True, 503}
+        assert srv.hits == {'bmap_scape_pdata': 20}
+
+    upstream = []
+
+    def request_retry(url):
+        upstream.append(url)
+        return b'<?xml version="1.0"?><qqsv/>'
+    monkeypatch.setattr(utils, 'request_retry', request_retry)
+    with StandInServer(tmp_path, record=True) as srv:
+        url = srv.templates()['QMAP_PANO_BY_ID_URL'].format(id='1')
+        assert pool.request(url) == pool.request(url)
+    assert upstream == [URL_DEFAULTS['QMAP_PANO_BY_ID_URL'].format(id='1')]
+    assert (tmp_path / 'record' / 'pano_cache' / '1.xml').exists()
+    pool.close()
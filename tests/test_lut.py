@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from geosys import lut
+from geosys.cvt_geosys import wgs84_to_gcj02_batch, gcj02_to_wgs84_batch
+from geosys.lut import (
+    OffsetLUT, GCJ02_LUT_STEPS, GCJ02_LUT_ERR,
+    _wgs84_to_gcj02_grid, _gcj02_to_wgs84_grid)
+
+def err_meters(a, b):
+    d = a - b
+    return np.hypot(d[0] * 111320, d[1] * 111320 * np.cos(np.radians(a[0])))
+
+def test_offset_lut(tmp_path, monkeypatch):
+    bounds = 39, 104, 41, 106.5  # crosses the sqrt kink at lng 105
+    f = tmp_path / 'wgs84_to_gcj02.npy'
+    fwd = OffsetLUT.build(_wgs84_to_gcj02_grid, bounds, GCJ02_LUT_STEPS, f=f)
+    inv = OffsetLUT.build(_gcj02_to_wgs84_grid, bounds, GCJ02_LUT_STEPS)
+    assert OffsetLUT.load(f).origin == fwd.origin
+    # built under a temp name, only the table and its sidecar are left
+    assert sorted(i.name for i in tmp_path.iterdir()) == [
+        'wgs84_to_gcj02.json', 'wgs84_to_gcj02.npy']
+
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(39.2, 40.8, 100000)
+    lng = rng.uniform(104.2, 106.3, 100000)
+    monkeypatch.setattr(lut, 'cache', {
+        lut._lut_key(False, None): OffsetLUT.load(f),
+        lut._lut_key(True, None): inv})
+
+    gcj02, mask = wgs84_to_gcj02_batch(lat, lng)
+    gcj02_lut, mask_lut = wgs84_to_gcj02_batch(lat, lng, mode='lut')
+    assert (mask == mask_lut).all()
+    assert err_meters(gcj02, gcj02_lut).max() < GCJ02_LUT_ERR
+
+    wgs84, _ = gcj02_to_wgs84_batch(*gcj02)
+    wgs84_lut, _ = gcj02_to_wgs84_batch(*gcj02, mode='lut')
+    assert err_meters(wgs84, wgs84_lut).max() < GCJ02_LUT_ERR
+
+    out = np.empty((2,) + lat.shape)
+    with pytest.raises(ValueError):
+        fwd.apply(lat, lng, out, mask=mask[:10])
+
+def test_lut_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(lut, 'cache', {})
+    for d, lat0 in ('a', 39), ('b', 40):
+        OffsetLUT.build(_wgs84_to_gcj02_grid, (lat0, 104, lat0 + 0.5, 104.5),
+                        GCJ02_LUT_STEPS, f=tmp_path / d / 'wgs84_to_gcj02.npy')
+    # each dir has its own cache entry
+    assert lut.get_gcj02_lut(lut_dir=tmp_path / 'a').origin == (39, 104)
+    assert lut.get_gcj02_lut(lut_dir=tmp_path / 'b').origin == (40, 104)
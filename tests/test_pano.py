@@ -0,0 +1,266 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+from geosys.pano import (
+    CanvasSlots, as_image, get_tile_grid, stitch_slot, encode_slot, align)
+
+def make_tile(color, w=16, fmt='PNG'):
+    buf = BytesIO()
+    Image.new('RGB', (w, w), color).save(buf, fmt)
+    return buf.getvalue()
+
+def test_stitch_slot(tmp_path):
+    w = 16
+    size = align(40, w), align(20, w)
+    grid = get_tile_grid(*size, tile_w=w)
+    assert grid == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+    colors = [(i * 40, 255 - i * 40, 7) for i in range(len(grid))]
+    tiles = [make_tile(i) for i in colors]
+
+    with CanvasSlots(size, 1, root=tmp_path) as slots:
+        slot, shape = slots.free.get_nowait(), slots.shape
+        for real_size in (40, 20), (48, 32), (40, 20):
+            f = tmp_path / 'pano{}.png'.format(real_size[0])
+            assert stitch_slot(slot, shape, tiles, grid, f, tile_w=w)
+            assert encode_slot(slot, shape, real_size, f)
+            img = np.asarray(Image.open(f))
+            assert img.shape == real_size[::-1] + (3,)
+            for (ti, pi), c in zip(grid, colors):
+                if ti * w < real_size[1] and pi * w < real_size[0]:
+                    assert tuple(img[ti * w, pi * w]) == c
+
+        f = tmp_path / 'pano.jpg'
+        assert encode_slot(slot, shape, (40, 20), f)
+        assert Image.open(f).size == (40, 20)
+        for bad in None, b'x', make_tile(0, 8):
+            assert not stitch_slot(slot, shape, tiles[:-1] + [bad], grid, f, w)
+    assert list(tmp_path.glob('geosys-canvas-*')) == []
+
+def test_as_image():
+    buf = np.zeros((4, 6, 4), np.uint8)
+    img = as_image(buf, (3, 2))
+    img.paste(Image.new('RGB', (2, 2), (255, 0, 0)), (1, 1))
+    assert img.size == (3, 2)
+    # clipped to the crop, the rows below it are untouched
+    assert tuple(buf[1, 2, :3]) == (255, 0, 0)
+    assert buf[2].sum() == 0 and buf[:, 3].sum() == 0
+
+def test_tile_archive(tmp_path):
+    from geosys.pano import TileArchive, save_tile_archive
+    w = 16
+    size, real_size = (48, 32), (40, 20)
+    grid = get_tile_grid(*size, tile_w=w)
+    colors = [(i * 40, 255 - i * 40, 7) for i in range(len(grid))]
+    tiles = [make_tile(i) for i in colors]
+    f = tmp_path / 'pano.tiles'
+    assert save_tile_archive(tiles, grid, size, real_size, f, zoom=3, tile_w=w)
+    assert not save_tile_archive(tiles[:-1] + [make_tile(0, 8)], grid, size,
+                                 real_size, tmp_path / 'bad.tiles', 3, w)
+    assert not (tmp_path / 'bad.tiles').exists()
+
+    with TileArchive(f) as ar:
+        assert ar.meta['real_size'] == list(real_size) and ar.zooms == [3]
+        # the bytes as downloaded
+        assert [bytes(ar.tile(*i)) for i in grid] == tiles
+        assert ar.tile(5, 5) is None and ar.tile(0, 0, zoom=2) is None
+        img = np.asarray(ar.region())
+        assert img.shape == (20, 40, 3)
+        assert tuple(img[16, 32]) == colors[5]
+        img = np.asarray(ar.region((10, 10, 20, 20)))
+        assert tuple(img[0, 0]) == colors[0] and tuple(img[9, 9]) == colors[4]
+
+    f.write_bytes(b'nope')
+    with pytest.raises(ValueError):
+        TileArchive(f)
+
+def load_download_map_pano():
+    import importlib.util
+    from pathlib import Path
+    f = Path(__file__).parents[1] / 'scripts' / 'download_map_pano.py'
+    spec = importlib.util.spec_from_file_location('download_map_pano', f)
+    dmp = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dmp)
+    return dmp
+
+def test_download_pipeline(tmp_path):
+    import asyncio
+    from geosys.standin import StandInServer
+    from geosys.pano import TileArchive
+    dmp = load_download_map_pano()
+
+    pids = ['10011049160219135739400', '10011059150713114528300', 'missing']
+    with StandInServer() as srv:
+        mpd = dmp.QMapPanoDownloader(3)
+        mpd.url = srv.templates()['QMAP_PANO_IMG_URL']
+        for fmt, workers in ('jpg', 0), ('jpg', 1), ('tiles', 1):
+            out = tmp_path / f'{fmt}{workers}'
+            out.mkdir()
+            asyncio.run(dmp.download_panos(
+                mpd, pids, out, 3, 8, 4, 2, fmt=fmt, stitch_workers=workers,
+                encode_workers=workers))
+            fs = sorted(out.glob('*.' + fmt))
+            assert [i.name for i in fs] == [i + '.' + fmt for i in pids[:2]]
+            if fmt == 'jpg':
+                assert Image.open(fs[0]).size == (4096, 2048)
+            else:
+                with TileArchive(fs[0]) as ar:
+                    assert ar.meta['real_size'] == [4096, 2048]
+
+def test_tile_manifest(tmp_path):
+    from geosys.pano import TileManifest, PartialTiles
+    with TileManifest(tmp_path, 10) as m:
+        m.set_tile('a', 3)
+        m.set_tile('a', 9)
+        m.set_done('b')
+        for i in range(2000):  # grows the bits file
+            m.set_tile(f'p{i}', i % 10)
+    with TileManifest(tmp_path, 10) as m:
+        assert m.tiles('a') == [3, 9] and not m.is_done('a')
+        assert m.is_done('b') and m.tiles('b') == [] and m.tiles('c') == []
+        assert m.has_tile('p1999', 9) and not m.has_tile('p1999', 8)
+        assert m.done_mask(['b', 'c', 'a']).tolist() == [True, False, False]
+        m.clear_done('b')
+        m.clear_done('c')
+        assert not m.is_done('b') and not m.is_done('c')
+        assert m.has_tile('p1999', 9)
+    with pytest.raises(ValueError):
+        TileManifest(tmp_path, 12)
+
+    parts = PartialTiles(tmp_path / 'parts')
+    parts.append('a', 3, b'xyz')
+    parts.append('a', 9, b'uv')
+    parts.close_all()
+    f = parts.path('a')
+    f.write_bytes(f.read_bytes() + parts.record.pack(4, 10) + b'cut')
+    assert parts.load('a') == {3: b'xyz', 9: b'uv'}
+    parts.remove('a')
+    assert parts.load('a') == {}
+
+def test_download_resume(tmp_path, monkeypatch):
+    import asyncio
+    from functools import partial
+    from geosys.standin import StandInServer
+    from geosys.http_ import AsyncFetcher
+    from geosys.utils import request_retry
+    dmp = load_download_map_pano()
+    fetched, fail = [], ['x=7']
+
+    def fetch(url):
+        fetched.append(url)
+        if any(i in url for i in fail):
+            return
+        return request_retry(url)
+    monkeypatch.setattr(dmp, 'AsyncFetcher', partial(AsyncFetcher, fetch))
+
+    pids = ['10011049160219135739400', '10011059150713114528300']
+    with StandInServer() as srv:
+        mpd = dmp.QMapPanoDownloader(3)
+        mpd.url = srv.templates()['QMAP_PANO_IMG_URL']
+
+        def run():
+            fetched.clear()
+            asyncio.run(dmp.download_panos(mpd, pids, tmp_path, 3, 8, 4, 2))
+        run()
+        assert len(fetched) == 64 and list(tmp_path.glob('*.jpg')) == []
+        fail.clear()
+        run()
+        # only the 4 rows of pan 7 of each pano are fetched again
+        assert len(fetched) == 8 and all('x=7' in i for i in fetched)
+        assert len(list(tmp_path.glob('*.jpg'))) == 2
+        assert list((tmp_path / '.resume' / 'jpg_z3' / 'parts').iterdir()) == []
+        run()
+        assert fetched == []
+
+def test_download_levels(tmp_path, monkeypatch):
+    import asyncio
+    from functools import partial
+    from geosys.standin import StandInServer
+    from geosys.http_ import AsyncFetcher
+    from geosys.pano import pano_size, TileArchive
+    from geosys.utils import request_retry
+    assert pano_size(8192, 5) == pano_size(8192, 4) == (8192, 4096)
+    assert pano_size(13312, 1) == (832, 416)
+
+    dmp = load_download_map_pano()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return request_retry(url)
+    monkeypatch.setattr(dmp, 'AsyncFetcher', partial(AsyncFetcher, fetch))
+    pid = '10011049160219135739400'
+    with StandInServer() as srv:
+        mpd = dmp.QMapPanoDownloader(3)
+        mpd.url = srv.templates()['QMAP_PANO_IMG_URL']
+        for fmt in 'jpg', 'tiles':
+            out = tmp_path / fmt
+            out.mkdir()
+            fetched.clear()
+            # qmap can not fetch below zoom 3, the levels are made locally
+            asyncio.run(dmp.download_panos(
+                mpd, [pid], out, 3, 8, 4, 2, fmt=fmt, stitch_workers=1,
+                encode_workers=1, levels=[0, 2, 1]))
+            assert len(fetched) == 32
+            for z, size in (0, (512, 256)), (1, (1024, 512)), (2, (2048, 1024)):
+                assert Image.open(out / f'z{z}' / f'{pid}.jpg').size == size
+            if fmt == 'jpg':
+                full = np.asarray(Image.open(out / f'{pid}.jpg'), float)
+                small = np.asarray(Image.open(out / 'z2' / f'{pid}.jpg'), float)
+                box = full.reshape(1024, 2, 2048, 2, 3).mean(axis=(1, 3))
+                # both went through jpeg once
+                assert np.abs(small - box).mean() < 5
+            else:
+                with TileArchive(out / f'{pid}.tiles') as ar:
+                    assert ar.meta['real_size'] == [4096, 2048]
+
+def test_download_by_id(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from geosys import http_
+    from geosys.standin import StandInServer
+    dmp = load_download_map_pano()
+    monkeypatch.setitem(http_.cache, 'limiter', None)
+    monkeypatch.setitem(http_.cache, 'responses', None)
+    pid = '10011049160219135739400'
+    with StandInServer() as srv:
+        monkeypatch.setattr(dmp, 'QMAP_PANO_IMG_URL',
+                            srv.templates()['QMAP_PANO_IMG_URL'])
+        # single id mode with the default --resume
+        res = CliRunner().invoke(dmp.main, [
+            pid, '-o', str(tmp_path), '-z', '3', '-q',
+            '--stitch_workers', '0', '--encode_workers', '0'])
+    assert res.exit_code == 0, res.output
+    assert Image.open(tmp_path / f'{pid}.jpg').size == (4096, 2048)
+
+def test_download_resume_outputs(tmp_path, monkeypatch):
+    import asyncio
+    from functools import partial
+    from geosys.standin import StandInServer
+    from geosys.http_ import AsyncFetcher
+    from geosys.utils import request_retry
+    dmp = load_download_map_pano()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return request_retry(url)
+    monkeypatch.setattr(dmp, 'AsyncFetcher', partial(AsyncFetcher, fetch))
+    pid = '10011049160219135739400'
+    with StandInServer() as srv:
+        mpd = dmp.QMapPanoDownloader(3)
+        mpd.url = srv.templates()['QMAP_PANO_IMG_URL']
+
+        def run(fmt):
+            fetched.clear()
+            asyncio.run(dmp.download_panos(mpd, [pid], tmp_path, 3, 8, 4, 2,
+                                           fmt=fmt))
+        run('jpg')
+        # the jpg run does not count as done for another fmt
+        run('tiles')
+        assert (tmp_path / f'{pid}.tiles').exists() and len(fetched) == 32
+        run('jpg')
+        assert fetched == []
+        # nor does a done pano whose output was removed
+        (tmp_path / f'{pid}.jpg').unlink()
+        run('jpg')
+        assert (tmp_path / f'{pid}.jpg').exists() and len(fetched) == 32
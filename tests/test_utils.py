@@ -0,0 +1,28 @@
+from pathlib import Path
+from geosys.utils import fix_xml_error, parse_data
+from geosys.io_ import load_xml
+
+cur_d = Path(__file__).parent
+pano_cache = cur_d.parent / 'samples/data/pano_cache'
+
+def test_fix_xml_error():
+    s = 'a & b &amp; &lt;&gt; &apos;&quot; &#23433; &#x5b89; &nbsp &a.b+ &'
+    fixed = ('a &amp; b &amp; &lt;&gt; &apos;&quot; &#23433; &#x5b89; '
+             '&amp;nbsp &amp;a.b+ &amp;')
+    assert fix_xml_error(s) == fixed
+    assert fix_xml_error(s.encode()) == fixed.encode()
+
+def test_parse_data():
+    f = pano_cache / '10011049160219135739400.xml'
+    bs = f.read_bytes()
+    ref = load_xml(f)
+    raw = bs.replace(b'name="', b'name="A&B+ ')
+    xml = parse_data(raw)
+    assert len(xml.findall('.//*')) == len(ref.findall('.//*'))
+    assert xml.find('.//*[@name]').get('name').startswith('A&B+ ')
+    assert load_xml(f, fix_err=True).find('.//*[@name]').get('name') == \
+        ref.find('.//*[@name]').get('name')
+
+    assert parse_data(b'cb({"a": [1, 2]});', 'http://x/?cb=cb') == {'a': [1, 2]}
+    assert parse_data(b'{"a": "\xff\xe5\xae\x89"}') == {'a': '安'}
+    assert parse_data(b'') is None